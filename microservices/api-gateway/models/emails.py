@@ -1,6 +1,6 @@
 
 
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, conlist
 from typing import List, Optional
 from datetime import datetime
 
@@ -19,6 +19,10 @@ class EmailForwardRequest(BaseModel):
     cc: Optional[List[str]] = None
     bcc: Optional[List[str]] = None
 
+class EmailBulkRequest(BaseModel):
+    email_ids: conlist(str, min_items=1, max_items=1000)
+    action: str
+
 class EmailSendRequest(BaseModel):
     to: List[str]
     subject: str
@@ -38,3 +42,4 @@ class EmailSearchRequest(BaseModel):
     to_date: Optional[str] = None
     labels: Optional[List[str]] = None
     read: Optional[bool] = None
+    sort: Optional[str] = None
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, Request, HTTPException, Query, Header
+from fastapi import APIRouter, Request, HTTPException, Query, Header, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import List, Optional
 import httpx
 import os
@@ -9,7 +10,8 @@ from models.emails import (
     EmailForwardRequest,
     EmailSendRequest,
     EmailUpdateRequest,
-    EmailSearchRequest
+    EmailSearchRequest,
+    EmailBulkRequest
     )
 
 
@@ -84,6 +86,8 @@ async def get_emails(
     sender: Optional[str] = Query(None),
     subject: Optional[str] = Query(None),
     type: Optional[str] = Query(None),  # ✅ Add this
+    cursor: Optional[str] = Query(None),
+    include_body: bool = Query(False),
     auth_data = Depends(verify_token_with_user_service)
 ):
     """Proxy: Get emails for current user with filtering and pagination"""
@@ -103,6 +107,10 @@ async def get_emails(
             params["subject"] = subject
         if type:  # ✅ forward type
             params["type"] = type
+        if cursor:
+            params["cursor"] = cursor
+        if include_body:
+            params["include_body"] = include_body
 
         async with httpx.AsyncClient() as client:
             response = await client.get(
@@ -119,6 +127,120 @@ async def get_emails(
         raise HTTPException(status_code=503, detail=f"Email service unavailable: {str(exc)}")
 
 
+# 2b. LIST CONVERSATION THREADS (declared before /{email_id} so "threads" is not taken as an id)
+@router.get("/threads")
+async def get_threads(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
+    label: Optional[str] = Query(None),
+    type: Optional[str] = Query(None),
+    auth_data = Depends(verify_token_with_user_service)
+):
+    """Proxy: Get conversation threads for current user, newest first"""
+    user_data, token = auth_data
+
+    try:
+        headers = await get_forwarded_headers(token)
+        params = {"limit": limit}
+        if cursor:
+            params["cursor"] = cursor
+        if label:
+            params["label"] = label
+        if type:
+            params["type"] = type
+
+        async with httpx.AsyncClient() as client:
+            response = await client.get(
+                f"{EMAIL_SERVICE_URL}/emails/threads",
+                headers=headers,
+                params=params
+            )
+            response.raise_for_status()
+            return response.json()
+
+    except httpx.HTTPStatusError as exc:
+        raise HTTPException(status_code=exc.response.status_code, detail=exc.response.text)
+    except httpx.RequestError as exc:
+        raise HTTPException(status_code=503, detail=f"Email service unavailable: {str(exc)}")
+
+
+# 2c. CHANGE FEED (only what changed since the client's token; also declared before /{email_id})
+@router.get("/changes")
+async def get_email_changes(
+    since: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=500),
+    auth_data = Depends(verify_token_with_user_service)
+):
+    """Proxy: Get emails changed or deleted since a change token"""
+    user_data, token = auth_data
+
+    try:
+        headers = await get_forwarded_headers(token)
+        params = {"limit": limit}
+        if since:
+            params["since"] = since
+
+        async with httpx.AsyncClient() as client:
+            response = await client.get(
+                f"{EMAIL_SERVICE_URL}/emails/changes",
+                headers=headers,
+                params=params
+            )
+            response.raise_for_status()
+            return response.json()
+
+    except httpx.HTTPStatusError as exc:
+        raise HTTPException(status_code=exc.response.status_code, detail=exc.response.text)
+    except httpx.RequestError as exc:
+        raise HTTPException(status_code=503, detail=f"Email service unavailable: {str(exc)}")
+
+
+# 2d. LIVE EVENT STREAM (server-sent events, relayed chunk by chunk without buffering)
+@router.get("/stream")
+async def stream_email_events(
+    last_event_id: Optional[str] = Header(None),
+    auth_data = Depends(verify_token_with_user_service)
+):
+    """Proxy: Server-sent events for the current user's mailbox"""
+    user_data, token = auth_data
+
+    headers = await get_forwarded_headers(token)
+    headers["Accept"] = "text/event-stream"
+    if last_event_id:
+        headers["Last-Event-ID"] = last_event_id
+
+    # No read timeout: the stream stays open and only heartbeats flow while the mailbox is idle
+    client = httpx.AsyncClient(timeout=httpx.Timeout(None, connect=10.0))
+    try:
+        response = await client.send(
+            client.build_request("GET", f"{EMAIL_SERVICE_URL}/emails/stream", headers=headers),
+            stream=True
+        )
+    except httpx.RequestError as exc:
+        await client.aclose()
+        raise HTTPException(status_code=503, detail=f"Email service unavailable: {str(exc)}")
+
+    if response.status_code != 200:
+        detail = (await response.aread()).decode(errors="replace")
+        await response.aclose()
+        await client.aclose()
+        raise HTTPException(status_code=response.status_code, detail=detail)
+
+    async def relay():
+        try:
+            async for chunk in response.aiter_raw():
+                yield chunk
+        finally:
+            await response.aclose()
+            await client.aclose()
+
+    return StreamingResponse(
+        relay(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 # 3. GET SINGLE EMAIL
 @router.get("/{email_id}")
 async def get_single_email(email_id: str, auth_data = Depends(verify_token_with_user_service)):
@@ -143,6 +265,7 @@ async def get_single_email(email_id: str, auth_data = Depends(verify_token_with_
 @router.post("/send")
 async def send_email(
     email_request: EmailSendRequest,
+    idempotency_key: Optional[str] = Header(None),
     auth_data = Depends(verify_token_with_user_service)
 ):
     """Proxy: Send an email via the email service"""
@@ -150,6 +273,8 @@ async def send_email(
     
     try:
         headers = await get_forwarded_headers(token)
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
         async with httpx.AsyncClient() as client:
             response = await client.post(
                 f"{EMAIL_SERVICE_URL}/emails/send",
@@ -157,7 +282,8 @@ async def send_email(
                 json=email_request.dict()
             )
             response.raise_for_status()
-            return response.json()
+            # 202 Accepted with the outbox status handle
+            return JSONResponse(status_code=response.status_code, content=response.json())
     except httpx.HTTPStatusError as exc:
         raise HTTPException(status_code=exc.response.status_code, detail=exc.response.text)
     except httpx.RequestError as exc:
@@ -168,6 +294,7 @@ async def send_email(
 async def reply_to_email(
     email_id: str,
     reply_request: EmailReplyRequest,
+    idempotency_key: Optional[str] = Header(None),
     auth_data = Depends(verify_token_with_user_service)
 ):
     """Proxy: Reply to an email"""
@@ -175,6 +302,8 @@ async def reply_to_email(
     
     try:
         headers = await get_forwarded_headers(token)
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
         async with httpx.AsyncClient() as client:
             response = await client.post(
                 f"{EMAIL_SERVICE_URL}/emails/{email_id}/reply",
@@ -182,7 +311,8 @@ async def reply_to_email(
                 json=reply_request.dict()
             )
             response.raise_for_status()
-            return response.json()
+            # 202 Accepted with the outbox status handle
+            return JSONResponse(status_code=response.status_code, content=response.json())
     except httpx.HTTPStatusError as exc:
         raise HTTPException(status_code=exc.response.status_code, detail=exc.response.text)
     except httpx.RequestError as exc:
@@ -193,6 +323,7 @@ async def reply_to_email(
 async def forward_email(
     email_id: str,
     forward_request: EmailForwardRequest,
+    idempotency_key: Optional[str] = Header(None),
     auth_data = Depends(verify_token_with_user_service)
 ):
     """Proxy: Forward an email"""
@@ -200,6 +331,8 @@ async def forward_email(
     
     try:
         headers = await get_forwarded_headers(token)
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
         async with httpx.AsyncClient() as client:
             response = await client.post(
                 f"{EMAIL_SERVICE_URL}/emails/{email_id}/forward",
@@ -207,6 +340,30 @@ async def forward_email(
                 json=forward_request.dict()
             )
             response.raise_for_status()
+            # 202 Accepted with the outbox status handle
+            return JSONResponse(status_code=response.status_code, content=response.json())
+    except httpx.HTTPStatusError as exc:
+        raise HTTPException(status_code=exc.response.status_code, detail=exc.response.text)
+    except httpx.RequestError as exc:
+        raise HTTPException(status_code=503, detail=f"Email service unavailable: {str(exc)}")
+
+# 6b. OUTBOUND EMAIL STATUS (poll the handle returned by send, reply and forward)
+@router.get("/outbox/{outbox_id}")
+async def get_outbox_status(
+    outbox_id: str,
+    auth_data = Depends(verify_token_with_user_service)
+):
+    """Proxy: Get the delivery status of a queued outbound email"""
+    user_data, token = auth_data
+
+    try:
+        headers = await get_forwarded_headers(token)
+        async with httpx.AsyncClient() as client:
+            response = await client.get(
+                f"{EMAIL_SERVICE_URL}/emails/outbox/{outbox_id}",
+                headers=headers
+            )
+            response.raise_for_status()
             return response.json()
     except httpx.HTTPStatusError as exc:
         raise HTTPException(status_code=exc.response.status_code, detail=exc.response.text)
@@ -318,12 +475,34 @@ async def move_email_to_trash(email_id: str, auth_data = Depends(verify_token_wi
     except httpx.RequestError as exc:
         raise HTTPException(status_code=503, detail=f"Email service unavailable: {str(exc)}")
 
+# 11b. BULK MARK READ/UNREAD, TRASH OR DELETE
+@router.post("/bulk")
+async def bulk_update_emails(bulk_request: EmailBulkRequest, auth_data = Depends(verify_token_with_user_service)):
+    """Proxy: Apply one action to many emails, with a result per email"""
+    user_data, token = auth_data
+    
+    try:
+        headers = await get_forwarded_headers(token)
+        async with httpx.AsyncClient(timeout=60.0) as client:
+            response = await client.post(
+                f"{EMAIL_SERVICE_URL}/emails/bulk",
+                headers=headers,
+                json=bulk_request.dict()
+            )
+            response.raise_for_status()
+            return response.json()
+    except httpx.HTTPStatusError as exc:
+        raise HTTPException(status_code=exc.response.status_code, detail=exc.response.text)
+    except httpx.RequestError as exc:
+        raise HTTPException(status_code=503, detail=f"Email service unavailable: {str(exc)}")
+
 # 12. SEARCH EMAILS (FIXED - Now uses Pydantic model)
 @router.post("/search")
 async def search_emails(
     search_request: EmailSearchRequest,
     skip: int = Query(0, ge=0),
     limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
     auth_data = Depends(verify_token_with_user_service)
 ):
     """Proxy: Advanced email search with pagination"""
@@ -335,6 +514,8 @@ async def search_emails(
             "skip": skip,
             "limit": limit
         }
+        if cursor:
+            params["cursor"] = cursor
         async with httpx.AsyncClient() as client:
             response = await client.post(
                 f"{EMAIL_SERVICE_URL}/emails/search",
@@ -369,7 +550,111 @@ async def get_email_stats(auth_data = Depends(verify_token_with_user_service)):
     except httpx.RequestError as exc:
         raise HTTPException(status_code=503, detail=f"Email service unavailable: {str(exc)}")
 
-# 14. TEST GMAIL CONNECTION
+# 14. START MAILBOX BACKFILL
+@router.post("/backfill", status_code=202)
+async def start_mailbox_backfill(
+    restart: bool = Query(False),
+    auth_data = Depends(verify_token_with_user_service)
+):
+    """Proxy: Start importing the user's whole mailbox in the background"""
+    user_data, token = auth_data
+    
+    try:
+        headers = await get_forwarded_headers(token)
+        async with httpx.AsyncClient() as client:
+            response = await client.post(
+                f"{EMAIL_SERVICE_URL}/emails/backfill",
+                headers=headers,
+                params={"restart": restart}
+            )
+            response.raise_for_status()
+            return response.json()
+    except httpx.HTTPStatusError as exc:
+        raise HTTPException(status_code=exc.response.status_code, detail=exc.response.text)
+    except httpx.RequestError as exc:
+        raise HTTPException(status_code=503, detail=f"Email service unavailable: {str(exc)}")
+
+# 15. MAILBOX BACKFILL STATUS
+@router.get("/backfill/status")
+async def get_mailbox_backfill_status(auth_data = Depends(verify_token_with_user_service)):
+    """Proxy: Get progress of the user's mailbox backfill job"""
+    user_data, token = auth_data
+    
+    try:
+        headers = await get_forwarded_headers(token)
+        async with httpx.AsyncClient() as client:
+            response = await client.get(
+                f"{EMAIL_SERVICE_URL}/emails/backfill/status",
+                headers=headers
+            )
+            response.raise_for_status()
+            return response.json()
+    except httpx.HTTPStatusError as exc:
+        raise HTTPException(status_code=exc.response.status_code, detail=exc.response.text)
+    except httpx.RequestError as exc:
+        raise HTTPException(status_code=503, detail=f"Email service unavailable: {str(exc)}")
+
+# 16. DOWNLOAD ATTACHMENT (streamed through; Range and If-None-Match are passed on)
+@router.get("/{email_id}/attachments/{attachment_id}")
+async def download_attachment(
+    email_id: str,
+    attachment_id: str,
+    range_header: Optional[str] = Header(None, alias="range"),
+    if_none_match: Optional[str] = Header(None),
+    auth_data = Depends(verify_token_with_user_service)
+):
+    """Proxy: Download an email attachment"""
+    user_data, token = auth_data
+
+    headers = await get_forwarded_headers(token)
+    if range_header:
+        headers["Range"] = range_header
+    if if_none_match:
+        headers["If-None-Match"] = if_none_match
+
+    client = httpx.AsyncClient(timeout=60.0)
+    try:
+        response = await client.send(
+            client.build_request(
+                "GET", f"{EMAIL_SERVICE_URL}/emails/{email_id}/attachments/{attachment_id}", headers=headers
+            ),
+            stream=True
+        )
+    except httpx.RequestError as exc:
+        await client.aclose()
+        raise HTTPException(status_code=503, detail=f"Email service unavailable: {str(exc)}")
+
+    # 304 and 416 carry no body but are answers, not errors
+    if response.status_code >= 400 and response.status_code != 416:
+        detail = (await response.aread()).decode(errors="replace")
+        await response.aclose()
+        await client.aclose()
+        raise HTTPException(status_code=response.status_code, detail=detail)
+
+    forwarded = {
+        key: value for key, value in response.headers.items()
+        if key.lower() in (
+            "content-disposition", "content-length", "content-range", "accept-ranges",
+            "etag", "last-modified", "cache-control"
+        )
+    }
+
+    async def relay():
+        try:
+            async for chunk in response.aiter_raw():
+                yield chunk
+        finally:
+            await response.aclose()
+            await client.aclose()
+
+    return StreamingResponse(
+        relay(),
+        status_code=response.status_code,
+        media_type=response.headers.get("content-type", "application/octet-stream"),
+        headers=forwarded
+    )
+
+# 17. TEST GMAIL CONNECTION
 @router.get("/test-gmail-connection")
 async def test_gmail_connection(auth_data = Depends(verify_token_with_user_service)):
     """Proxy: Test Gmail API connection for debugging"""
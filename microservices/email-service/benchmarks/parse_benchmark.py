@@ -0,0 +1,143 @@
+"""
+Header extraction benchmark: per-header list scans (old _parse_email_message) vs the
+single-pass header map (header_map + rfc_headers_from).
+
+Only header extraction is timed; body, attachment and snippet handling are the same on
+both sides and left out. Runs over a recorded corpus of Gmail payloads (one
+messages.get(format='full') response per line) or, without one, a synthetic corpus with
+realistic header counts. Imports only services.message_parsing, so no MongoDB or Gmail
+access is needed:
+
+    python benchmarks/parse_benchmark.py --corpus recorded_messages.jsonl
+    python benchmarks/parse_benchmark.py --messages 20000
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.message_parsing import header_map, rfc_headers_from  # noqa: E402
+
+# Transport headers a real Gmail message carries alongside the ones we read
+TRANSPORT_HEADERS = [
+    "Delivered-To", "Received", "X-Google-Smtp-Source", "X-Received", "ARC-Seal",
+    "ARC-Message-Signature", "ARC-Authentication-Results", "Return-Path", "Received-SPF",
+    "Authentication-Results", "DKIM-Signature", "X-Gm-Message-State", "MIME-Version",
+    "Content-Type", "List-Unsubscribe", "X-Mailer", "Feedback-ID"
+]
+
+
+def make_message(i: int) -> dict:
+    headers = [{"name": name, "value": f"value-{random.getrandbits(64):x}"}
+               for name in random.choices(TRANSPORT_HEADERS, k=random.randint(15, 30))]
+    headers += [
+        {"name": "From", "value": f"Sender {i % 50} <sender{i % 50}@example.com>"},
+        {"name": "To", "value": "Me <me@example.com>, team@example.com"},
+        {"name": "Subject", "value": f"Synthetic message {i}"},
+        {"name": "Date", "value": "Mon, 01 Jan 2024 10:00:00 +0000"},
+        {"name": "Message-ID", "value": f"<{i}@example.com>"},
+    ]
+    if i % 3 == 0:
+        headers.append({"name": "In-Reply-To", "value": f"<{i - 1}@example.com>"})
+        headers.append({"name": "References", "value": f"<{i - 2}@example.com> <{i - 1}@example.com>"})
+    random.shuffle(headers)
+
+    body = base64.urlsafe_b64encode(b"Hello from the benchmark. " * 20).decode()
+    return {
+        "id": f"{i:016x}",
+        "threadId": f"{i // 4:016x}",
+        "labelIds": ["INBOX", "UNREAD"],
+        "snippet": "Hello from the benchmark.",
+        "internalDate": "1704103200000",
+        "payload": {
+            "mimeType": "multipart/alternative",
+            "headers": headers,
+            "parts": [{"mimeType": "text/plain", "body": {"data": body}}]
+        }
+    }
+
+
+def legacy_headers(msg: dict) -> dict:
+    """Header extraction as _parse_email_message did it: one list scan per header"""
+    headers = msg['payload']['headers']
+    sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown')
+    return {
+        "subject": next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject'),
+        "sender": sender,
+        "to": next((h['value'] for h in headers if h['name'].lower() == 'to'), ''),
+        "headers": {
+            "from": sender,
+            "to": next((h['value'] for h in headers if h['name'].lower() == 'to'), ''),
+            "cc": next((h['value'] for h in headers if h['name'].lower() == 'cc'), ''),
+            "date": next((h['value'] for h in headers if h['name'].lower() == 'date'), ''),
+            "message_id": next((h['value'] for h in headers if h['name'].lower() == 'message-id'), ''),
+            "references": next((h['value'] for h in headers if h['name'].lower() == 'references'), ''),
+            "in_reply_to": next((h['value'] for h in headers if h['name'].lower() == 'in-reply-to'), '')
+        }
+    }
+
+
+def current_headers(msg: dict) -> dict:
+    """Header extraction as _parse_email_message does it now: one pass into a map"""
+    headers = header_map(msg['payload'].get('headers'))
+    sender = headers.get('from', 'Unknown')
+    return {
+        "subject": headers.get('subject', 'No Subject'),
+        "sender": sender,
+        "to": headers.get('to', ''),
+        "headers": rfc_headers_from(headers, sender)
+    }
+
+
+def load_corpus(path: str) -> list:
+    with open(path) as corpus:
+        return [json.loads(line) for line in corpus if line.strip()]
+
+
+def throughput(parse, corpus: list, runs: int) -> float:
+    """Median messages parsed per second"""
+    rates = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        for msg in corpus:
+            parse(msg)
+        rates.append(len(corpus) / (time.perf_counter() - start))
+    return statistics.median(rates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="JSON lines file of recorded Gmail messages (format=full)")
+    parser.add_argument("--messages", type=int, default=10_000, help="synthetic corpus size")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.corpus:
+        corpus = load_corpus(args.corpus)
+    else:
+        random.seed(42)
+        corpus = [make_message(i) for i in range(args.messages)]
+
+    # Both paths must agree before their speed is worth comparing
+    for msg in corpus[:100]:
+        assert current_headers(msg) == legacy_headers(msg)
+
+    avg_headers = statistics.mean(len(msg['payload'].get('headers', [])) for msg in corpus)
+    print(f"{len(corpus)} messages, {avg_headers:.1f} headers on average\n")
+
+    legacy_rate = throughput(legacy_headers, corpus, args.runs)
+    current_rate = throughput(current_headers, corpus, args.runs)
+    print(f"{'header extraction':<24}{'messages/s':>14}")
+    print(f"{'per-header scans':<24}{legacy_rate:>14.0f}")
+    print(f"{'single-pass map':<24}{current_rate:>14.0f}")
+    print(f"\nspeedup: {current_rate / legacy_rate:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Search benchmark: unanchored $regex (old query shape) vs the per-user text index.
+
+Loads a synthetic mailbox into a scratch database and times the same searches with
+both query shapes. Needs a reachable MongoDB:
+
+    MONGO_URI=mongodb://localhost:27017 python benchmarks/search_benchmark.py --emails 100000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.email_service import email_service  # noqa: E402
+from services.body_store import body_terms  # noqa: E402
+
+WORDS = (
+    "invoice meeting project deadline report budget review contract schedule update "
+    "travel flight hotel booking receipt payment order shipping delivery account "
+    "password security alert newsletter webinar discount offer team lunch quarterly "
+    "roadmap release bug feature customer support ticket feedback survey launch"
+).split()
+SENDERS = [f"{name}@{domain}" for name in ("alice", "bob", "carol", "dave", "erin", "frank")
+           for domain in ("example.com", "shop.example", "corp.example")]
+USER_ID = "benchmark-user"
+
+
+def make_email(i: int, now: datetime) -> dict:
+    subject = " ".join(random.choices(WORDS, k=6))
+    body = " ".join(random.choices(WORDS, k=random.randint(40, 400)))
+    return {
+        "user_id": USER_ID,
+        "message_id": f"bench-{i}",
+        "thread_id": f"bench-thread-{i // 4}",
+        "subject": subject,
+        "sender": random.choice(SENDERS),
+        "recipients": ["me@example.com"],
+        # The inline body only serves the old regex query shape; the service stores it apart
+        "body": body,
+        "body_terms": body_terms(body),
+        "snippet": body[:200],
+        "timestamp": now - timedelta(minutes=i),
+        "read": random.random() < 0.7,
+        "labels": ["INBOX"]
+    }
+
+
+def regex_query(text: str) -> dict:
+    """The query shape EmailService used before the text index"""
+    return {"user_id": USER_ID, "$or": [
+        {"subject": {"$regex": text, "$options": "i"}},
+        {"body": {"$regex": text, "$options": "i"}},
+        {"sender": {"$regex": text, "$options": "i"}}
+    ]}
+
+
+def time_query(collection, query: dict, limit: int, runs: int) -> list:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        list(collection.find(query, {"body": 0}).sort("timestamp", -1).limit(limit))
+        collection.count_documents(query)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=100_000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch database afterwards")
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    db = client["email_search_benchmark"]
+    collection = db["emails"]
+    collection.drop()
+
+    # Same indexes as db/mongodb.py
+    collection.create_index([("user_id", 1), ("timestamp", -1)])
+    collection.create_index(
+        [("user_id", 1), ("subject", "text"), ("sender", "text"), ("body_terms", "text")],
+        name="user_text_search",
+        weights={"subject": 5, "sender": 3, "body_terms": 1},
+        default_language="english"
+    )
+
+    random.seed(42)
+    now = datetime.utcnow()
+    print(f"Loading {args.emails} synthetic emails...")
+    start = time.perf_counter()
+    batch = []
+    for i in range(args.emails):
+        batch.append(make_email(i, now))
+        if len(batch) == 5000:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+    print(f"Loaded in {time.perf_counter() - start:.1f}s\n")
+
+    searches = ["invoice", "quarterly roadmap", "carol", "nonexistentterm"]
+    print(f"{'search':<20}{'regex median ms':>18}{'text median ms':>18}{'speedup':>10}")
+    for text in searches:
+        regex_ms = statistics.median(time_query(collection, regex_query(text), args.limit, args.runs))
+        text_query = email_service._build_search_query(USER_ID, {"query": text})
+        text_ms = statistics.median(time_query(collection, text_query, args.limit, args.runs))
+        print(f"{text:<20}{regex_ms:>18.1f}{text_ms:>18.1f}{regex_ms / text_ms:>9.1f}x")
+
+    if not args.keep:
+        client.drop_database("email_search_benchmark")
+
+
+if __name__ == "__main__":
+    main()
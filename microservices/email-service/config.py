@@ -11,9 +11,104 @@ class Settings(BaseSettings):
     
     # User service URL
     USER_SERVICE_URL: str = os.getenv("USER_SERVICE_URL", "http://user-service:8000")
+
+    # Pooled keep-alive connections to user-service, and how long fetched profiles are reused
+    USER_SERVICE_MAX_CONNECTIONS: int = int(os.getenv("USER_SERVICE_MAX_CONNECTIONS", "50"))
+    USER_SERVICE_KEEPALIVE_CONNECTIONS: int = int(os.getenv("USER_SERVICE_KEEPALIVE_CONNECTIONS", "20"))
+    PROFILE_CACHE_TTL: int = int(os.getenv("PROFILE_CACHE_TTL", "300"))
+    PROFILE_CACHE_MAX_USERS: int = int(os.getenv("PROFILE_CACHE_MAX_USERS", "10000"))
+
+    # JWTs are issued by user-service with this shared key; email-service verifies them locally
+    SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-for-development")
+    ALGORITHM: str = "HS256"
+    # Verified claims are reused for this long (never past the token's own expiry)
+    TOKEN_CACHE_TTL: int = int(os.getenv("TOKEN_CACHE_TTL", "60"))
+    TOKEN_CACHE_MAX_SIZE: int = int(os.getenv("TOKEN_CACHE_MAX_SIZE", "10000"))
+    # How often user-service is asked whether a user with a valid token still exists
+    TOKEN_REVOCATION_CHECK_INTERVAL: int = int(os.getenv("TOKEN_REVOCATION_CHECK_INTERVAL", "300"))
     
     # Email fetching settings
     EMAIL_FETCH_BATCH_SIZE: int = int(os.getenv("EMAIL_FETCH_BATCH_SIZE", "20"))
     EMAIL_FETCH_TIMEOUT: int = int(os.getenv("EMAIL_FETCH_TIMEOUT", "30"))
+    # "batch" groups message gets into Gmail batch HTTP requests, "serial" does one get per message
+    EMAIL_FETCH_MODE: str = os.getenv("EMAIL_FETCH_MODE", "batch")
+    # Gmail accepts up to 100 calls per batch, but recommends staying at 50 or below
+    GMAIL_BATCH_SIZE: int = int(os.getenv("GMAIL_BATCH_SIZE", "50"))
+    # Page size for users.history.list during incremental sync
+    GMAIL_HISTORY_PAGE_SIZE: int = int(os.getenv("GMAIL_HISTORY_PAGE_SIZE", "500"))
+
+    # Gmail quota: 250 units/s per user and 1,200,000 units/min per project by default.
+    # Rate-limit and transient errors are retried with full-jitter exponential backoff.
+    GMAIL_USER_QUOTA_PER_SECOND: int = int(os.getenv("GMAIL_USER_QUOTA_PER_SECOND", "250"))
+    GMAIL_PROJECT_QUOTA_PER_SECOND: int = int(os.getenv("GMAIL_PROJECT_QUOTA_PER_SECOND", "20000"))
+    GMAIL_MAX_RETRIES: int = int(os.getenv("GMAIL_MAX_RETRIES", "5"))
+    GMAIL_BACKOFF_BASE_SECONDS: float = float(os.getenv("GMAIL_BACKOFF_BASE_SECONDS", "1.0"))
+    GMAIL_BACKOFF_MAX_SECONDS: float = float(os.getenv("GMAIL_BACKOFF_MAX_SECONDS", "32.0"))
+
+    # Full-mailbox backfill settings (messages.list allows up to 500 ids per page)
+    BACKFILL_PAGE_SIZE: int = int(os.getenv("BACKFILL_PAGE_SIZE", "500"))
+    BACKFILL_CONCURRENCY: int = int(os.getenv("BACKFILL_CONCURRENCY", "2"))
+    BACKFILL_THROTTLE_SECONDS: int = int(os.getenv("BACKFILL_THROTTLE_SECONDS", "60"))
+
+    # Background sync of recently active users: poll intervals adapt between the min and max
+    # (seconds) to how often new mail arrives, with at most SYNC_WORKERS syncs at once
+    SYNC_SCHEDULER_ENABLED: bool = os.getenv("SYNC_SCHEDULER_ENABLED", "true").lower() == "true"
+    SYNC_WORKERS: int = int(os.getenv("SYNC_WORKERS", "4"))
+    SYNC_MIN_INTERVAL: int = int(os.getenv("SYNC_MIN_INTERVAL", "30"))
+    SYNC_MAX_INTERVAL: int = int(os.getenv("SYNC_MAX_INTERVAL", "600"))
+    SYNC_ACTIVE_WINDOW: int = int(os.getenv("SYNC_ACTIVE_WINDOW", "1800"))
+    # Share of the project's Gmail quota background syncs may use before they are deferred
+    SYNC_QUOTA_SHARE: float = float(os.getenv("SYNC_QUOTA_SHARE", "0.5"))
+    # A full resync (after Gmail's history expired) re-checks only mail from the last
+    # RESYNC_WINDOW_DAYS days; Gmail keeps history for at least a week
+    RESYNC_WINDOW_DAYS: int = int(os.getenv("RESYNC_WINDOW_DAYS", "7"))
+
+    # Read/unread/trash reach Gmail through a write-behind queue: changes are coalesced for
+    # LABEL_SYNC_DELAY_SECONDS, then flushed as batchModify calls; failed flushes retry up to
+    # LABEL_SYNC_MAX_ATTEMPTS times
+    LABEL_SYNC_DELAY_SECONDS: float = float(os.getenv("LABEL_SYNC_DELAY_SECONDS", "1.0"))
+    LABEL_SYNC_POLL_SECONDS: int = int(os.getenv("LABEL_SYNC_POLL_SECONDS", "30"))
+    LABEL_SYNC_MAX_ATTEMPTS: int = int(os.getenv("LABEL_SYNC_MAX_ATTEMPTS", "10"))
+
+    # Change feed tokens older than this (seconds) are refused; deletion tombstones expire with them
+    CHANGE_FEED_RETENTION_SECONDS: int = int(os.getenv("CHANGE_FEED_RETENTION_SECONDS", "604800"))
+
+    # Idle server-sent event streams send a heartbeat comment this often (seconds)
+    SSE_HEARTBEAT_SECONDS: int = int(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
+    # Outbound mail is queued and sent by OUTBOX_WORKERS workers, retried up to OUTBOX_MAX_ATTEMPTS
+    # times; finished jobs (and their idempotency keys) are kept for OUTBOX_RETENTION_SECONDS
+    OUTBOX_WORKERS: int = int(os.getenv("OUTBOX_WORKERS", "4"))
+    OUTBOX_MAX_ATTEMPTS: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+    OUTBOX_POLL_SECONDS: int = int(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+    OUTBOX_RETENTION_SECONDS: int = int(os.getenv("OUTBOX_RETENTION_SECONDS", "604800"))
+
+    # Downloaded attachments are cached on disk by content hash (LRU), up to ATTACHMENT_CACHE_MAX_BYTES
+    ATTACHMENT_CACHE_DIR: str = os.getenv("ATTACHMENT_CACHE_DIR", "/tmp/email-attachments")
+    ATTACHMENT_CACHE_MAX_BYTES: int = int(os.getenv("ATTACHMENT_CACHE_MAX_BYTES", "1073741824"))
+
+    # Built Gmail clients cached per user (LRU), refreshed when the OAuth token changes or expires
+    GMAIL_CLIENT_CACHE_SIZE: int = int(os.getenv("GMAIL_CLIENT_CACHE_SIZE", "256"))
+    GMAIL_CLIENT_CACHE_TTL: int = int(os.getenv("GMAIL_CLIENT_CACHE_TTL", "3000"))
+    # Directory with the vendored Gmail discovery document (defaults to ./discovery)
+    DISCOVERY_DOCUMENTS_DIR: str = os.getenv("DISCOVERY_DOCUMENTS_DIR", "")
+
+    # Mailbox totals for list/search responses are cached per user and filter set
+    EMAIL_COUNT_CACHE_TTL: int = int(os.getenv("EMAIL_COUNT_CACHE_TTL", "30"))
+    EMAIL_COUNT_CACHE_MAX_USERS: int = int(os.getenv("EMAIL_COUNT_CACHE_MAX_USERS", "10000"))
+
+    # Mailbox counters are updated incrementally and fully recomputed at most this often (seconds)
+    MAILBOX_COUNTERS_REBUILD_INTERVAL: int = int(os.getenv("MAILBOX_COUNTERS_REBUILD_INTERVAL", "3600"))
+
+    # Stored bodies are truncated to this many bytes of decoded text; attachments are never stored
+    MAX_BODY_BYTES: int = int(os.getenv("MAX_BODY_BYTES", "262144"))
+
+    # Bodies are stored zlib-compressed in email_bodies; the text index sees at most this many distinct terms
+    BODY_COMPRESSION_LEVEL: int = int(os.getenv("BODY_COMPRESSION_LEVEL", "6"))
+    MAX_BODY_TERMS: int = int(os.getenv("MAX_BODY_TERMS", "5000"))
+
+    # Offline Gmail stand-in (services/fake_gmail.py), useful for local runs without Google credentials
+    USE_FAKE_GMAIL: bool = os.getenv("USE_FAKE_GMAIL", "false").lower() == "true"
+    FAKE_GMAIL_MAILBOX_SIZE: int = int(os.getenv("FAKE_GMAIL_MAILBOX_SIZE", "100"))
 
 settings = Settings()
\ No newline at end of file
@@ -8,21 +8,100 @@ db = client[settings.MONGO_DB]
 
 # Collections
 email_collection = db["emails"]
+sync_state_collection = db["sync_state"]
+backfill_job_collection = db["backfill_jobs"]
+counters_collection = db["mailbox_counters"]
+body_collection = db["email_bodies"]
+thread_collection = db["threads"]
+label_sync_collection = db["label_sync_queue"]
+tombstone_collection = db["email_tombstones"]
+outbox_collection = db["outbox"]
+migration_collection = db["migrations"]
+
+TEXT_INDEX_NAME = "user_text_search"
 
 # Create indexes for better performance
 email_collection.create_index([("user_id", 1), ("timestamp", -1)])
+email_collection.create_index([("user_id", 1), ("timestamp", -1), ("_id", -1)])
 email_collection.create_index([("user_id", 1), ("message_id", 1)], unique=True)
 email_collection.create_index([("user_id", 1), ("read", 1)])
 email_collection.create_index([("user_id", 1), ("sender", 1)])
+email_collection.create_index([("user_id", 1), ("thread_id", 1)])
+# Per-user full-text search; user_id is an equality prefix so each search only touches one mailbox
+# Bodies live in email_bodies, so the index covers their distinct terms instead
+email_collection.create_index(
+    [("user_id", 1), ("subject", "text"), ("sender", "text"), ("body_terms", "text")],
+    name=TEXT_INDEX_NAME,
+    weights={"subject": 5, "sender": 3, "body_terms": 1},
+    default_language="english"
+)
+sync_state_collection.create_index([("user_id", 1)], unique=True)
+backfill_job_collection.create_index([("user_id", 1)], unique=True)
+backfill_job_collection.create_index([("status", 1)])
+counters_collection.create_index([("user_id", 1)], unique=True)
+body_collection.create_index([("user_id", 1)])
+thread_collection.create_index([("user_id", 1), ("thread_id", 1)], unique=True)
+thread_collection.create_index([("user_id", 1), ("last_message_at", -1), ("_id", -1)])
+thread_collection.create_index([("user_id", 1), ("labels", 1), ("last_message_at", -1), ("_id", -1)])
+label_sync_collection.create_index([("user_id", 1), ("message_id", 1)], unique=True)
+label_sync_collection.create_index([("next_attempt_at", 1)])
+# Change feed: emails and deletion tombstones are read by (user_id, change_seq)
+email_collection.create_index([("user_id", 1), ("change_seq", 1)])
+tombstone_collection.create_index([("user_id", 1), ("change_seq", 1)])
+tombstone_collection.create_index([("deleted_at", 1)], expireAfterSeconds=settings.CHANGE_FEED_RETENTION_SECONDS)
+# Outbox: workers claim the oldest due job; idempotency keys are unique per user while a job is kept
+outbox_collection.create_index([("status", 1), ("next_attempt_at", 1)])
+outbox_collection.create_index(
+    [("user_id", 1), ("idempotency_key", 1)],
+    unique=True,
+    partialFilterExpression={"idempotency_key": {"$type": "string"}}
+)
+outbox_collection.create_index([("expires_at", 1)], expireAfterSeconds=0)
 
 def get_email_collection():
     """Get email collection"""
     return email_collection
 
+def get_sync_state_collection():
+    """Get per-user mailbox sync checkpoint collection"""
+    return sync_state_collection
+
+def get_backfill_job_collection():
+    """Get full-mailbox backfill job collection"""
+    return backfill_job_collection
+
+def get_counters_collection():
+    """Get materialized per-user mailbox counters collection"""
+    return counters_collection
+
+def get_body_collection():
+    """Get compressed email body collection (keyed by the email _id)"""
+    return body_collection
+
+def get_thread_collection():
+    """Get materialized conversation thread collection"""
+    return thread_collection
+
+def get_label_sync_collection():
+    """Get pending Gmail label changes (write-behind queue, one document per message)"""
+    return label_sync_collection
+
+def get_tombstone_collection():
+    """Get deleted-email markers for the change feed (expire after CHANGE_FEED_RETENTION_SECONDS)"""
+    return tombstone_collection
+
+def get_outbox_collection():
+    """Get queued outbound emails (send, reply, forward) and their delivery status"""
+    return outbox_collection
+
+def get_migration_collection():
+    """Get completed one-off data migrations (one document per migration name)"""
+    return migration_collection
+
 def get_database():
     """Get database instance"""
     return db
 
 def close_db_connection():
     """Close database connection"""
-    client.close()
\ No newline at end of file
+    client.close()
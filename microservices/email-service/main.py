@@ -1,6 +1,16 @@
 from fastapi import FastAPI
 from routes.email import router as email_router
+from routes.internal import router as internal_router
+from services.backfill_service import backfill_service
+from services.body_store import body_store
+from services.sync_scheduler import sync_scheduler
+from services.label_sync import label_sync_queue
+from services.outbox import outbox_service
+from services.attachment_cache import attachment_cache
+from services.email_service import email_service
+from services.user_service_client import user_service_client
 from fastapi.middleware.cors import CORSMiddleware
+from config import settings
 import logging
 
 
@@ -21,11 +31,26 @@ app.add_middleware(
 
 # Include routers
 app.include_router(email_router)
+app.include_router(internal_router)
 
 @app.on_event("startup")
 async def startup_event():
     logging.info("Email service is starting up...")
+    await user_service_client.start()
+    await backfill_service.resume_jobs()
+    body_store.start_migration()
+    label_sync_queue.start(email_service)
+    await outbox_service.start(email_service)
+    await attachment_cache.start()
+    if settings.SYNC_SCHEDULER_ENABLED:
+        await sync_scheduler.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    logging.info("Email service is shutting down...")
\ No newline at end of file
+    logging.info("Email service is shutting down...")
+    await sync_scheduler.shutdown()
+    await backfill_service.shutdown()
+    await body_store.shutdown()
+    await label_sync_queue.shutdown()
+    await outbox_service.shutdown()
+    await user_service_client.close()
\ No newline at end of file
@@ -1,7 +1,14 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, conlist
 from typing import List, Optional
 from datetime import datetime
 
+class EmailAttachment(BaseModel):
+    attachment_id: Optional[str] = None
+    part_id: Optional[str] = None
+    filename: str
+    mime_type: str
+    size: int = 0
+
 class EmailBase(BaseModel):
     subject: str
     sender: str
@@ -16,12 +23,18 @@ class Email(EmailBase):
     message_id: str
     thread_id: Optional[str] = None
     labels: List[str] = []
+    snippet: Optional[str] = None
+    body_truncated: bool = False
+    attachments: List[EmailAttachment] = []
 
 class EmailInDB(EmailBase):
     user_id: str
     message_id: str
     thread_id: Optional[str] = None
     labels: List[str] = []
+    snippet: Optional[str] = None
+    body_truncated: bool = False
+    attachments: List[EmailAttachment] = []
 
 class EmailSendRequest(BaseModel):
     to: List[str]  # Changed from EmailStr to str for compatibility
@@ -35,10 +48,24 @@ class EmailSendResponse(BaseModel):
     message_id: Optional[str] = None
     error: Optional[str] = None
 
+class EmailOutboxStatus(BaseModel):
+    outbox_id: str
+    kind: str                                     # "send", "reply" or "forward"
+    status: str                                   # "queued", "sending", "retrying", "sent" or "failed"
+    attempts: int = 0
+    message_id: Optional[str] = None              # Gmail id once sent
+    thread_id: Optional[str] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
 class EmailFetchResponse(BaseModel):
     success: bool
     processed: int = 0
     total: int = 0
+    mode: Optional[str] = None   # "full" or "incremental"
+    updated: int = 0
+    deleted: int = 0
     error: Optional[str] = None
 
 class EmailUpdateRequest(BaseModel):
@@ -53,6 +80,26 @@ class EmailSearchRequest(BaseModel):
     to_date: Optional[str] = None    # Keep as string for API compatibility
     read: Optional[bool] = None
     labels: Optional[List[str]] = None
+    sort: Optional[str] = None   # "relevance" (default when query is set) or "date"
+
+class EmailBulkRequest(BaseModel):
+    email_ids: conlist(str, min_items=1, max_items=1000)
+    action: str                                   # "mark_read", "mark_unread", "trash" or "delete"
+
+class EmailBulkItemResult(BaseModel):
+    email_id: str
+    success: bool
+    gmail_updated: Optional[bool] = None
+    gmail_queued: Optional[bool] = None
+    error: Optional[str] = None
+
+class EmailBulkResponse(BaseModel):
+    success: bool
+    action: Optional[str] = None
+    succeeded: int = 0
+    failed: int = 0
+    results: List[EmailBulkItemResult] = []
+    error: Optional[str] = None
 
 # FIXED - Updated to match the backend service expectations
 class EmailReplyRequest(BaseModel):
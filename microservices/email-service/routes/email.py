@@ -502,7 +502,10 @@
 
 
 
-from fastapi import APIRouter, Depends, HTTPException, status, Header, Query, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from googleapiclient.errors import HttpError
+from urllib.parse import quote
 from typing import List, Optional
 from datetime import datetime, timedelta
 import json
@@ -510,35 +513,75 @@ import json
 from models.email import (
     Email, 
     EmailSendRequest, 
-    EmailSendResponse,
     EmailFetchResponse,
     EmailUpdateRequest,
     EmailSearchRequest,
     EmailReplyRequest,
-    EmailForwardRequest  # ✅ Added missing import
+    EmailForwardRequest,  # ✅ Added missing import
+    EmailBulkRequest,
+    EmailBulkResponse,
+    EmailOutboxStatus
 )
-from services.email_service import email_service
+from services.email_service import email_service, InvalidPageCursor, LIST_PROJECTION, BULK_ACTIONS
+from services.sync_service import sync_service
+from services.backfill_service import backfill_service
 from services.user_service_client import user_service_client
+from services.token_verifier import token_verifier
+from services.sync_scheduler import sync_scheduler
+from services.change_feed import InvalidChangeToken, ExpiredChangeToken
+from services.event_stream import event_stream
+from services.outbox import outbox_service
+from services.attachment_cache import attachment_cache, parse_byte_range, RangeNotSatisfiable
 
 router = APIRouter(prefix="/emails", tags=["emails"])
 
 async def get_user_from_token(authorization: str = Header(...)) -> dict:
     """Extract and verify token, return user data"""
-    print("this is the authorization:\n", authorization)
-
     if not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Invalid authorization header")
     
     token = authorization.replace("Bearer ","")
-    print("this is token\n", token)
-    user_data = await user_service_client.verify_token(token)
+    # Signature and expiry are checked locally; user-service is only consulted periodically
+    user_data = await token_verifier.verify(token)
     print("[DEBUG] CCC User data from token:", "User Found" if user_data else "User Not Found")
     if not user_data:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+    # Active users are kept synced in the background
+    sync_scheduler.touch(str(user_data["user_id"]))
     
     print("\ni got here\n")
     return user_data
 
+async def _search_page(user_id: str, filters: dict, skip: int, limit: int, cursor: Optional[str],
+                       sort: str = "date", include_body: bool = False) -> dict:
+    """
+    Read one page of list items from Mongo; the total comes from a separate (cached) count.
+    Bodies are left out unless include_body is set.
+    """
+    # Emails the body migration has not reached yet still keep their body inline
+    projection = {**LIST_PROJECTION, "body": 1} if include_body else LIST_PROJECTION
+    try:
+        page = await email_service.search_emails(
+            user_id, filters, skip=skip, limit=limit, cursor=cursor, projection=projection, sort=sort
+        )
+    except InvalidPageCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if include_body:
+        await email_service.attach_bodies(page["emails"])
+
+    total = await email_service.count_emails(user_id, filters)
+
+    return {
+        "emails": page["emails"],
+        "total": total,
+        "skip": 0 if cursor else skip,
+        "limit": limit,
+        "has_more": page["has_more"],
+        "next_cursor": page["next_cursor"]
+    }
+
 @router.post("/fetch", response_model=EmailFetchResponse)
 async def fetch_user_emails(authorization: str = Header(...)):
     """Fetch emails for current user from Gmail"""
@@ -546,7 +589,7 @@ async def fetch_user_emails(authorization: str = Header(...)):
     user_id = user_data.get("user_id") or user_data.get("id") or user_data.get("_id")
     
     print(f"Starting fetch for user: {user_id}")
-    result = await email_service.fetch_emails(str(user_id))
+    result = await sync_service.sync_mailbox(str(user_id))
     print("Fetch result:", result)
     return EmailFetchResponse(**result)
 
@@ -608,6 +651,16 @@ async def fetch_user_emails(authorization: str = Header(...)):
 #         "has_more": skip + limit < total
 #     }
 
+# Mailbox folder names used by the UI → Gmail labels
+TYPE_TO_LABEL = {
+    "Inbox": "INBOX",
+    "Sent": "SENT",
+    "Drafts": "DRAFT",
+    "Spam": "SPAM",
+    "Trash": "TRASH",
+    "Starred": "STARRED"
+}
+
 @router.get("/", response_model=dict)
 async def get_emails(
     skip: int = Query(0, ge=0),
@@ -620,6 +673,8 @@ async def get_emails(
     to_date: Optional[str] = Query(None),
     labels: Optional[str] = Query(None),
     type: Optional[str] = Query(None),  # ✅ New line
+    cursor: Optional[str] = Query(None),
+    include_body: bool = Query(False),
     authorization: str = Header(...)
 ):
     """Get emails for current user with filtering and pagination"""
@@ -629,16 +684,8 @@ async def get_emails(
     filters = {}
 
     # ✅ Convert `type` → Gmail label
-    type_to_label = {
-        "Inbox": "INBOX",
-        "Sent": "SENT",
-        "Drafts": "DRAFT",
-        "Spam": "SPAM",
-        "Trash": "TRASH",
-        "Starred": "STARRED"
-    }
-    if type and type in type_to_label:
-        filters["labels"] = [type_to_label[type]]
+    if type and type in TYPE_TO_LABEL:
+        filters["labels"] = [TYPE_TO_LABEL[type]]
     elif labels:
         filters["labels"] = labels.split(",")
 
@@ -664,20 +711,69 @@ async def get_emails(
     print("User ID:", user_id)
     print("Filters:", filters)
 
-    emails = await email_service.search_emails(str(user_id), filters)
-    print(f"Found {len(emails)} emails")
+    return await _search_page(str(user_id), filters, skip, limit, cursor, include_body=include_body)
+
+@router.get("/threads", response_model=dict)
+async def get_threads(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
+    label: Optional[str] = Query(None),
+    type: Optional[str] = Query(None),
+    authorization: str = Header(...)
+):
+    """Conversation view: threads ordered by their latest message, keyset-paginated"""
+    user_data = await get_user_from_token(authorization)
+    user_id = user_data.get("user_id") or user_data.get("id") or user_data.get("_id")
+
+    if type and type in TYPE_TO_LABEL:
+        label = TYPE_TO_LABEL[type]
 
-    total = len(emails)
-    paginated_emails = emails[skip:skip + limit]
+    try:
+        page = await email_service.list_threads(str(user_id), limit=limit, cursor=cursor, label=label)
+    except InvalidPageCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     return {
-        "emails": paginated_emails,
-        "total": total,
-        "skip": skip,
+        "threads": page["threads"],
         "limit": limit,
-        "has_more": skip + limit < total
+        "has_more": page["has_more"],
+        "next_cursor": page["next_cursor"]
     }
 
+@router.get("/changes", response_model=dict)
+async def get_email_changes(
+    since: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=500),
+    authorization: str = Header(...)
+):
+    """Emails changed or deleted since a change token; without one, just the current token"""
+    user_data = await get_user_from_token(authorization)
+    user_id = user_data.get("user_id") or user_data.get("id") or user_data.get("_id")
+
+    try:
+        return await email_service.list_changes(str(user_id), since=since, limit=limit)
+    except InvalidChangeToken as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ExpiredChangeToken as e:
+        # The client has to reload its pages and start over from a fresh token
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail=str(e))
+
+@router.get("/stream")
+async def stream_email_events(
+    request: Request,
+    last_event_id: Optional[str] = Header(None),
+    authorization: str = Header(...)
+):
+    """Server-sent events for new, updated and deleted emails; resumes from Last-Event-ID"""
+    user_data = await get_user_from_token(authorization)
+    user_id = user_data.get("user_id") or user_data.get("id") or user_data.get("_id")
+
+    return StreamingResponse(
+        event_stream.events(str(user_id), last_event_id, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/{email_id}", response_model=Email)
 async def get_single_email(
     email_id: str,
@@ -697,114 +793,182 @@ async def get_single_email(
     
     return Email(**email)
 
+@router.get("/{email_id}/attachments/{attachment_id}")
+async def download_attachment(
+    email_id: str,
+    attachment_id: str,
+    range_header: Optional[str] = Header(None, alias="range"),
+    if_none_match: Optional[str] = Header(None),
+    authorization: str = Header(...)
+):
+    """Download an attachment; fetched from Gmail once, then served from the disk cache (supports Range)"""
+    user_data = await get_user_from_token(authorization)
+    user_id = user_data.get("user_id") or user_data.get("id") or user_data.get("_id")
+    
+    try:
+        attachment = await email_service.get_attachment(str(user_id), email_id, attachment_id)
+    except HttpError as e:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"Gmail API error: {str(e)}"
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to download attachment: {str(e)}"
+        )
+    
+    if not attachment:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Attachment not found"
+        )
+    
+    # Content-addressed, so the hash is a strong validator that never goes stale
+    etag = f'"{attachment["sha256"]}"'
+    headers = {
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(attachment['filename'])}",
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Cache-Control": "private, max-age=86400"
+    }
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    size = attachment["size"]
+    try:
+        byte_range = parse_byte_range(range_header, size)
+    except RangeNotSatisfiable:
+        return Response(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={**headers, "Content-Range": f"bytes */{size}"}
+        )
+
+    if byte_range is None:
+        # Streamed from disk in chunks, never loaded into memory
+        return FileResponse(attachment["path"], media_type=attachment["mime_type"], headers=headers)
+
+    start, end = byte_range
+    return StreamingResponse(
+        attachment_cache.iter_range(attachment["path"], start, end),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=attachment["mime_type"],
+        headers={
+            **headers,
+            "Content-Range": f"bytes {start}-{end}/{size}",
+            "Content-Length": str(end - start + 1)
+        }
+    )
+
 # ✅ FIXED - Now uses Pydantic model instead of Request
-@router.post("/send", response_model=EmailSendResponse)
+@router.post("/send", response_model=EmailOutboxStatus, status_code=status.HTTP_202_ACCEPTED)
 async def send_user_email(
     email_request: EmailSendRequest,  # ✅ Changed from Request to Pydantic model
+    idempotency_key: Optional[str] = Header(None),
     authorization: str = Header(...)
 ):
-    """Send an email from the user's Gmail account"""
+    """Queue an email for sending from the user's Gmail account; poll the returned outbox handle"""
     user_data = await get_user_from_token(authorization)
-    print("[DEBUG email-service send_user_email] TOKEN:", authorization)
     user_id = user_data.get("user_id") or user_data.get("id") or user_data.get("_id")
     
     print(f"[DEBUG] Send email request: {email_request.dict()}")
     
-    result = await email_service.send_email(
-        user_id=str(user_id),
-        to=email_request.to,
-        subject=email_request.subject,
-        body=email_request.body,
-        cc=email_request.cc,
-        bcc=email_request.bcc
+    job = await outbox_service.enqueue(
+        str(user_id),
+        "send",
+        {
+            "to": email_request.to,
+            "subject": email_request.subject,
+            "body": email_request.body,
+            "cc": email_request.cc,
+            "bcc": email_request.bcc
+        },
+        idempotency_key=idempotency_key
     )
-    
-    return EmailSendResponse(**result)
+    return EmailOutboxStatus(**job)
+
+@router.get("/outbox/{outbox_id}", response_model=EmailOutboxStatus)
+async def get_outbox_status(
+    outbox_id: str,
+    authorization: str = Header(...)
+):
+    """Delivery status of a queued send, reply or forward"""
+    user_data = await get_user_from_token(authorization)
+    user_id = user_data.get("user_id") or user_data.get("id") or user_data.get("_id")
+
+    job = await outbox_service.get_status(str(user_id), outbox_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Outbox entry not found")
+    return EmailOutboxStatus(**job)
 
 # ✅ FIXED - Now uses Pydantic model instead of Request
-@router.post("/{email_id}/reply")
+@router.post("/{email_id}/reply", response_model=EmailOutboxStatus, status_code=status.HTTP_202_ACCEPTED)
 async def reply_to_email(
     email_id: str,
     reply_request: EmailReplyRequest,  # ✅ Changed from Request to Pydantic model
+    idempotency_key: Optional[str] = Header(None),
     authorization: str = Header(...)
 ):
-    """Reply to an email"""
+    """Queue a reply to an email; poll the returned outbox handle"""
     user_data = await get_user_from_token(authorization)
     user_id = user_data.get("user_id") or user_data.get("id") or user_data.get("_id")
     
     print(f"[DEBUG] Reply request: {reply_request.dict()}")
-    
-    result = await email_service.reply_to_email(
-        user_id=str(user_id),
-        email_id=email_id,
-        reply_body=reply_request.reply_body,
-        reply_to_all=reply_request.reply_to_all,
-        additional_cc=reply_request.additional_cc,
-        additional_bcc=reply_request.additional_bcc
+
+    if not await email_service.email_exists(str(user_id), email_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Original email not found")
+    
+    job = await outbox_service.enqueue(
+        str(user_id),
+        "reply",
+        {
+            "email_id": email_id,
+            "reply_body": reply_request.reply_body,
+            "reply_to_all": reply_request.reply_to_all,
+            "additional_cc": reply_request.additional_cc,
+            "additional_bcc": reply_request.additional_bcc
+        },
+        idempotency_key=idempotency_key
     )
-    
-    if not result["success"]:
-        if "not found" in result["error"].lower():
-            status_code = status.HTTP_404_NOT_FOUND
-        elif "service not available" in result["error"].lower():
-            status_code = status.HTTP_503_SERVICE_UNAVAILABLE
-        else:
-            status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
-            
-        raise HTTPException(status_code=status_code, detail=result["error"])
-    
-    return {
-        "status": "success",
-        "message": result["message"],
-        "message_id": result.get("message_id"),
-        "thread_id": result.get("thread_id")
-    }
+    return EmailOutboxStatus(**job)
 
 # ✅ FIXED - Now uses Pydantic model instead of Request
-@router.post("/{email_id}/forward")
+@router.post("/{email_id}/forward", response_model=EmailOutboxStatus, status_code=status.HTTP_202_ACCEPTED)
 async def forward_email(
     email_id: str,
     forward_request: EmailForwardRequest,  # ✅ Changed from Request to Pydantic model
+    idempotency_key: Optional[str] = Header(None),
     authorization: str = Header(...)
 ):
-    """Forward an email to other recipients"""
+    """Queue a forward of an email to other recipients; poll the returned outbox handle"""
     user_data = await get_user_from_token(authorization)
     user_id = user_data.get("user_id") or user_data.get("id") or user_data.get("_id")
     
     print(f"[DEBUG] Forward request: {forward_request.dict()}")
-    
-    result = await email_service.forward_email(
-        user_id=str(user_id),
-        email_id=email_id,
-        to=forward_request.to,
-        forward_message=forward_request.forward_message,
-        cc=forward_request.cc,
-        bcc=forward_request.bcc
+
+    if not await email_service.email_exists(str(user_id), email_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Original email not found")
+    
+    job = await outbox_service.enqueue(
+        str(user_id),
+        "forward",
+        {
+            "email_id": email_id,
+            "to": forward_request.to,
+            "forward_message": forward_request.forward_message,
+            "cc": forward_request.cc,
+            "bcc": forward_request.bcc
+        },
+        idempotency_key=idempotency_key
     )
-    
-    if not result["success"]:
-        if "not found" in result["error"].lower():
-            status_code = status.HTTP_404_NOT_FOUND
-        elif "service not available" in result["error"].lower():
-            status_code = status.HTTP_503_SERVICE_UNAVAILABLE
-        else:
-            status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
-            
-        raise HTTPException(status_code=status_code, detail=result["error"])
-    
-    return {
-        "status": "success",
-        "message": result["message"],
-        "message_id": result.get("message_id"),
-        "thread_id": result.get("thread_id")
-    }
+    return EmailOutboxStatus(**job)
 
 @router.put("/{email_id}/mark-read")
 async def mark_email_as_read(
     email_id: str,
     authorization: str = Header(...)
 ):
-    """Mark email as read in both Gmail and database"""
+    """Mark email as read; the database answers now, Gmail is updated in the background"""
     user_data = await get_user_from_token(authorization)
     user_id = user_data.get("user_id") or user_data.get("id") or user_data.get("_id")
     
@@ -827,6 +991,8 @@ async def mark_email_as_read(
     
     if "gmail_updated" in result:
         response["gmail_synced"] = result["gmail_updated"]
+    if "gmail_queued" in result:
+        response["gmail_queued"] = result["gmail_queued"]
     if "database_updated" in result:
         response["database_updated"] = result["database_updated"]
     
@@ -837,7 +1003,7 @@ async def mark_email_as_unread(
     email_id: str,
     authorization: str = Header(...)
 ):
-    """Mark email as unread in both Gmail and database"""
+    """Mark email as unread; the database answers now, Gmail is updated in the background"""
     user_data = await get_user_from_token(authorization)
     user_id = user_data.get("user_id") or user_data.get("id") or user_data.get("_id")
     
@@ -912,7 +1078,7 @@ async def move_email_to_trash(
     email_id: str,
     authorization: str = Header(...)
 ):
-    """Move email to trash in Gmail and update database"""
+    """Move email to trash; the database answers now, Gmail is updated in the background"""
     user_data = await get_user_from_token(authorization)
     user_id = user_data.get("user_id") or user_data.get("id") or user_data.get("_id")
     
@@ -931,11 +1097,35 @@ async def move_email_to_trash(
     }
 
 # ✅ FIXED - Now uses Pydantic model instead of Request
+@router.post("/bulk", response_model=EmailBulkResponse)
+async def bulk_update_emails(
+    bulk_request: EmailBulkRequest,
+    authorization: str = Header(...)
+):
+    """Mark read/unread, trash or delete up to 1000 emails in one call, with a result per email"""
+    user_data = await get_user_from_token(authorization)
+    user_id = user_data.get("user_id") or user_data.get("id") or user_data.get("_id")
+
+    if bulk_request.action not in BULK_ACTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid action, expected one of: {', '.join(BULK_ACTIONS)}"
+        )
+
+    result = await email_service.bulk_update(str(user_id), bulk_request.email_ids, bulk_request.action)
+    if result.get("error"):
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=result["error"]
+        )
+    return EmailBulkResponse(**result)
+
 @router.post("/search")
 async def search_emails(
     search_request: EmailSearchRequest,  # ✅ Changed from Request to Pydantic model
     skip: int = Query(0, ge=0),
     limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
     authorization: str = Header(...)
 ):
     """Advanced email search with pagination"""
@@ -945,6 +1135,11 @@ async def search_emails(
     # Convert Pydantic model to dict and handle date conversion
     filters = search_request.dict(exclude_unset=True)
     print(f"[DEBUG] Search request: {filters}")
+
+    # Free-text searches are ranked by relevance unless the client asks for date order
+    sort = filters.pop("sort", None) or ("relevance" if filters.get("query") and not cursor else "date")
+    if sort not in ("relevance", "date"):
+        raise HTTPException(status_code=400, detail="Invalid sort, expected 'relevance' or 'date'")
     
     # Convert date strings to datetime objects if present
     for date_field in ["from_date", "to_date"]:
@@ -954,19 +1149,7 @@ async def search_emails(
             except ValueError:
                 raise HTTPException(status_code=400, detail=f"Invalid {date_field} format")
     
-    emails = await email_service.search_emails(str(user_id), filters)
-    
-    # Apply pagination
-    total = len(emails)
-    paginated_emails = emails[skip:skip + limit]
-    
-    return {
-        "emails": paginated_emails,
-        "total": total,
-        "skip": skip,
-        "limit": limit,
-        "has_more": skip + limit < total
-    }
+    return await _search_page(str(user_id), filters, skip, limit, cursor, sort=sort)
 
 @router.get("/stats/summary")
 async def get_email_stats(authorization: str = Header(...)):
@@ -974,36 +1157,43 @@ async def get_email_stats(authorization: str = Header(...)):
     user_data = await get_user_from_token(authorization)
     user_id = user_data.get("user_id") or user_data.get("id") or user_data.get("_id")
     
-    from db.mongodb import get_email_collection
-    
-    email_collection = get_email_collection()
-    
     try:
-        now = datetime.utcnow()
-        total = await email_collection.count_documents({"user_id": str(user_id)})
-        unread = await email_collection.count_documents({"user_id": str(user_id), "read": False})
-        today = await email_collection.count_documents({
-            "user_id": str(user_id),
-            "timestamp": {"$gte": now.replace(hour=0, minute=0, second=0, microsecond=0)}
-        })
-        this_week = await email_collection.count_documents({
-            "user_id": str(user_id),
-            "timestamp": {"$gte": now - timedelta(days=7)}
-        })
-        
-        return {
-            "total_emails": total,
-            "unread_emails": unread,
-            "read_emails": total - unread,
-            "today": today,
-            "this_week": this_week
-        }
+        return await email_service.get_email_stats(str(user_id))
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error getting email stats: {str(e)}"
         )
 
+@router.post("/backfill", status_code=status.HTTP_202_ACCEPTED)
+async def start_mailbox_backfill(
+    restart: bool = Query(False),
+    authorization: str = Header(...)
+):
+    """Start importing the user's whole mailbox in the background"""
+    user_data = await get_user_from_token(authorization)
+    user_id = user_data.get("user_id") or user_data.get("id") or user_data.get("_id")
+
+    job = await backfill_service.start_backfill(str(user_id), restart=restart)
+    return {
+        "status": "accepted",
+        "job": job
+    }
+
+@router.get("/backfill/status")
+async def get_mailbox_backfill_status(authorization: str = Header(...)):
+    """Get progress of the user's mailbox backfill job"""
+    user_data = await get_user_from_token(authorization)
+    user_id = user_data.get("user_id") or user_data.get("id") or user_data.get("_id")
+
+    job = await backfill_service.get_status(str(user_id))
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No backfill job found"
+        )
+    return job
+
 @router.get("/test-gmail-connection")
 async def test_gmail_connection(authorization: str = Header(...)):
     """Test Gmail API connection for debugging"""
@@ -0,0 +1,52 @@
+from fastapi import APIRouter, Header, HTTPException, status
+from jose import jwt, JWTError
+
+from services.email_service import email_service
+from services.gmail_quota import gmail_limiter
+from services.sync_scheduler import sync_scheduler
+from services.attachment_cache import attachment_cache
+from config import settings
+
+# Service-to-service notifications; not proxied by the api-gateway
+router = APIRouter(prefix="/internal", tags=["internal"])
+
+TOKEN_REFRESHED_EVENT = "google_token_refreshed"
+INTERNAL_AUDIENCE = "email-service-internal"
+
+
+@router.post("/users/{user_id}/token-refreshed", status_code=status.HTTP_204_NO_CONTENT)
+async def google_token_refreshed(user_id: str, authorization: str = Header(...)):
+    """user-service stored a new Google token: forget the cached profile and Gmail client"""
+    if not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Invalid authorization header")
+
+    # user-service signs these notifications with the shared SECRET_KEY, for the internal audience
+    # (jose accepts tokens without an aud claim, so its presence is checked below)
+    try:
+        claims = jwt.decode(authorization[len("Bearer "):], settings.SECRET_KEY,
+                            algorithms=[settings.ALGORITHM], audience=INTERNAL_AUDIENCE)
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid service token")
+
+    if claims.get("aud") != INTERNAL_AUDIENCE or claims.get("sub") != "user-service" \
+            or claims.get("event") != TOKEN_REFRESHED_EVENT or claims.get("user_id") != user_id:
+        raise HTTPException(status_code=403, detail="Token not valid for this notification")
+
+    email_service.invalidate_user_credentials(user_id)
+
+
+@router.get("/metrics/gmail-quota")
+async def gmail_quota_metrics():
+    """Gmail quota utilization over the last minute, per project and for the busiest users"""
+    return gmail_limiter.snapshot()
+
+
+@router.get("/metrics/sync-scheduler")
+async def sync_scheduler_metrics():
+    """Background sync state: active users, queue depth and sync outcomes"""
+    return sync_scheduler.snapshot()
+
+@router.get("/metrics/attachment-cache")
+async def attachment_cache_metrics():
+    """Attachment disk cache: size, hit and miss counts, evictions"""
+    return attachment_cache.snapshot()
@@ -0,0 +1,202 @@
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Optional, Tuple
+from config import settings
+import asyncio
+import base64
+import hashlib
+import os
+import time
+import uuid
+
+# Base64 characters decoded per step (a multiple of 4, so chunks decode independently)
+DECODE_CHUNK_CHARS = 256 * 1024
+READ_CHUNK_BYTES = 64 * 1024
+# A file handed out for serving is not evicted for this long (seconds), so it cannot
+# disappear between the lookup and the response opening it
+SERVE_LEASE_SECONDS = 60
+
+
+class RangeNotSatisfiable(ValueError):
+    """Raised for byte ranges that start past the end of the file"""
+    pass
+
+
+def parse_byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Inclusive (start, end) of a single-range Range header, or None to send the whole file.
+    Malformed and multi-range headers are ignored, as RFC 9110 allows.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    if not (first or last).isdigit() or (first and last and not last.isdigit()):
+        return None
+    if first:
+        start, end = int(first), int(last) if last else size - 1
+        if last and end < start:
+            return None
+    else:
+        # Suffix range: the last N bytes
+        start, end = size - min(int(last), size), size - 1
+        if int(last) == 0:
+            start = size
+    if start >= size:
+        raise RangeNotSatisfiable(f"Range bytes={first}-{last} is outside a {size} byte file")
+    return start, min(end, size - 1)
+
+
+class AttachmentCache:
+    """
+    Disk-backed LRU cache of attachment bytes, content-addressed by SHA-256.
+
+    Files live under ATTACHMENT_CACHE_DIR as <first two hex digits>/<digest>, so an
+    attachment received by many users (or forwarded around) is stored once. Emails
+    record the digest of each attachment after its first download; repeat downloads are
+    served from disk without a Gmail call. The total stays under ATTACHMENT_CACHE_MAX_BYTES
+    by evicting the least recently served files. Recency is kept in file mtimes, so the
+    order survives restarts.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # digest -> size, least recent first
+        self._leases: Dict[str, float] = {}
+        self._size = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    async def start(self):
+        """Index files kept from a previous run (called on app startup)"""
+        loop = asyncio.get_running_loop()
+        found = await loop.run_in_executor(None, self._scan)
+        for digest, size in found:
+            if digest not in self._entries:
+                self._entries[digest] = size
+                self._size += size
+        self._evict()
+        print(f"Attachment cache: {len(self._entries)} files, {self._size} bytes in {self.root}")
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    async def get(self, digest: str) -> Optional[Tuple[str, int]]:
+        """(path, size) of a cached file, or None when it is not (or no longer) on disk"""
+        size = self._entries.get(digest)
+        path = self.path_for(digest)
+        if size is None:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Removed behind our back
+            self._forget(digest)
+            return None
+
+        self._entries.move_to_end(digest)
+        self._leases[digest] = time.monotonic() + SERVE_LEASE_SECONDS
+        self.stats["hits"] += 1
+        return path, size
+
+    async def put_base64(self, data: str) -> Tuple[str, str, int]:
+        """Store base64url data (as Gmail returns it); returns (digest, path, size)"""
+        loop = asyncio.get_running_loop()
+        digest, size = await loop.run_in_executor(None, self._write_base64, data)
+        self.stats["misses"] += 1
+
+        if digest not in self._entries:
+            self._entries[digest] = size
+            self._size += size
+        self._entries.move_to_end(digest)
+        self._leases[digest] = time.monotonic() + SERVE_LEASE_SECONDS
+        self._evict()
+        return digest, self.path_for(digest), size
+
+    async def iter_range(self, path: str, start: int, end: int) -> AsyncIterator[bytes]:
+        """Bytes start..end (inclusive) of a cached file, read off the event loop"""
+        loop = asyncio.get_running_loop()
+        with open(path, "rb") as file:
+            file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await loop.run_in_executor(None, file.read, min(READ_CHUNK_BYTES, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def snapshot(self) -> Dict:
+        return {"files": len(self._entries), "bytes": self._size, "max_bytes": self.max_bytes, **self.stats}
+
+    def _write_base64(self, data: str) -> Tuple[str, int]:
+        # Decoded chunk by chunk into a temp file while hashing, then moved into place;
+        # the full decoded attachment is never held in memory
+        tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+        sha256 = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, "wb") as file:
+                for offset in range(0, len(data), DECODE_CHUNK_CHARS):
+                    chunk = data[offset:offset + DECODE_CHUNK_CHARS]
+                    decoded = base64.urlsafe_b64decode(chunk + "=" * (-len(chunk) % 4))
+                    sha256.update(decoded)
+                    file.write(decoded)
+                    size += len(decoded)
+
+            digest = sha256.hexdigest()
+            path = self.path_for(digest)
+            if os.path.exists(path):
+                # Same content already cached
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+            return digest, size
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _scan(self):
+        """(digest, size) of cached files, least recently used first; clears abandoned temp files"""
+        tmp_dir = os.path.join(self.root, "tmp")
+        if os.path.isdir(tmp_dir):
+            for name in os.listdir(tmp_dir):
+                os.remove(os.path.join(tmp_dir, name))
+
+        found = []
+        if not os.path.isdir(self.root):
+            return found
+        for prefix in os.listdir(self.root):
+            directory = os.path.join(self.root, prefix)
+            if prefix == "tmp" or not os.path.isdir(directory):
+                continue
+            for digest in os.listdir(directory):
+                stat = os.stat(os.path.join(directory, digest))
+                found.append((stat.st_mtime, digest, stat.st_size))
+        found.sort()
+        return [(digest, size) for _, digest, size in found]
+
+    def _evict(self):
+        now = time.monotonic()
+        self._leases = {digest: until for digest, until in self._leases.items() if until > now}
+        for digest in list(self._entries):
+            if self._size <= self.max_bytes:
+                break
+            if digest in self._leases:
+                continue
+            try:
+                os.remove(self.path_for(digest))
+            except FileNotFoundError:
+                pass
+            self._forget(digest)
+            self.stats["evictions"] += 1
+
+    def _forget(self, digest: str):
+        size = self._entries.pop(digest, None)
+        if size is not None:
+            self._size -= size
+
+
+attachment_cache = AttachmentCache(settings.ATTACHMENT_CACHE_DIR, settings.ATTACHMENT_CACHE_MAX_BYTES)
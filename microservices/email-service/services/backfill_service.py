@@ -0,0 +1,245 @@
+from googleapiclient.errors import HttpError
+from datetime import datetime
+from collections import deque
+from typing import Dict, Optional
+from db.mongodb import get_backfill_job_collection
+from services.email_service import email_service
+from services.sync_service import sync_service
+from services.gmail_quota import gmail_limiter, is_rate_limited
+from config import settings
+import asyncio
+import time
+
+
+class BackfillService:
+    """
+    Imports a user's whole mailbox in the background by walking messages.list pages.
+    The page cursor is persisted after every page so a restarted service resumes
+    where it stopped instead of starting over.
+    """
+
+    def __init__(self):
+        self.job_collection = get_backfill_job_collection()
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def start_backfill(self, user_id: str, restart: bool = False) -> Dict:
+        """Start (or resume) the backfill job for a user and return its status"""
+        if self._is_running(user_id):
+            return await self.get_status(user_id)
+
+        job = await self.job_collection.find_one({"user_id": user_id})
+        if job and job.get("status") == "completed" and not restart:
+            return await self.get_status(user_id)
+
+        if not job or restart:
+            await self.job_collection.update_one(
+                {"user_id": user_id},
+                {"$set": {
+                    "status": "pending",
+                    "page_token": None,
+                    "pages_done": 0,
+                    "messages_listed": 0,
+                    "messages_ingested": 0,
+                    "estimated_total": None,
+                    "elapsed_seconds": 0.0,
+                    "error": None,
+                    "created_at": datetime.utcnow(),
+                    "finished_at": None,
+                    "updated_at": datetime.utcnow()
+                }},
+                upsert=True
+            )
+
+        self._launch(user_id)
+        return await self.get_status(user_id)
+
+    async def resume_jobs(self):
+        """Restart jobs that were interrupted by a shutdown (called on app startup)"""
+        cursor = self.job_collection.find(
+            {"status": {"$in": ["pending", "running", "throttled"]}}, {"user_id": 1}
+        )
+        async for job in cursor:
+            print(f"Resuming mailbox backfill for user {job['user_id']}")
+            self._launch(job["user_id"])
+
+    async def shutdown(self):
+        """Cancel running jobs; their cursors stay persisted for resume_jobs"""
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+
+    async def get_status(self, user_id: str) -> Optional[Dict]:
+        """Progress of the user's backfill job, including an ETA while it runs"""
+        job = await self.job_collection.find_one({"user_id": user_id}, {"_id": 0})
+        if not job:
+            return None
+
+        job.pop("page_token", None)
+        job["running"] = self._is_running(user_id)
+
+        eta_seconds = None
+        elapsed = job.get("elapsed_seconds") or 0
+        listed = job.get("messages_listed") or 0
+        total = job.get("estimated_total")
+        if job.get("status") == "running" and total and listed and elapsed:
+            rate = listed / elapsed
+            eta_seconds = max(0, int((total - listed) / rate))
+        job["eta_seconds"] = eta_seconds
+        return job
+
+    def _is_running(self, user_id: str) -> bool:
+        task = self._tasks.get(user_id)
+        return task is not None and not task.done()
+
+    def _launch(self, user_id: str):
+        if self._is_running(user_id):
+            return
+        task = asyncio.create_task(self._run(user_id))
+        self._tasks[user_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(user_id, None))
+
+    async def _run(self, user_id: str):
+        throttled = 0
+        while True:
+            try:
+                await self._walk_mailbox(user_id)
+                return
+            except asyncio.CancelledError:
+                # Leave the job as "running" so the next startup resumes it
+                raise
+            except HttpError as e:
+                if is_rate_limited(e):
+                    # Out of quota even after retries: pause and pick up from the stored cursor
+                    await self._throttle(user_id, throttled, e)
+                    throttled += 1
+                    continue
+                email_service._handle_gmail_error(user_id, e)
+                await self._fail(user_id, f"Gmail API error: {str(e)}")
+                return
+            except Exception as e:
+                await self._fail(user_id, f"Unexpected error: {str(e)}")
+                return
+
+    async def _walk_mailbox(self, user_id: str):
+        service = await email_service.get_gmail_service(user_id)
+        if not service:
+            await self._fail(user_id, "Gmail service not available")
+            return
+
+        job = await self.job_collection.find_one({"user_id": user_id})
+
+        if not job.get("estimated_total"):
+            profile = await gmail_limiter.execute(
+                user_id, "getProfile",
+                lambda: service.users().getProfile(userId='me').execute()
+            )
+            # Everything newer than this checkpoint is picked up by incremental sync
+            await sync_service.seed_checkpoint(user_id, profile.get('historyId'))
+            await email_service.remember_own_address(user_id, profile.get('emailAddress'))
+            job["estimated_total"] = profile.get('messagesTotal')
+
+        await self.job_collection.update_one(
+            {"user_id": user_id},
+            {"$set": {
+                "status": "running",
+                "estimated_total": job["estimated_total"],
+                "error": None,
+                "updated_at": datetime.utcnow()
+            }}
+        )
+
+        page_token = job.get("page_token")
+        pages_done = job.get("pages_done", 0)
+        messages_listed = job.get("messages_listed", 0)
+        messages_ingested = job.get("messages_ingested", 0)
+        elapsed_seconds = job.get("elapsed_seconds", 0.0)
+        last_tick = time.monotonic()
+
+        # Listing is inherently sequential, but up to BACKFILL_CONCURRENCY pages are ingested
+        # at once. Pages are committed in order, so the stored cursor never skips a page.
+        in_flight = deque()
+        concurrency = max(1, settings.BACKFILL_CONCURRENCY)
+
+        while True:
+            response = await gmail_limiter.execute(
+                user_id, "messages.list",
+                lambda: service.users().messages().list(
+                    userId='me',
+                    maxResults=settings.BACKFILL_PAGE_SIZE,
+                    pageToken=page_token
+                ).execute()
+            )
+            message_ids = [message['id'] for message in response.get('messages', [])]
+            page_token = response.get('nextPageToken')
+
+            task = asyncio.create_task(email_service._store_new_messages(user_id, service, message_ids))
+            in_flight.append((task, len(message_ids), page_token))
+
+            while in_flight and (len(in_flight) >= concurrency or not page_token):
+                task, listed, next_token = in_flight.popleft()
+                try:
+                    ingested = await task
+                except BaseException:
+                    for pending, _, _ in in_flight:
+                        pending.cancel()
+                    raise
+
+                now = time.monotonic()
+                elapsed_seconds += now - last_tick
+                last_tick = now
+                pages_done += 1
+                messages_listed += listed
+                messages_ingested += ingested
+
+                await self.job_collection.update_one(
+                    {"user_id": user_id},
+                    {"$set": {
+                        "page_token": next_token,
+                        "pages_done": pages_done,
+                        "messages_listed": messages_listed,
+                        "messages_ingested": messages_ingested,
+                        "elapsed_seconds": elapsed_seconds,
+                        "updated_at": datetime.utcnow()
+                    }}
+                )
+
+            if not page_token:
+                break
+
+        await self.job_collection.update_one(
+            {"user_id": user_id},
+            {"$set": {
+                "status": "completed",
+                "finished_at": datetime.utcnow(),
+                "updated_at": datetime.utcnow()
+            }}
+        )
+        print(f"Mailbox backfill completed for user {user_id}: {messages_ingested} emails ingested")
+
+    async def _throttle(self, user_id: str, attempt: int, error: HttpError):
+        delay = max(settings.BACKFILL_THROTTLE_SECONDS, gmail_limiter.backoff_delay(attempt, error))
+        print(f"Mailbox backfill for user {user_id} is rate limited, resuming in {delay:.0f}s")
+        await self.job_collection.update_one(
+            {"user_id": user_id},
+            {"$set": {
+                "status": "throttled",
+                "error": f"Gmail rate limit: {str(error)}",
+                "updated_at": datetime.utcnow()
+            }}
+        )
+        await asyncio.sleep(delay)
+
+    async def _fail(self, user_id: str, error: str):
+        print(f"Mailbox backfill failed for user {user_id}: {error}")
+        await self.job_collection.update_one(
+            {"user_id": user_id},
+            {"$set": {
+                "status": "failed",
+                "error": error,
+                "updated_at": datetime.utcnow()
+            }}
+        )
+
+
+backfill_service = BackfillService()
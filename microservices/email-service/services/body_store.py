@@ -0,0 +1,175 @@
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+from db.mongodb import get_email_collection, get_body_collection, get_migration_collection, TEXT_INDEX_NAME
+from config import settings
+import asyncio
+import re
+import zlib
+
+DUPLICATE_KEY_ERROR = 11000
+# Name under which the finished inline-body migration is recorded
+INLINE_BODY_MIGRATION = "inline_bodies"
+
+_TERM_RE = re.compile(r"\w{2,}")
+
+
+def body_terms(text: str) -> str:
+    """Distinct words of a body, in first-seen order, for the text index"""
+    terms = dict.fromkeys(_TERM_RE.findall((text or "").lower()))
+    return " ".join(list(terms)[:settings.MAX_BODY_TERMS])
+
+
+class BodyStore:
+    """
+    Email bodies, zlib-compressed, in their own collection keyed by the email _id.
+    The emails collection keeps only metadata, a snippet and the body's distinct
+    terms for search, so list and search queries never page bodies into memory.
+    Emails stored before the split still carry an inline body; they are read
+    as-is and moved over in the background by migrate_inline_bodies().
+
+    The terms stay on the email document because a text index can only cover fields
+    of one collection, next to user_id, subject and sender. They are capped at
+    MAX_BODY_TERMS and left out of list projections, but still count toward the
+    documents' size in the working set.
+    """
+
+    def __init__(self):
+        self.email_collection = get_email_collection()
+        self.body_collection = get_body_collection()
+        self.migration_collection = get_migration_collection()
+        self._migration: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _compress(text: str) -> bytes:
+        return zlib.compress(text.encode("utf-8"), settings.BODY_COMPRESSION_LEVEL)
+
+    async def put_many(self, user_id: str, bodies: Dict) -> None:
+        """Store bodies for freshly inserted emails ({email _id: body text})"""
+        if not bodies:
+            return
+        documents = [
+            {
+                "_id": email_id,
+                "user_id": user_id,
+                "codec": "zlib",
+                "size": len(text.encode("utf-8")),
+                "data": self._compress(text)
+            }
+            for email_id, text in bodies.items()
+        ]
+        try:
+            await self.body_collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # A body written by an earlier, interrupted migration is already there
+            unexpected = [error for error in e.details.get("writeErrors", [])
+                          if error.get("code") != DUPLICATE_KEY_ERROR]
+            if unexpected:
+                raise
+
+    async def get(self, email: Dict) -> str:
+        """Body of a stored email document (falls back to a not yet migrated inline body)"""
+        if "body" in email:
+            return email["body"] or ""
+        stored = await self.body_collection.find_one({"_id": email["_id"]})
+        if not stored:
+            return ""
+        return zlib.decompress(stored["data"]).decode("utf-8")
+
+    async def get_many(self, email_ids: Iterable) -> Dict:
+        """Bodies of several stored emails ({email _id: body text}); ones without a stored body are left out"""
+        email_ids = list(email_ids)
+        if not email_ids:
+            return {}
+        cursor = self.body_collection.find({"_id": {"$in": email_ids}})
+        return {stored["_id"]: zlib.decompress(stored["data"]).decode("utf-8") async for stored in cursor}
+
+    async def delete_many(self, email_ids: Iterable) -> None:
+        email_ids = list(email_ids)
+        if email_ids:
+            await self.body_collection.delete_many({"_id": {"$in": email_ids}})
+
+    def start_migration(self):
+        """Move inline bodies of older emails out of the emails collection (called on startup)"""
+        if self._migration is None or self._migration.done():
+            self._migration = asyncio.create_task(self.migrate_inline_bodies())
+
+    async def shutdown(self):
+        if self._migration and not self._migration.done():
+            self._migration.cancel()
+            await asyncio.gather(self._migration, return_exceptions=True)
+
+    async def migrate_inline_bodies(self, batch_size: int = 200):
+        try:
+            # New emails never carry an inline body, so once finished the migration stays finished
+            if await self.migration_collection.find_one({"_id": INLINE_BODY_MIGRATION}):
+                return
+            index_ready = await self._ensure_text_index()
+            moved = 0
+            while True:
+                batch = await self.email_collection.find(
+                    {"body": {"$exists": True}},
+                    {"user_id": 1, "body": 1, "snippet": 1}
+                ).limit(batch_size).to_list(length=batch_size)
+                if not batch:
+                    break
+
+                by_user: Dict[str, Dict] = {}
+                for email in batch:
+                    by_user.setdefault(email["user_id"], {})[email["_id"]] = email.get("body") or ""
+                for user_id, bodies in by_user.items():
+                    await self.put_many(user_id, bodies)
+
+                await self.email_collection.bulk_write([
+                    UpdateOne(
+                        {"_id": email["_id"]},
+                        {
+                            "$set": {
+                                "body_terms": body_terms(email.get("body")),
+                                # Same preview length as email_service.SNIPPET_LENGTH
+                                "snippet": email.get("snippet") or (email.get("body") or "")[:200]
+                            },
+                            "$unset": {"body": ""}
+                        }
+                    )
+                    for email in batch
+                ], ordered=False)
+                moved += len(batch)
+
+            if moved:
+                print(f"Moved {moved} inline email bodies to the body store")
+            if not index_ready:
+                # Retried on the next startup
+                return
+            await self.migration_collection.update_one(
+                {"_id": INLINE_BODY_MIGRATION},
+                {"$set": {"completed_at": datetime.utcnow(), "moved": moved}},
+                upsert=True
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error migrating inline email bodies: {str(e)}")
+
+    async def _ensure_text_index(self) -> bool:
+        """Replace the text index over the old inline body field; False if that failed"""
+        indexes = await self.email_collection.index_information()
+        old_index = indexes.get(TEXT_INDEX_NAME)
+        if not old_index or "body_terms" in (old_index.get("weights") or {}):
+            return True
+        try:
+            await self.email_collection.drop_index(TEXT_INDEX_NAME)
+            await self.email_collection.create_index(
+                [("user_id", 1), ("subject", "text"), ("sender", "text"), ("body_terms", "text")],
+                name=TEXT_INDEX_NAME,
+                weights={"subject": 5, "sender": 3, "body_terms": 1},
+                default_language="english"
+            )
+            return True
+        except OperationFailure as e:
+            print(f"Error rebuilding the email text index: {str(e)}")
+            return False
+
+
+body_store = BodyStore()
@@ -0,0 +1,153 @@
+from pymongo import ReturnDocument
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Set
+from db.mongodb import get_sync_state_collection, get_tombstone_collection
+from config import settings
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import weakref
+
+
+class InvalidChangeToken(ValueError):
+    """Raised for change tokens we did not issue"""
+    pass
+
+
+class ExpiredChangeToken(ValueError):
+    """Raised when deletions older than the token may already have been forgotten"""
+    pass
+
+
+def _sign_change_token(user_id: str, seq: int, issued_at: str) -> str:
+    message = f"{user_id}|{seq}|{issued_at}".encode()
+    return hmac.new(settings.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()[:32]
+
+
+def encode_change_token(user_id: str, seq: int) -> str:
+    """Opaque token for position `seq` of the user's feed, signed so it only works for that user"""
+    issued_at = datetime.utcnow().isoformat()
+    raw = json.dumps({"s": seq, "at": issued_at, "sig": _sign_change_token(user_id, seq, issued_at)})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_change_token(token: str, user_id: str, head: Optional[int] = None) -> int:
+    """
+    Sequence number of a token issued to this user. Tokens of another account, and tokens
+    ahead of the user's current head (issued before the data was reset), are invalid.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        data = json.loads(raw)
+        seq, issued_at, signature = int(data["s"]), str(data["at"]), str(data["sig"])
+        issued = datetime.fromisoformat(issued_at)
+    except Exception:
+        raise InvalidChangeToken("Invalid change token")
+    if not hmac.compare_digest(signature, _sign_change_token(user_id, seq, issued_at)):
+        raise InvalidChangeToken("Invalid change token")
+    if head is not None and seq > head:
+        raise InvalidChangeToken("Change token is ahead of the mailbox, reload it")
+    if (datetime.utcnow() - issued).total_seconds() > settings.CHANGE_FEED_RETENTION_SECONDS:
+        raise ExpiredChangeToken("Change token expired, reload the mailbox")
+    return seq
+
+
+class ChangeFeed:
+    """
+    Per-user monotonic change sequence behind GET /emails/changes.
+
+    Every write path reserves sequence numbers with sequence() and stamps them on the
+    emails it inserts or updates (change_seq); deletions leave a tombstone carrying
+    their number. A client holding token N then only needs the emails and tombstones
+    with change_seq > N. Numbers are reserved before the write commits, so readers are
+    held below the oldest reservation still in flight and never skip a slow writer
+    (tracked in process: the service runs as a single instance).
+    """
+
+    def __init__(self):
+        self.sync_state_collection = get_sync_state_collection()
+        self.tombstone_collection = get_tombstone_collection()
+        self._inflight: Dict[str, Set[int]] = {}
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self._listeners: Dict[str, Set[asyncio.Event]] = {}
+
+    @asynccontextmanager
+    async def sequence(self, user_id: str, count: int = 1):
+        """Reserve `count` consecutive numbers for the writes made inside the block; yields the first"""
+        count = max(1, count)
+        async with self._lock(user_id):
+            state = await self.sync_state_collection.find_one_and_update(
+                {"user_id": user_id},
+                {"$inc": {"change_seq": count}},
+                projection={"change_seq": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            first = state["change_seq"] - count + 1
+            inflight = self._inflight.setdefault(user_id, set())
+            inflight.add(first)
+        try:
+            yield first
+        finally:
+            inflight.discard(first)
+            if not inflight:
+                self._inflight.pop(user_id, None)
+            # The write is committed (or failed): wake the user's open event streams
+            for event in self._listeners.get(user_id, ()):
+                event.set()
+
+    @contextmanager
+    def listen(self, user_id: str):
+        """An event that is set whenever a write for the user finishes"""
+        event = asyncio.Event()
+        self._listeners.setdefault(user_id, set()).add(event)
+        try:
+            yield event
+        finally:
+            listeners = self._listeners.get(user_id)
+            if listeners is not None:
+                listeners.discard(event)
+                if not listeners:
+                    self._listeners.pop(user_id, None)
+
+    async def record_deleted(self, user_id: str, docs: Iterable[Dict]):
+        """Leave tombstones for deleted emails"""
+        docs = list(docs)
+        if not docs:
+            return
+        now = datetime.utcnow()
+        async with self.sequence(user_id, len(docs)) as first:
+            await self.tombstone_collection.insert_many([
+                {
+                    "user_id": user_id,
+                    "email_id": str(doc["_id"]),
+                    "message_id": doc.get("message_id"),
+                    "thread_id": doc.get("thread_id"),
+                    "change_seq": first + offset,
+                    "deleted_at": now
+                }
+                for offset, doc in enumerate(docs)
+            ], ordered=False)
+
+    async def stable_head(self, user_id: str) -> int:
+        """Highest sequence number up to which every reserved write has committed"""
+        # Reservations are registered under the same lock, so none can slip between the two reads
+        async with self._lock(user_id):
+            state = await self.sync_state_collection.find_one({"user_id": user_id}, {"change_seq": 1})
+            head = (state or {}).get("change_seq", 0)
+            inflight = self._inflight.get(user_id)
+            if inflight:
+                head = min(head, min(inflight) - 1)
+            return head
+
+    def _lock(self, user_id: str) -> asyncio.Lock:
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        return lock
+
+
+change_feed = ChangeFeed()
@@ -1,35 +1,115 @@
 
 
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+from google_auth_httplib2 import AuthorizedHttp
 from bson.objectid import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 import base64
+from email.utils import getaddresses
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime
 from typing import List, Optional, Dict
 from motor.motor_asyncio import AsyncIOMotorCollection
-from db.mongodb import get_email_collection
+from db.mongodb import get_email_collection, get_sync_state_collection
 from services.user_service_client import user_service_client
+from services.fake_gmail import get_fake_gmail_service
+from services.gmail_client_cache import GmailClientCache
+from services.gmail_discovery import build_gmail_client
+from services.mailbox_counters import mailbox_counters, email_delta, change_delta, merge_deltas
+from services.body_store import body_store, body_terms
+from services.thread_store import thread_store
+from services.gmail_quota import gmail_limiter, is_rate_limited, is_retryable
+from services.label_sync import label_sync_queue, GMAIL_BATCH_MODIFY_LIMIT
+from services.change_feed import change_feed, encode_change_token, decode_change_token
+from services.attachment_cache import attachment_cache
+from services.message_parsing import decode_body_data, html_to_text, header_map, rfc_headers_from
 from config import settings
 import asyncio
+import html
+import re
+import httplib2
+import json
+import time
+
+DUPLICATE_KEY_ERROR = 11000
+SNIPPET_LENGTH = 200
+
+# Mailbox list views only need metadata and a preview, never the full body.
+# Emails stored before snippets existed get a preview derived from the body server-side.
+LIST_PROJECTION = {
+    "user_id": 1,
+    "message_id": 1,
+    "thread_id": 1,
+    "subject": 1,
+    "sender": 1,
+    "recipients": 1,
+    "timestamp": 1,
+    "read": 1,
+    "labels": 1,
+    "trashed": 1,
+    "updated_at": 1,
+    "snippet": {"$ifNull": ["$snippet", {"$substrCP": [{"$ifNull": ["$body", ""]}, 0, SNIPPET_LENGTH]}]}
+}
+
+
+# Bulk actions; label changes go through label_sync_queue, "delete" uses batchDelete
+BULK_ACTIONS = ("mark_read", "mark_unread", "trash", "delete")
+
+
+class InvalidPageCursor(ValueError):
+    """Raised when a client sends a cursor we did not issue"""
+    pass
+
+
+def encode_page_cursor(email: Dict) -> str:
+    """Opaque keyset cursor pointing just after the given email"""
+    raw = json.dumps({"t": email["timestamp"].isoformat(), "id": str(email["_id"])})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_page_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return datetime.fromisoformat(data["t"]), ObjectId(data["id"])
+    except Exception:
+        raise InvalidPageCursor("Invalid page cursor")
+
 
 class EmailService:
     """Service for handling email operations"""
     
     def __init__(self):
         self.email_collection = get_email_collection()
+        self.gmail_client_cache = GmailClientCache(
+            max_size=settings.GMAIL_CLIENT_CACHE_SIZE,
+            max_age_seconds=settings.GMAIL_CLIENT_CACHE_TTL
+        )
+        self.sync_state_collection = get_sync_state_collection()
+        self._count_cache: Dict[str, Dict[str, tuple]] = {}
+        self._own_addresses: Dict[str, str] = {}
     
     async def get_gmail_service(self, user_id: str):  # NOT async - just gets credentials
         """Get Gmail API service for the user"""
-        # Get user's Google token from user service (synchronous call)
+        if settings.USE_FAKE_GMAIL:
+            return get_fake_gmail_service(user_id, settings.FAKE_GMAIL_MAILBOX_SIZE)
+
+        # The token comes from the profile cache, so this is usually served from memory
         user_data = await user_service_client.get_user_profile(user_id)
-        print(f"[DEBUG] User data fetched for user_id {user_id}: {user_data}")
         if not user_data or not user_data.get("google_token"):
             return None
-        
+
         token_info = user_data["google_token"]
+        fingerprint = GmailClientCache.fingerprint(token_info)
+
+        # Cached client skips the discovery build; a client built from a replaced token is not served
+        service = self.gmail_client_cache.get(user_id, fingerprint)
+        if service:
+            return service
         
         try:
             credentials = Credentials(
@@ -40,15 +120,81 @@ class EmailService:
                 client_secret=token_info["client_secret"],
                 scopes=token_info["scopes"]
             )
-            loop = asyncio.get_running_loop()
-            service = await loop.run_in_executor(None,lambda: build('gmail', 'v1', credentials=credentials))
+
+            # httplib2.Http is not thread-safe, and a cached client is shared by executor
+            # threads, so every request gets its own authorized Http object
+            def build_request(http, *args, **kwargs):
+                return HttpRequest(AuthorizedHttp(credentials, http=httplib2.Http()), *args, **kwargs)
+
+            # Built from the vendored discovery document, so this is cheap and needs no network
+            service = build_gmail_client(credentials=credentials, requestBuilder=build_request)
+            self.gmail_client_cache.put(user_id, fingerprint, service, token_info.get("expiry"))
             return service
             
         except Exception as e:
             print(f"Error creating Gmail service: {str(e)}")
             return None
-    
 
+    def invalidate_gmail_service(self, user_id: str):
+        """Drop the user's cached Gmail client so the next call rebuilds it"""
+        self.gmail_client_cache.invalidate(user_id)
+
+    def invalidate_user_credentials(self, user_id: str):
+        """The user's Google token changed: drop the cached profile and the client built from it"""
+        user_service_client.invalidate_profile(user_id)
+        self.invalidate_gmail_service(user_id)
+
+    def _handle_gmail_error(self, user_id: str, error: HttpError):
+        """Gmail rejected the credentials: the cached client and profile must not be reused"""
+        if getattr(error.resp, 'status', None) == 401:
+            self.invalidate_user_credentials(user_id)
+
+    async def remember_own_address(self, user_id: str, email_address: Optional[str]):
+        """Cache the user's Gmail address from a getProfile response we already made"""
+        if not email_address or self._own_addresses.get(user_id) == email_address:
+            return
+        self._own_addresses[user_id] = email_address
+        await self.sync_state_collection.update_one(
+            {"user_id": user_id},
+            {"$set": {"email_address": email_address}},
+            upsert=True
+        )
+
+    async def _get_own_address(self, user_id: str, service) -> str:
+        """The user's own address: memory, then sync state, then one getProfile call"""
+        if user_id in self._own_addresses:
+            return self._own_addresses[user_id]
+
+        state = await self.sync_state_collection.find_one({"user_id": user_id}, {"email_address": 1})
+        if state and state.get("email_address"):
+            self._own_addresses[user_id] = state["email_address"]
+            return state["email_address"]
+
+        profile = await gmail_limiter.execute(
+            user_id, "getProfile",
+            lambda: service.users().getProfile(userId='me').execute()
+        )
+        await self.remember_own_address(user_id, profile.get('emailAddress'))
+        return profile.get('emailAddress', '')
+
+    async def _get_rfc_headers(self, user_id: str, service, email: Dict) -> Dict:
+        """Stored threading headers; emails ingested before they were kept are fetched once and backfilled"""
+        if email.get("headers"):
+            return email["headers"]
+
+        msg = await gmail_limiter.execute(
+            user_id, "messages.get",
+            lambda: service.users().messages().get(
+                userId='me',
+                id=email['message_id'],
+                format='metadata',
+                metadataHeaders=['From', 'To', 'Cc', 'Date', 'Message-ID', 'References', 'In-Reply-To']
+            ).execute()
+        )
+        headers = header_map(msg.get('payload', {}).get('headers'))
+        rfc_headers = rfc_headers_from(headers, email.get('sender', ''))
+        await self.email_collection.update_one({"_id": email["_id"]}, {"$set": {"headers": rfc_headers}})
+        return rfc_headers
 
     async def fetch_emails(self, user_id: str) -> Dict:
         service = await self.get_gmail_service(user_id)
@@ -56,13 +202,10 @@ class EmailService:
             return {"success": False, "error": "Gmail service not available"}
         
         try:
-            #This way, the blocking Gmail call runs in a separate thread, and your async app isn’t blocked.
-
-            loop = asyncio.get_running_loop()
             
-            # Gmail API call in executor (list messages)
-            results = await loop.run_in_executor(
-                None,
+            # Gmail API call under the shared quota limiter (list messages)
+            results = await gmail_limiter.execute(
+                user_id, "messages.list",
                 lambda: service.users().messages().list(
                     userId='me', 
                     maxResults=settings.EMAIL_FETCH_BATCH_SIZE
@@ -70,30 +213,9 @@ class EmailService:
             )
             
             messages = results.get('messages', [])
-            processed_count = 0
-            
-            for message in messages:
-                # Async check in MongoDB
-                existing = await self.email_collection.find_one({
-                    "user_id": user_id,
-                    "message_id": message['id']
-                })
-                if existing:
-                    continue
-                # Gmail API call in executor (get message)
-                msg = await loop.run_in_executor(
-                    None,
-                    lambda: service.users().messages().get(
-                        userId='me',
-                        id=message['id'],
-                        format='full'
-                    ).execute()
-                )
-                
-                email_data = self._parse_email_message(msg, user_id)
-                if email_data:
-                    await self.email_collection.insert_one(email_data)
-                    processed_count += 1
+            processed_count = await self._store_new_messages(
+                user_id, service, [message['id'] for message in messages]
+            )
 
             return {
                 "success": True, 
@@ -102,25 +224,170 @@ class EmailService:
             }
             
         except HttpError as e:
+            self._handle_gmail_error(user_id, e)
             return {"success": False, "error": f"Gmail API error: {str(e)}"}
         except Exception as e:
             return {"success": False, "error": f"Unexpected error: {str(e)}"}
 
     
+    async def _store_new_messages(self, user_id: str, service, message_ids: List[str]) -> int:
+        """Download and store the given Gmail messages that are not in the database yet"""
+        if not message_ids:
+            return 0
+
+        # One $in query resolves which candidates are already stored
+        cursor = self.email_collection.find(
+            {"user_id": user_id, "message_id": {"$in": message_ids}},
+            {"message_id": 1, "_id": 0}
+        )
+        existing_ids = {doc["message_id"] async for doc in cursor}
+        new_message_ids = [message_id for message_id in message_ids if message_id not in existing_ids]
+
+        # Gmail API calls under the shared quota limiter (get messages, batched or serial)
+        full_messages = await self._get_messages(user_id, service, new_message_ids)
+
+        documents = []
+        for msg in full_messages:
+            email_data = self._parse_email_message(msg, user_id)
+            if email_data:
+                documents.append(email_data)
+
+        return await self._insert_emails(documents)
+
+    async def _insert_emails(self, documents: List[Dict]) -> int:
+        """Bulk insert parsed emails; rows already stored by a concurrent sync are skipped"""
+        if not documents:
+            return 0
+
+        user_id = documents[0]["user_id"]
+        self._invalidate_counts(user_id)
+
+        # Bodies go to the compressed body store, keyed by the _id the insert assigns
+        bodies = [doc.pop("body", "") for doc in documents]
+        rejected = set()
+        async with change_feed.sequence(user_id, len(documents)) as first_seq:
+            for offset, doc in enumerate(documents):
+                doc["change_seq"] = doc["created_seq"] = first_seq + offset
+            try:
+                await self.email_collection.insert_many(documents, ordered=False)
+            except BulkWriteError as e:
+                # The unique (user_id, message_id) index rejects duplicates, everything else was inserted
+                write_errors = e.details.get("writeErrors", [])
+                unexpected = [error for error in write_errors if error.get("code") != DUPLICATE_KEY_ERROR]
+                if unexpected:
+                    raise
+                rejected = {error["index"] for error in write_errors}
+
+        inserted = [doc for index, doc in enumerate(documents) if index not in rejected]
+        await body_store.put_many(user_id, {
+            documents[index]["_id"]: body for index, body in enumerate(bodies) if index not in rejected
+        })
+        await mailbox_counters.apply(user_id, merge_deltas(email_delta(doc) for doc in inserted))
+        await thread_store.refresh(user_id, (doc.get("thread_id") for doc in inserted))
+        return len(inserted)
+
+    async def _get_messages(self, user_id: str, service, message_ids: List[str],
+                            message_format: str = 'full') -> List[Dict]:
+        """Get Gmail messages, grouped into batch HTTP requests unless serial mode is configured"""
+        if settings.EMAIL_FETCH_MODE != "batch":
+            full_messages = []
+            for message_id in message_ids:
+                try:
+                    msg = await gmail_limiter.execute(
+                        user_id, "messages.get",
+                        lambda: service.users().messages().get(
+                            userId='me',
+                            id=message_id,
+                            format=message_format
+                        ).execute()
+                    )
+                except HttpError as e:
+                    # Deleted since it was listed: skipped, as in batch mode
+                    if e.resp.status != 404:
+                        raise
+                    continue
+                full_messages.append(msg)
+            return full_messages
+
+        loop = asyncio.get_running_loop()
+        responses = {}
+        batch_size = max(1, min(settings.GMAIL_BATCH_SIZE, 100))
+        for start in range(0, len(message_ids), batch_size):
+            pending = message_ids[start:start + batch_size]
+            attempt = 0
+            while pending:
+                # Every message inside a batch is charged as its own messages.get
+                await gmail_limiter.acquire(user_id, "messages.get", count=len(pending))
+                fetched, failed = await loop.run_in_executor(
+                    None, self._execute_batch_get, service, pending, message_format
+                )
+                responses.update(fetched)
+                if not failed:
+                    break
+                errors = list(failed.values())
+                if attempt >= gmail_limiter.max_retries:
+                    # Skipping them would leave holes; callers (e.g. backfill) decide whether to pause
+                    gmail_limiter.stats["failures"] += 1
+                    raise errors[0]
+
+                # Only the throttled or transiently failed messages are asked for again
+                if any(is_rate_limited(error) for error in errors):
+                    # The penalty makes the next acquire() wait
+                    gmail_limiter.on_rate_limited(user_id, attempt, errors[0])
+                else:
+                    await asyncio.sleep(gmail_limiter.backoff_delay(attempt, errors[0]))
+                gmail_limiter.stats["retries"] += 1
+                pending = [message_id for message_id in pending if message_id in failed]
+                attempt += 1
+
+        # Keep the listing order; messages that failed for good are skipped
+        return [responses[message_id] for message_id in message_ids if message_id in responses]
+
+    def _execute_batch_get(self, service, message_ids: List[str], message_format: str = 'full') -> tuple:  # Sync
+        """
+        Get a chunk of messages in a single Gmail batch HTTP request.
+        Returns ({message_id: message}, {message_id: error}) where the errors are the
+        retryable ones (rate limits, 5xx); other failures are logged and dropped.
+        """
+        responses = {}
+        failed = {}
+
+        def on_response(request_id, response, exception):
+            if exception is not None:
+                if is_retryable(exception):
+                    failed[request_id] = exception
+                else:
+                    print(f"Error getting message {request_id} in batch: {str(exception)}")
+                return
+            responses[request_id] = response
+
+        batch = service.new_batch_http_request(callback=on_response)
+        for message_id in message_ids:
+            batch.add(
+                service.users().messages().get(userId='me', id=message_id, format=message_format),
+                request_id=message_id
+            )
+        batch.execute()
+        return responses, failed
+
     def _parse_email_message(self, msg: Dict, user_id: str) -> Optional[Dict]:  # Sync
         """Parse Gmail API message format into our email format"""
         try:
             # Extract headers
-            headers = msg['payload']['headers']
-            subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
-            sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown')
+            headers = header_map(msg['payload'].get('headers'))
+            subject = headers.get('subject', 'No Subject')
+            sender = headers.get('from', 'Unknown')
             
             # Extract recipients
-            to_header = next((h['value'] for h in headers if h['name'].lower() == 'to'), '')
+            to_header = headers.get('to', '')
             recipients = [r.strip() for r in to_header.split(',')] if to_header else []
+            cc_header = headers.get('cc', '')
+
+            # Threading headers, kept so reply/forward never re-download the message
+            rfc_headers = rfc_headers_from(headers, sender)
             
-            # Extract body
-            body = self._extract_email_body(msg['payload'])
+            # Extract body and attachment metadata
+            body, body_truncated, attachments = self._extract_content(msg['payload'])
             
             # Parse timestamp
             internal_date = int(msg['internalDate']) / 1000
@@ -128,6 +395,9 @@ class EmailService:
             
             # Get labels
             labels = msg.get('labelIds', [])
+
+            # Gmail's own snippet is HTML-escaped plain text; fall back to the start of the body
+            snippet = html.unescape(msg.get('snippet') or '') or body[:SNIPPET_LENGTH]
             
             return {
                 "user_id": user_id,
@@ -136,7 +406,13 @@ class EmailService:
                 "subject": subject,
                 "sender": sender,
                 "recipients": recipients,
+                "cc": [r.strip() for r in cc_header.split(',')] if cc_header else [],
+                "headers": rfc_headers,
                 "body": body,
+                "body_terms": body_terms(body),
+                "body_truncated": body_truncated,
+                "attachments": attachments,
+                "snippet": snippet[:SNIPPET_LENGTH],
                 "timestamp": timestamp,
                 "read": 'UNREAD' not in labels,
                 "labels": labels
@@ -147,20 +423,108 @@ class EmailService:
     
     def _extract_email_body(self, payload: Dict) -> str:  # Sync
         """Extract email body from Gmail API payload"""
-        body = ""
-        
-        if 'parts' in payload:
-            for part in payload['parts']:
-                if part.get('mimeType') == 'text/plain':
-                    if 'data' in part['body']:
-                        body_bytes = base64.urlsafe_b64decode(part['body']['data'])
-                        body = body_bytes.decode('utf-8', errors='replace')
-                        break
-        elif 'body' in payload and 'data' in payload['body']:
-            body_bytes = base64.urlsafe_b64decode(payload['body']['data'])
-            body = body_bytes.decode('utf-8', errors='replace')
-        
+        body, _, _ = self._extract_content(payload)
         return body
+
+    def _extract_content(self, payload: Dict):  # Sync
+        """
+        Walk the MIME tree once: the body (first text/plain part, else the first text/html
+        part stripped to text, capped at MAX_BODY_BYTES), whether it was truncated, and
+        metadata for every attachment. Attachment bytes are never downloaded here.
+        """
+        plain_part, html_part, attachments = None, None, []
+        stack = [payload]
+        while stack:
+            part = stack.pop()
+            if part.get('parts'):
+                # Reverse so parts are visited in document order
+                stack.extend(reversed(part['parts']))
+                continue
+
+            mime_type = (part.get('mimeType') or '').lower()
+            part_body = part.get('body') or {}
+            if part.get('filename') or part_body.get('attachmentId'):
+                attachments.append({
+                    "attachment_id": part_body.get('attachmentId'),
+                    "part_id": part.get('partId'),
+                    "filename": part.get('filename') or 'attachment',
+                    "mime_type": mime_type or 'application/octet-stream',
+                    "size": part_body.get('size', 0)
+                })
+            elif 'data' not in part_body:
+                continue
+            elif mime_type == 'text/html':
+                html_part = html_part or part_body
+            elif plain_part is None and mime_type in ('text/plain', ''):
+                plain_part = part_body
+
+        if plain_part is not None:
+            body, truncated = decode_body_data(plain_part['data'], settings.MAX_BODY_BYTES)
+        elif html_part is not None:
+            markup, truncated = decode_body_data(html_part['data'], settings.MAX_BODY_BYTES)
+            body = html_to_text(markup)
+        else:
+            body, truncated = "", False
+
+        return body, truncated, attachments
+
+    async def get_attachment(self, user_id: str, email_id: str, attachment_id: str) -> Optional[Dict]:
+        """
+        Locate one attachment of a stored email in the disk cache, downloading it from
+        Gmail on first use. Returns its metadata and the cached file's path and size.
+        """
+        if not ObjectId.is_valid(email_id):
+            return None
+        email = await self.email_collection.find_one(
+            {"_id": ObjectId(email_id), "user_id": user_id},
+            {"message_id": 1, "attachments": 1}
+        )
+        if not email:
+            return None
+
+        attachment = next(
+            (a for a in email.get("attachments") or [] if a.get("attachment_id") == attachment_id),
+            None
+        )
+        if not attachment:
+            return None
+
+        # Emails remember the content hash of attachments downloaded before
+        cached = await attachment_cache.get(attachment["sha256"]) if attachment.get("sha256") else None
+        if cached:
+            digest = attachment["sha256"]
+            path, size = cached
+        else:
+            service = await self.get_gmail_service(user_id)
+            if not service:
+                raise RuntimeError("Gmail service not available")
+
+            try:
+                response = await gmail_limiter.execute(
+                    user_id, "messages.attachments.get",
+                    lambda: service.users().messages().attachments().get(
+                        userId='me',
+                        messageId=email['message_id'],
+                        id=attachment_id
+                    ).execute()
+                )
+            except HttpError as e:
+                self._handle_gmail_error(user_id, e)
+                raise
+
+            digest, path, size = await attachment_cache.put_base64(response.get('data', ''))
+            await self.email_collection.update_one(
+                {"_id": email["_id"], "attachments.attachment_id": attachment_id},
+                {"$set": {"attachments.$.sha256": digest}}
+            )
+
+        return {
+            "filename": attachment["filename"],
+            "mime_type": attachment["mime_type"],
+            "sha256": digest,
+            "path": path,
+            "size": size
+        }
     
     async def send_email(self, user_id: str, to: List[str], subject: str, body: str, 
                         cc: List[str] = None, bcc: List[str] = None) -> Dict:  # ASYNC - Gmail API
@@ -168,7 +532,7 @@ class EmailService:
         service = await self.get_gmail_service(user_id)  # Sync call
         
         if not service:
-            return {"success": False, "error": "Gmail service not available"}
+            return {"success": False, "error": "Gmail service not available", "retryable": True}
         
         try:
             # Create message
@@ -189,10 +553,14 @@ class EmailService:
             create_message = {'raw': raw}
             
             # Send message (Gmail API call)
-            sent = service.users().messages().send(
-                userId="me", 
-                body=create_message
-            ).execute()
+            sent = await gmail_limiter.execute(
+                user_id, "messages.send",
+                lambda: service.users().messages().send(
+                    userId="me",
+                    body=create_message
+                ).execute(),
+                retry_server_errors=False
+            )
             
             return {
                 "success": True, 
@@ -200,7 +568,7 @@ class EmailService:
             }
             
         except HttpError as e:
-            return {"success": False, "error": f"Gmail API error: {str(e)}"}
+            return self._send_failure(user_id, f"Gmail API error: {str(e)}", e)
         except Exception as e:
             return {"success": False, "error": f"Error sending email: {str(e)}"}
     
@@ -216,6 +584,8 @@ class EmailService:
             if not email:
                 return None
             
+            email["body"] = await body_store.get(email)
+            email.pop("body_terms", None)
             email["id"] = str(email.pop("_id"))
             return email
         except Exception as e:
@@ -224,50 +594,207 @@ class EmailService:
     
 
 
-    async def search_emails(self, user_id: str, filters: Dict) -> List[Dict]:
-        """Async search emails with filters"""
-        try:
-            query = {"user_id": user_id}
+    async def attach_bodies(self, emails: List[Dict]) -> None:
+        """Add "body" to list items (for callers that need full text, like style learning)"""
+        missing = [email for email in emails if "body" not in email]
+        bodies = await body_store.get_many(ObjectId(email["id"]) for email in missing)
+        for email in missing:
+            email["body"] = bodies.get(ObjectId(email["id"]), "")
+
+    def _build_search_query(self, user_id: str, filters: Dict) -> Dict:
+        """Translate API filters into a Mongo query"""
+        query = {"user_id": user_id}
+
+        if filters.get("read") is not None:
+            query["read"] = filters["read"]
+
+        # Sender and subject filters stay substring matches (escaped regex), as before the text index
+        for field in ("sender", "subject"):
+            if filters.get(field):
+                query[field] = {"$regex": re.escape(filters[field]), "$options": "i"}
+
+        # Free text goes through the (user_id, subject/sender/body_terms) text index. Only then are
+        # sender/subject added as phrases to narrow it: candidates already come from the query's
+        # terms and phrases are checked as substrings. On their own, a phrase would need whole
+        # indexed words and "ali" would no longer find alice@example.com.
+        text_terms = []
+        if filters.get("query") and filters["query"].replace('"', ' ').strip():
+            text_terms.append(filters["query"].replace('"', ' '))
+            for field in ("sender", "subject"):
+                if filters.get(field) and filters[field].replace('"', ' ').strip():
+                    text_terms.append(f'"{filters[field].replace(chr(34), " ")}"')
 
-            if filters.get("read") is not None:
-                query["read"] = filters["read"]
+        if text_terms:
+            query["$text"] = {"$search": " ".join(text_terms)}
 
-            if filters.get("sender"):
-                query["sender"] = {"$regex": filters["sender"], "$options": "i"}
+        if filters.get("from_date") or filters.get("to_date"):
+            date_filter = {}
+            if filters.get("from_date"):
+                date_filter["$gte"] = filters["from_date"]
+            if filters.get("to_date"):
+                date_filter["$lte"] = filters["to_date"]
+            query["timestamp"] = date_filter
 
-            if filters.get("subject"):
-                query["subject"] = {"$regex": filters["subject"], "$options": "i"}
+        if filters.get("labels"):
+            query["labels"] = {"$in": filters["labels"]}
 
-            if filters.get("query"):
-                query["$or"] = [
-                    {"subject": {"$regex": filters["query"], "$options": "i"}},
-                    {"body": {"$regex": filters["query"], "$options": "i"}},
-                    {"sender": {"$regex": filters["query"], "$options": "i"}}
-                ]
+        return query
 
-            if filters.get("from_date") or filters.get("to_date"):
-                date_filter = {}
-                if filters.get("from_date"):
-                    date_filter["$gte"] = filters["from_date"]
-                if filters.get("to_date"):
-                    date_filter["$lte"] = filters["to_date"]
-                query["timestamp"] = date_filter
+    async def search_emails(self, user_id: str, filters: Dict, skip: int = 0, limit: int = 20,
+                            cursor: Optional[str] = None, projection: Optional[Dict] = None,
+                            sort: str = "date") -> Dict:
+        """Async search emails with filters, paginated inside Mongo.
 
-            if filters.get("labels"):
-                query["labels"] = {"$in": filters["labels"]}
+        With a cursor (returned as next_cursor by the previous page) the page is read with a
+        (timestamp, _id) keyset seek, otherwise with skip/limit. Pass LIST_PROJECTION to
+        leave bodies out of list pages. sort="relevance" orders text searches by text score
+        and pages with skip/limit only.
+        """
+        try:
+            query = self._build_search_query(user_id, filters)
+
+            if sort == "relevance" and "$text" in query:
+                projection = {**(projection or {}), "score": {"$meta": "textScore"}}
+                db_cursor = self.email_collection.find(query, projection).sort(
+                    [("score", {"$meta": "textScore"}), ("timestamp", -1)]
+                ).skip(skip).limit(limit + 1)
+                results = await db_cursor.to_list(length=limit + 1)
+
+                has_more = len(results) > limit
+                results = results[:limit]
+                for email in results:
+                    email["id"] = str(email.pop("_id"))
+                return {"emails": results, "has_more": has_more, "next_cursor": None}
+
+            if cursor:
+                timestamp, last_id = decode_page_cursor(cursor)
+                query.setdefault("$and", []).append({"$or": [
+                    {"timestamp": {"$lt": timestamp}},
+                    {"timestamp": timestamp, "_id": {"$lt": last_id}}
+                ]})
+                skip = 0
 
-            cursor = self.email_collection.find(query).sort("timestamp", -1)
-            results = await cursor.to_list(length=None)
+            # Read one extra row to know whether another page exists
+            db_cursor = self.email_collection.find(query, projection).sort(
+                [("timestamp", -1), ("_id", -1)]
+            ).skip(skip).limit(limit + 1)
+            results = await db_cursor.to_list(length=limit + 1)
+
+            has_more = len(results) > limit
+            results = results[:limit]
+            next_cursor = encode_page_cursor(results[-1]) if has_more else None
 
             # Convert ObjectId to str
             for email in results:
                 email["id"] = str(email.pop("_id"))
 
-            return results
+            return {"emails": results, "has_more": has_more, "next_cursor": next_cursor}
 
+        except InvalidPageCursor:
+            raise
         except Exception as e:
             print(f"Error searching emails: {str(e)}")
-            return []
+            return {"emails": [], "has_more": False, "next_cursor": None}
+
+    async def count_emails(self, user_id: str, filters: Dict) -> int:
+        """Count matching emails; results are cached briefly since totals are only informative"""
+        key = json.dumps(filters, sort_keys=True, default=str)
+        user_counts = self._count_cache.get(user_id, {})
+        cached = user_counts.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        total = await self.email_collection.count_documents(self._build_search_query(user_id, filters))
+
+        if settings.EMAIL_COUNT_CACHE_TTL > 0:
+            if len(self._count_cache) >= settings.EMAIL_COUNT_CACHE_MAX_USERS:
+                self._count_cache.clear()
+            self._count_cache.setdefault(user_id, {})[key] = (
+                time.monotonic() + settings.EMAIL_COUNT_CACHE_TTL, total
+            )
+        return total
+
+    def _invalidate_counts(self, user_id: str):
+        self._count_cache.pop(user_id, None)
+
+    async def get_email_stats(self, user_id: str) -> Dict:
+        """Mailbox totals, today/this-week counts and per-label counts from the counters document"""
+        return await mailbox_counters.get_stats(user_id)
+
+    async def list_threads(self, user_id: str, limit: int = 20, cursor: Optional[str] = None,
+                           label: Optional[str] = None) -> Dict:
+        """Conversation view: threads by latest message, keyset-paginated like search_emails"""
+        await thread_store.ensure_built(user_id)
+
+        query = {"user_id": user_id}
+        if label:
+            query["labels"] = label
+        if cursor:
+            last_message_at, last_id = decode_page_cursor(cursor)
+            query["$or"] = [
+                {"last_message_at": {"$lt": last_message_at}},
+                {"last_message_at": last_message_at, "_id": {"$lt": last_id}}
+            ]
+
+        threads = await thread_store.thread_collection.find(query).sort(
+            [("last_message_at", -1), ("_id", -1)]
+        ).limit(limit + 1).to_list(length=limit + 1)
+
+        has_more = len(threads) > limit
+        threads = threads[:limit]
+        next_cursor = None
+        if has_more and threads:
+            last = threads[-1]
+            next_cursor = encode_page_cursor({"timestamp": last["last_message_at"], "_id": last["_id"]})
+
+        for thread in threads:
+            thread["id"] = str(thread.pop("_id"))
+        return {"threads": threads, "has_more": has_more, "next_cursor": next_cursor}
+
+    async def list_changes(self, user_id: str, since: Optional[str] = None, limit: int = 100) -> Dict:
+        """
+        Emails inserted or updated and emails deleted since a change token, oldest change first.
+        Without a token only the current token is returned (call it after a full page load).
+        Raises InvalidChangeToken / ExpiredChangeToken for tokens that cannot be served.
+        """
+        head = await change_feed.stable_head(user_id)
+        if not since:
+            return {"changes": [], "deleted": [], "has_more": False, "token": encode_change_token(user_id, head)}
+
+        merged = await self.changes_after(user_id, decode_change_token(since, user_id, head), head, limit + 1)
+        has_more = len(merged) > limit
+        merged = merged[:limit]
+        next_seq = merged[-1][1]["change_seq"] if has_more else head
+
+        changed = [doc for kind, doc in merged if kind != "deleted"]
+        deleted = [doc for kind, doc in merged if kind == "deleted"]
+        return {"changes": changed, "deleted": deleted, "has_more": has_more, "token": encode_change_token(user_id, next_seq)}
+
+    async def changes_after(self, user_id: str, last_seq: int, head: int, limit: int) -> List[tuple]:
+        """
+        Up to `limit` changes in (last_seq, head] in sequence order, as ("created" | "updated" |
+        "deleted", document) pairs; "created" means the email arrived after last_seq.
+        """
+        seq_range = {"$gt": last_seq, "$lte": head}
+        projection = {**LIST_PROJECTION, "change_seq": 1, "created_seq": 1}
+        emails = await self.email_collection.find(
+            {"user_id": user_id, "change_seq": seq_range}, projection
+        ).sort("change_seq", 1).limit(limit).to_list(length=limit)
+        tombstones = await change_feed.tombstone_collection.find(
+            {"user_id": user_id, "change_seq": seq_range},
+            {"_id": 0, "email_id": 1, "message_id": 1, "thread_id": 1, "change_seq": 1}
+        ).sort("change_seq", 1).limit(limit).to_list(length=limit)
+
+        changes = []
+        for email in emails:
+            email["id"] = str(email.pop("_id"))
+            kind = "created" if email.get("created_seq", 0) > last_seq else "updated"
+            changes.append((kind, email))
+        changes.extend(("deleted", tombstone) for tombstone in tombstones)
+
+        # Merge both streams in sequence order and cut at the limit
+        changes.sort(key=lambda item: item[1]["change_seq"])
+        return changes[:limit]
 
 
     async def delete_email(self, user_id: str, email_id: str) -> bool:
@@ -290,7 +817,8 @@ class EmailService:
                     # 2. Get Gmail service for this user (async)
                     service = await self.get_gmail_service(user_id)
                     # 3. Delete message from Gmail (run in thread to avoid blocking)
-                    await asyncio.to_thread(
+                    await gmail_limiter.execute(
+                        user_id, "messages.delete",
                         lambda: service.users().messages().delete(
                             userId='me',
                             id=gmail_message_id
@@ -298,16 +826,25 @@ class EmailService:
                     )
                     print(f"Gmail message {gmail_message_id} deleted")
                 except HttpError as e:
+                    self._handle_gmail_error(user_id, e)
                     print(f"Gmail API error: {e}")
                     return False
 
             # 4. Delete from your DB (async)
+            self._invalidate_counts(user_id)
             result = await self.email_collection.delete_one({
                 "_id": ObjectId(email_id),
                 "user_id": user_id
             })
 
-            return result.deleted_count > 0
+            if result.deleted_count > 0:
+                await body_store.delete_many([email_doc["_id"]])
+                await label_sync_queue.discard(user_id, [gmail_message_id])
+                await change_feed.record_deleted(user_id, [email_doc])
+                await mailbox_counters.apply(user_id, email_delta(email_doc, -1))
+                await thread_store.refresh(user_id, [email_doc.get("thread_id")])
+                return True
+            return False
 
         except Exception as e:
             print(f"Error deleting email: {str(e)}")
@@ -323,78 +860,39 @@ class EmailService:
                 "updated_at": datetime.utcnow()
             }
             
-            result = await self.email_collection.update_one(
-                {"_id": ObjectId(email_id), "user_id": user_id},
-                {"$set": updates_with_timestamp}
-            )
+            self._invalidate_counts(user_id)
+            async with change_feed.sequence(user_id) as seq:
+                before = await self.email_collection.find_one_and_update(
+                    {"_id": ObjectId(email_id), "user_id": user_id},
+                    {"$set": {**updates_with_timestamp, "change_seq": seq}},
+                    return_document=ReturnDocument.BEFORE
+                )
             
-            return result.matched_count > 0
+            if not before:
+                return False
+            await mailbox_counters.apply(user_id, change_delta(before, {**before, **updates}))
+            await thread_store.refresh(user_id, [before.get("thread_id")])
+            return True
         except Exception as e:
             print(f"Error updating email {email_id} for user {user_id}: {str(e)}")
             return False
         
 
     async def mark_email_read(self, user_id: str, email_id: str) -> Dict:
-        """Mark email as read in database AND in Gmail"""
+        """Mark email as read in the database; Gmail follows through the write-behind queue"""
         try:
-            # First, get the email from database to get the Gmail message_id
-            email_doc = await self.email_collection.find_one({
-                "_id": ObjectId(email_id),
-                "user_id": user_id
-            })
-            
+            email_doc = await self._set_read(user_id, email_id, True)
             if not email_doc:
                 return {"success": False, "error": "Email not found"}
-            
-            gmail_message_id = email_doc.get("message_id")
-            if not gmail_message_id:
-                return {"success": False, "error": "Gmail message ID not found"}
-            
-            # Get Gmail service
-            service = await self.get_gmail_service(user_id)
-            if not service:
-                return {"success": False, "error": "Gmail service not available"}
-            
-            # Mark as read in Gmail by removing the UNREAD label
-            gmail_success = True
-            loop = asyncio.get_running_loop()
-            try:
-                await loop.run_in_executor(
-                    None,
-                    lambda: service.users().messages().modify(
-                        userId='me',
-                        id=gmail_message_id,
-                        body={'removeLabelIds': ['UNREAD']}
-                    ).execute()
-                )
-                print(f"Successfully marked Gmail message {gmail_message_id} as read")
-            except HttpError as gmail_error:
-                print(f"Gmail API error marking as read: {str(gmail_error)}")
-                gmail_success = False
-            except Exception as gmail_error:
-                print(f"Failed to mark Gmail message as read: {str(gmail_error)}")
-                gmail_success = False
-            
-            # Update in database (always attempt this)
-            result = await self.email_collection.update_one(
-                {"_id": ObjectId(email_id), "user_id": user_id},
-                {"$set": {
-                    "read": True,
-                    "updated_at": datetime.utcnow()
-                }}
-            )
-            
-            if result.matched_count > 0:
-                print(f"Successfully marked email {email_id} as read in database")
-                return {
-                    "success": True,
-                    "gmail_updated": gmail_success,
-                    "database_updated": True,
-                    "message": "Email marked as read"
-                }
-            else:
-                return {"success": False, "error": "Failed to update database"}
-                
+
+            print(f"Successfully marked email {email_id} as read in database")
+            return {
+                "success": True,
+                "gmail_queued": True,
+                "database_updated": True,
+                "message": "Email marked as read"
+            }
+
         except Exception as e:
             print(f"Error marking email {email_id} as read for user {user_id}: {str(e)}")
             return {"success": False, "error": f"Unexpected error: {str(e)}"}
@@ -403,124 +901,230 @@ class EmailService:
 
 #might be redundant
     async def mark_email_unread(self, user_id: str, email_id: str) -> bool:
-        """Mark email as unread in database AND in Gmail"""
+        """Mark email as unread in the database; Gmail follows through the write-behind queue"""
         try:
-            # Get the email from database to get the Gmail message_id
-            email_doc = await self.email_collection.find_one({
-                "_id": ObjectId(email_id), 
-                "user_id": user_id
-            })
-            
+            email_doc = await self._set_read(user_id, email_id, False)
             if not email_doc:
                 print(f"Email {email_id} not found for user {user_id}")
                 return False
-            
-            gmail_message_id = email_doc.get("message_id")
-            if not gmail_message_id:
-                print(f"No Gmail message_id found for email {email_id}")
-                return False
-            
-            # Get Gmail service
-            service = await self.get_gmail_service(user_id)
-            if not service:
-                print(f"Gmail service not available for user {user_id}")
-                return False
-            
-            # Mark as unread in Gmail by adding the UNREAD label
-            loop = asyncio.get_running_loop()
-            try:
-                await loop.run_in_executor(
-                    None,
-                    lambda: service.users().messages().modify(
-                        userId='me',
-                        id=gmail_message_id,
-                        body={'addLabelIds': ['UNREAD']}
-                    ).execute()
-                )
-                print(f"Successfully marked Gmail message {gmail_message_id} as unread")
-            except Exception as gmail_error:
-                print(f"Failed to mark Gmail message as unread: {str(gmail_error)}")
-                # Continue to update database even if Gmail update fails
-            
-            # Update in database
-            result = await self.email_collection.update_one(
-                {"_id": ObjectId(email_id), "user_id": user_id},
-                {"$set": {
-                    "read": False,
-                    "updated_at": datetime.utcnow()
-                }}
-            )
-            
-            if result.matched_count > 0:
-                print(f"Successfully marked email {email_id} as unread in database")
-                return True
-            else:
-                print(f"Failed to update email {email_id} in database")
-                return False
-                
+
+            print(f"Successfully marked email {email_id} as unread in database")
+            return True
+
         except Exception as e:
             print(f"Error marking email {email_id} as unread for user {user_id}: {str(e)}")
             return False
-        
+
+    async def _set_read(self, user_id: str, email_id: str, read: bool) -> Optional[Dict]:
+        """Update the read flag, counters and thread, and queue the Gmail label change"""
+        self._invalidate_counts(user_id)
+        async with change_feed.sequence(user_id) as seq:
+            email_doc = await self.email_collection.find_one_and_update(
+                {"_id": ObjectId(email_id), "user_id": user_id},
+                {"$set": {"read": read, "updated_at": datetime.utcnow(), "change_seq": seq}},
+                return_document=ReturnDocument.BEFORE
+            )
+        if not email_doc:
+            return None
+
+        await mailbox_counters.apply(user_id, change_delta(email_doc, {**email_doc, "read": read}))
+        await thread_store.refresh(user_id, [email_doc.get("thread_id")])
+        await label_sync_queue.enqueue(user_id, [email_doc.get("message_id")], read=read)
+        return email_doc
 
     async def move_to_trash(self, user_id: str, email_id: str) -> Dict:
-        """Move email to trash in Gmail and update database"""
+        """Move email to trash in the database; Gmail follows through the write-behind queue"""
         try:
-            # 1. Find the email in database to get Gmail message ID
+            # 1. Find the email in database
             email_doc = await self.email_collection.find_one({
                 "_id": ObjectId(email_id),
-                    "user_id": user_id
+                "user_id": user_id
             })
-                
+
             if not email_doc:
                 return {"success": False, "error": "Email not found"}
-                
-            gmail_message_id = email_doc.get("message_id")
-            if not gmail_message_id:
-                return {"success": False, "error": "Gmail message ID not found"}
-                
-            # 2. Get Gmail service
-            service = await self.get_gmail_service(user_id)
-            if not service:
-                return {"success": False, "error": "Gmail service not available"}
-                
-            # 3. Move to trash in Gmail (using executor to avoid blocking)
-            loop = asyncio.get_running_loop()
-            try:
-                await loop.run_in_executor(
-                    None,
-                    lambda: service.users().messages().trash(
-                        userId='me',
-                        id=gmail_message_id
-                    ).execute()
-                )
-            except HttpError as e:
-                return {"success": False, "error": f"Gmail API error: {str(e)}"}
-                
-                # 4. Update database to reflect trash status
-            
-            result = await self.email_collection.update_one(
-                {"_id": ObjectId(email_id), "user_id": user_id},
-                {"$set": {
+
+            # 2. Update database to reflect trash status (Gmail adds TRASH and drops INBOX)
+            trashed_labels = [label for label in email_doc.get("labels", []) if label != "INBOX"]
+            if "TRASH" not in trashed_labels:
+                trashed_labels.append("TRASH")
+
+            self._invalidate_counts(user_id)
+            async with change_feed.sequence(user_id) as seq:
+                result = await self.email_collection.update_one(
+                    {"_id": ObjectId(email_id), "user_id": user_id},
+                    {"$set": {
                         "trashed": True,
-                        "updated_at": datetime.utcnow()
-                }}
+                        "labels": trashed_labels,
+                        "updated_at": datetime.utcnow(),
+                        "change_seq": seq
+                    }}
                 )
-                    
+
             if result.matched_count == 0:
-                    return {"success": False, "error": "Failed to update database"}
-                    
+                return {"success": False, "error": "Failed to update database"}
+
+            await mailbox_counters.apply(user_id, change_delta(email_doc, {**email_doc, "labels": trashed_labels}))
+            await thread_store.refresh(user_id, [email_doc.get("thread_id")])
+
+            # 3. Queue the move for Gmail
+            await label_sync_queue.enqueue(user_id, [email_doc.get("message_id")], trashed=True)
+
             return {
-                    "success": True,
-                    "message": "Email moved to trash successfully"
-                    }
-                
+                "success": True,
+                "message": "Email moved to trash successfully"
+            }
+
+        except Exception as e:
+            print(f"Error moving email {email_id} to trash for user {user_id}: {str(e)}")
+            return {"success": False, "error": f"Unexpected error: {str(e)}"}
+
+
+
+
+    async def bulk_update(self, user_id: str, email_ids: List[str], action: str) -> Dict:
+        """
+        Apply one action ("mark_read", "mark_unread", "trash" or "delete") to many emails:
+        one Mongo read and one Mongo write, with a result per requested id. Label actions
+        reach Gmail through the write-behind queue; deletes are one batchDelete per 1000 ids.
+        """
+        if action not in BULK_ACTIONS:
+            return {"success": False, "error": f"Unknown action: {action}"}
+
+        results = {}
+        object_ids = []
+        for email_id in dict.fromkeys(email_ids):
+            if ObjectId.is_valid(email_id):
+                object_ids.append(ObjectId(email_id))
+            else:
+                results[email_id] = {"email_id": email_id, "success": False, "error": "Invalid email ID"}
+
+        try:
+            docs = await self.email_collection.find(
+                {"_id": {"$in": object_ids}, "user_id": user_id},
+                {"message_id": 1, "thread_id": 1, "read": 1, "labels": 1, "timestamp": 1}
+            ).to_list(length=None)
+            found = {str(doc["_id"]) for doc in docs}
+            for object_id in object_ids:
+                if str(object_id) not in found:
+                    results[str(object_id)] = {"email_id": str(object_id), "success": False, "error": "Email not found"}
+
+            if docs and action == "delete":
+                if not await self._bulk_gmail_delete(user_id, docs):
+                    # Like the single-email route, nothing changes locally when Gmail refused
+                    for doc in docs:
+                        results[str(doc["_id"])] = {"email_id": str(doc["_id"]), "success": False,
+                                                    "error": "Gmail API error"}
+                else:
+                    await self._bulk_database(user_id, docs, action)
+                    for doc in docs:
+                        results[str(doc["_id"])] = {"email_id": str(doc["_id"]), "success": True,
+                                                    "gmail_updated": True}
+            elif docs:
+                await self._bulk_database(user_id, docs, action)
+                for doc in docs:
+                    results[str(doc["_id"])] = {"email_id": str(doc["_id"]), "success": True,
+                                                "gmail_queued": True}
+
+            ordered = [results[email_id] for email_id in dict.fromkeys(email_ids)]
+            succeeded = sum(1 for result in ordered if result["success"])
+            return {
+                "success": succeeded > 0 or not ordered,
+                "action": action,
+                "succeeded": succeeded,
+                "failed": len(ordered) - succeeded,
+                "results": ordered
+            }
         except Exception as e:
-                print(f"Error moving email {email_id} to trash for user {user_id}: {str(e)}")
-                return {"success": False, "error": f"Unexpected error: {str(e)}"}
+            print(f"Error applying bulk {action} for user {user_id}: {str(e)}")
+            return {"success": False, "error": f"Unexpected error: {str(e)}"}
+
+    async def _bulk_gmail_delete(self, user_id: str, docs: List[Dict]) -> bool:
+        """One batchDelete call per 1000 messages; False if Gmail rejected it"""
+        service = await self.get_gmail_service(user_id)
+        if not service:
+            return False
+
+        message_ids = [doc["message_id"] for doc in docs if doc.get("message_id")]
+        try:
+            for start in range(0, len(message_ids), GMAIL_BATCH_MODIFY_LIMIT):
+                chunk = message_ids[start:start + GMAIL_BATCH_MODIFY_LIMIT]
+                await gmail_limiter.execute(
+                    user_id, "messages.batchDelete",
+                    lambda: service.users().messages().batchDelete(userId='me', body={'ids': chunk}).execute()
+                )
+            return True
+        except HttpError as e:
+            self._handle_gmail_error(user_id, e)
+            print(f"Gmail API error applying bulk delete: {str(e)}")
+            return False
+
+    async def _bulk_database(self, user_id: str, docs: List[Dict], action: str):
+        self._invalidate_counts(user_id)
+        ids = [doc["_id"] for doc in docs]
+        now = datetime.utcnow()
+
+        if action == "delete":
+            await self.email_collection.delete_many({"_id": {"$in": ids}, "user_id": user_id})
+            await body_store.delete_many(ids)
+            await label_sync_queue.discard(user_id, (doc.get("message_id") for doc in docs))
+            await change_feed.record_deleted(user_id, docs)
+            deltas = [email_delta(doc, -1) for doc in docs]
+        elif action == "trash":
+            changes = {}
+            for doc in docs:
+                labels = [label for label in doc.get("labels", []) if label != "INBOX"]
+                if "TRASH" not in labels:
+                    labels.append("TRASH")
+                changes[doc["_id"]] = labels
+            async with change_feed.sequence(user_id, len(changes)) as first_seq:
+                await self.email_collection.bulk_write([
+                    UpdateOne({"_id": email_id, "user_id": user_id},
+                              {"$set": {"trashed": True, "labels": labels, "updated_at": now,
+                                        "change_seq": first_seq + offset}})
+                    for offset, (email_id, labels) in enumerate(changes.items())
+                ], ordered=False)
+            deltas = [change_delta(doc, {**doc, "labels": changes[doc["_id"]]}) for doc in docs]
+            await label_sync_queue.enqueue(user_id, (doc.get("message_id") for doc in docs), trashed=True)
+        else:
+            read = action == "mark_read"
+            # One write per email: each gets its own change sequence number
+            async with change_feed.sequence(user_id, len(ids)) as first_seq:
+                await self.email_collection.bulk_write([
+                    UpdateOne({"_id": email_id, "user_id": user_id},
+                              {"$set": {"read": read, "updated_at": now, "change_seq": first_seq + offset}})
+                    for offset, email_id in enumerate(ids)
+                ], ordered=False)
+            deltas = [change_delta(doc, {**doc, "read": read}) for doc in docs]
+            await label_sync_queue.enqueue(user_id, (doc.get("message_id") for doc in docs), read=read)
 
+        await mailbox_counters.apply(user_id, merge_deltas(deltas))
+        await thread_store.refresh(user_id, (doc.get("thread_id") for doc in docs))
 
+    @staticmethod
+    def _send_retryable(error: HttpError, sent: bool = True) -> bool:
+        """
+        Whether the outbox may try a failed send again. Rate limits and expired credentials
+        are rejected before anything is sent; outages only count before messages.send was
+        called, since Gmail may have sent the mail before failing.
+        """
+        if error.resp.status == 401 or is_rate_limited(error):
+            return True
+        return not sent and is_retryable(error)
 
+    def _send_failure(self, user_id: str, message: str, error: HttpError) -> Dict:
+        """Result for a messages.send that failed with a Gmail API error"""
+        self._handle_gmail_error(user_id, error)
+        if error.resp.status >= 500:
+            message += "; it may still have been sent, check the Sent folder before sending again"
+        return {"success": False, "error": message, "retryable": self._send_retryable(error)}
+
+    async def email_exists(self, user_id: str, email_id: str) -> bool:
+        if not ObjectId.is_valid(email_id):
+            return False
+        return await self.email_collection.count_documents(
+            {"_id": ObjectId(email_id), "user_id": user_id}, limit=1
+        ) > 0
 
     async def reply_to_email(self, user_id: str, email_id: str, 
                         reply_body: str, reply_to_all: bool = False,
@@ -540,29 +1144,22 @@ class EmailService:
             # 2. Get Gmail service
             service = await self.get_gmail_service(user_id)
             if not service:
-                return {"success": False, "error": "Gmail service not available"}
+                return {"success": False, "error": "Gmail service not available", "retryable": True}
             
-            # 3. Get the original Gmail message to extract reply info
-            loop = asyncio.get_running_loop()
+            # 3. Threading headers were stored at ingest
             try:
-                original_msg = await loop.run_in_executor(
-                    None,
-                    lambda: service.users().messages().get(
-                        userId='me',
-                        id=original_email['message_id'],
-                        format='full'
-                    ).execute()
-                )
+                rfc_headers = await self._get_rfc_headers(user_id, service, original_email)
             except HttpError as e:
-                return {"success": False, "error": f"Could not fetch original message: {str(e)}"}
+                self._handle_gmail_error(user_id, e)
+                return {"success": False, "error": f"Could not fetch original message: {str(e)}",
+                        "retryable": self._send_retryable(e, sent=False)}
             
             # 4. Extract headers for reply
-            headers = original_msg['payload']['headers']
-            original_subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
-            original_sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), '')
-            original_to = next((h['value'] for h in headers if h['name'].lower() == 'to'), '')
-            original_cc = next((h['value'] for h in headers if h['name'].lower() == 'cc'), '')
-            message_id = next((h['value'] for h in headers if h['name'].lower() == 'message-id'), '')
+            original_subject = original_email.get('subject') or 'No Subject'
+            original_sender = rfc_headers.get('from') or original_email.get('sender', '')
+            original_to = rfc_headers.get('to', '')
+            original_cc = rfc_headers.get('cc', '')
+            message_id = rfc_headers.get('message_id', '')
             
             # 5. Build reply message
             reply_message = MIMEMultipart()
@@ -575,22 +1172,14 @@ class EmailService:
             
             if reply_to_all:
                 # Add original recipients to CC (excluding yourself)
-                user_profile = await loop.run_in_executor(
-                    None,
-                    lambda: service.users().getProfile(userId='me').execute()
-                )
-                user_email = user_profile.get('emailAddress', '')
+                user_email = (await self._get_own_address(user_id, service)).lower()
+                sender_addresses = {addr.lower() for _, addr in getaddresses([original_sender])}
                 
-                all_recipients = []
-                if original_to:
-                    all_recipients.extend([email.strip() for email in original_to.split(',')])
-                if original_cc:
-                    all_recipients.extend([email.strip() for email in original_cc.split(',')])
-                
-                # Remove user's own email and original sender
-                reply_all_cc = [email for email in all_recipients 
-                            if email != user_email and email != original_sender]
-                cc_recipients.extend(reply_all_cc)
+                # Compare bare addresses so "Name <me@x.com>" still matches the user's own address
+                for name, addr in getaddresses([original_to, original_cc]):
+                    if not addr or addr.lower() == user_email or addr.lower() in sender_addresses:
+                        continue
+                    cc_recipients.append(f"{name} <{addr}>" if name else addr)
             
             # Add additional CC recipients from request
             if additional_cc:
@@ -614,10 +1203,11 @@ class EmailService:
             
             # Set threading headers for proper conversation grouping
             if message_id:
+                references = rfc_headers.get('references') or rfc_headers.get('in_reply_to') or ''
                 reply_message['In-Reply-To'] = message_id
-                reply_message['References'] = message_id
+                reply_message['References'] = f"{references} {message_id}".strip()
             
-            reply_message['Thread-Index'] = original_msg.get('threadId', '')
+            reply_message['Thread-Index'] = original_email.get('thread_id') or ''
             
             # 6. Add reply body
             reply_message.attach(MIMEText(reply_body, 'plain'))
@@ -626,16 +1216,17 @@ class EmailService:
             raw_message = base64.urlsafe_b64encode(reply_message.as_bytes()).decode()
             send_message = {
                 'raw': raw_message,
-                'threadId': original_msg.get('threadId')  # Keep in same conversation
+                'threadId': original_email.get('thread_id')  # Keep in same conversation
             }
             
             try:
-                sent_message = await loop.run_in_executor(
-                    None,
+                sent_message = await gmail_limiter.execute(
+                    user_id, "messages.send",
                     lambda: service.users().messages().send(
                         userId='me',
                         body=send_message
-                    ).execute()
+                    ).execute(),
+                    retry_server_errors=False
                 )
                 
                 return {
@@ -646,7 +1237,7 @@ class EmailService:
                 }
                 
             except HttpError as e:
-                return {"success": False, "error": f"Failed to send reply: {str(e)}"}
+                return self._send_failure(user_id, f"Failed to send reply: {str(e)}", e)
                 
         except Exception as e:
             print(f"Error replying to email {email_id} for user {user_id}: {str(e)}")
@@ -671,31 +1262,24 @@ class EmailService:
             # 2. Get Gmail service
             service = await self.get_gmail_service(user_id)
             if not service:
-                return {"success": False, "error": "Gmail service not available"}
+                return {"success": False, "error": "Gmail service not available", "retryable": True}
             
-            # 3. Get the original Gmail message to extract content
-            loop = asyncio.get_running_loop()
+            # 3. Headers and body were stored at ingest
             try:
-                original_msg = await loop.run_in_executor(
-                    None,
-                    lambda: service.users().messages().get(
-                        userId='me',
-                        id=original_email['message_id'],
-                        format='full'
-                    ).execute()
-                )
+                rfc_headers = await self._get_rfc_headers(user_id, service, original_email)
             except HttpError as e:
-                return {"success": False, "error": f"Could not fetch original message: {str(e)}"}
+                self._handle_gmail_error(user_id, e)
+                return {"success": False, "error": f"Could not fetch original message: {str(e)}",
+                        "retryable": self._send_retryable(e, sent=False)}
             
             # 4. Extract original email details
-            headers = original_msg['payload']['headers']
-            original_subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
-            original_sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown')
-            original_to = next((h['value'] for h in headers if h['name'].lower() == 'to'), '')
-            original_date = next((h['value'] for h in headers if h['name'].lower() == 'date'), '')
+            original_subject = original_email.get('subject') or 'No Subject'
+            original_sender = rfc_headers.get('from') or original_email.get('sender') or 'Unknown'
+            original_to = rfc_headers.get('to', '')
+            original_date = rfc_headers.get('date', '')
             
             # Extract original body
-            original_body = self._extract_email_body(original_msg['payload'])
+            original_body = await body_store.get(original_email)
             
             # 5. Build forward message
             forward_msg = MIMEMultipart()
@@ -743,12 +1327,13 @@ class EmailService:
             send_message = {'raw': raw_message}
             
             try:
-                sent_message = await loop.run_in_executor(
-                    None,
+                sent_message = await gmail_limiter.execute(
+                    user_id, "messages.send",
                     lambda: service.users().messages().send(
                         userId='me',
                         body=send_message
-                    ).execute()
+                    ).execute(),
+                    retry_server_errors=False
                 )
                 
                 return {
@@ -759,7 +1344,7 @@ class EmailService:
                 }
                 
             except HttpError as e:
-                return {"success": False, "error": f"Failed to forward email: {str(e)}"}
+                return self._send_failure(user_id, f"Failed to forward email: {str(e)}", e)
                 
         except Exception as e:
             print(f"Error forwarding email {email_id} for user {user_id}: {str(e)}")
@@ -0,0 +1,90 @@
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+from bson.objectid import ObjectId
+from services.email_service import email_service
+from services.change_feed import (
+    change_feed, encode_change_token, decode_change_token, InvalidChangeToken, ExpiredChangeToken
+)
+from config import settings
+import asyncio
+import json
+
+# SSE event names per change kind
+EVENT_NAMES = {
+    "created": "email_created",
+    "updated": "email_updated",
+    "deleted": "email_deleted"
+}
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def format_event(data: Dict, event: Optional[str] = None, event_id: Optional[str] = None) -> str:
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, default=_json_default)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class EventStream:
+    """
+    Server-sent events for one user's mailbox, read from the change feed.
+
+    Each event carries the change token of its change as SSE id, so a reconnecting
+    EventSource resumes with Last-Event-ID exactly where it stopped. The stream sleeps
+    on the change feed's per-user wakeup (set by every ingest and mutation write) and
+    sends a comment line every SSE_HEARTBEAT_SECONDS to keep idle proxies from closing it.
+    """
+
+    def __init__(self, heartbeat_seconds: int = 15, batch_size: int = 100, retry_ms: int = 5000):
+        self.heartbeat_seconds = heartbeat_seconds
+        self.batch_size = batch_size
+        self.retry_ms = retry_ms
+
+    async def events(self, user_id: str, last_event_id: Optional[str],
+                     is_disconnected: Callable[[], Awaitable[bool]]) -> AsyncIterator[str]:
+        yield f"retry: {self.retry_ms}\n\n"
+
+        last_seq = None
+        if last_event_id:
+            try:
+                last_seq = decode_change_token(last_event_id, user_id, await change_feed.stable_head(user_id))
+            except (InvalidChangeToken, ExpiredChangeToken) as e:
+                # Missed changes cannot be replayed: the client reloads and continues live
+                yield format_event({"reason": str(e)}, event="reset")
+        if last_seq is None:
+            last_seq = await change_feed.stable_head(user_id)
+            token = encode_change_token(user_id, last_seq)
+            yield format_event({"token": token}, event="ready", event_id=token)
+
+        with change_feed.listen(user_id) as wakeup:
+            while not await is_disconnected():
+                # Cleared before reading the head, so a write landing meanwhile wakes us again
+                wakeup.clear()
+                head = await change_feed.stable_head(user_id)
+                while last_seq < head:
+                    changes = await email_service.changes_after(user_id, last_seq, head, self.batch_size)
+                    if not changes:
+                        # Numbers reserved by writes that changed nothing
+                        last_seq = head
+                        break
+                    for kind, doc in changes:
+                        last_seq = doc["change_seq"]
+                        yield format_event(doc, event=EVENT_NAMES[kind], event_id=encode_change_token(user_id, last_seq))
+
+                try:
+                    await asyncio.wait_for(wakeup.wait(), self.heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+
+
+event_stream = EventStream(heartbeat_seconds=settings.SSE_HEARTBEAT_SECONDS)
@@ -0,0 +1,343 @@
+import base64
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+
+_HISTORY_TYPE_KEYS = {
+    'messageAdded': 'messagesAdded',
+    'messageDeleted': 'messagesDeleted',
+    'labelAdded': 'labelsAdded',
+    'labelRemoved': 'labelsRemoved'
+}
+
+
+class FakeGmailRequest:
+    """Stand-in for googleapiclient's HttpRequest: a deferred call with execute()"""
+
+    def __init__(self, gmail: "FakeGmailService", func: Callable[[], Dict]):
+        self.gmail = gmail
+        self.func = func
+
+    def execute(self) -> Dict:
+        # Every standalone execute() is one HTTP round trip against the real API
+        self.gmail.round_trips += 1
+        return self.func()
+
+
+class FakeBatchHttpRequest:
+    """Stand-in for googleapiclient's BatchHttpRequest"""
+
+    def __init__(self, gmail: "FakeGmailService", callback: Optional[Callable] = None):
+        self.gmail = gmail
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request: FakeGmailRequest, callback: Optional[Callable] = None,
+            request_id: Optional[str] = None):
+        request_id = request_id or str(len(self.requests) + 1)
+        self.requests.append((request_id, request, callback or self.callback))
+
+    def execute(self):
+        # The whole batch goes out as a single multipart HTTP request
+        self.gmail.round_trips += 1
+        for request_id, request, callback in self.requests:
+            response, exception = None, None
+            try:
+                response = request.func()
+            except HttpError as e:
+                exception = e
+            if callback:
+                callback(request_id, response, exception)
+
+
+class _FakeMessages:
+    def __init__(self, gmail: "FakeGmailService"):
+        self.gmail = gmail
+
+    def list(self, userId: str = 'me', maxResults: int = 100, pageToken: Optional[str] = None,
+             q: Optional[str] = None, labelIds: Optional[List[str]] = None, **kwargs) -> FakeGmailRequest:
+        def run():
+            ids = self.gmail.message_order
+            if labelIds:
+                ids = [i for i in ids if set(labelIds) <= set(self.gmail.messages[i]['labelIds'])]
+            start = int(pageToken) if pageToken else 0
+            page = ids[start:start + maxResults]
+            result = {
+                'messages': [{'id': i, 'threadId': self.gmail.messages[i]['threadId']} for i in page],
+                'resultSizeEstimate': len(ids)
+            }
+            if start + maxResults < len(ids):
+                result['nextPageToken'] = str(start + maxResults)
+            return result
+        return FakeGmailRequest(self.gmail, run)
+
+    def get(self, userId: str = 'me', id: str = None, format: str = 'full', **kwargs) -> FakeGmailRequest:
+        def run():
+            return self.gmail._get_message(id)
+        return FakeGmailRequest(self.gmail, run)
+
+    def modify(self, userId: str = 'me', id: str = None, body: Dict = None) -> FakeGmailRequest:
+        def run():
+            body_ = body or {}
+            return self.gmail._modify_labels(id, body_.get('addLabelIds', []), body_.get('removeLabelIds', []))
+        return FakeGmailRequest(self.gmail, run)
+
+    def trash(self, userId: str = 'me', id: str = None) -> FakeGmailRequest:
+        def run():
+            return self.gmail._modify_labels(id, ['TRASH'], ['INBOX'])
+        return FakeGmailRequest(self.gmail, run)
+
+    def delete(self, userId: str = 'me', id: str = None) -> FakeGmailRequest:
+        def run():
+            self.gmail._get_message(id)
+            self.gmail._remove_message(id)
+            return {}
+        return FakeGmailRequest(self.gmail, run)
+
+    def send(self, userId: str = 'me', body: Dict = None) -> FakeGmailRequest:
+        def run():
+            return self.gmail._store_sent(body or {})
+        return FakeGmailRequest(self.gmail, run)
+
+    def batchModify(self, userId: str = 'me', body: Dict = None) -> FakeGmailRequest:
+        def run():
+            body_ = body or {}
+            ids = body_.get('ids', [])
+            # Gmail rejects the whole call if any id is unknown
+            for message_id in ids:
+                self.gmail._get_message(message_id)
+            for message_id in ids:
+                self.gmail._modify_labels(message_id, body_.get('addLabelIds', []), body_.get('removeLabelIds', []))
+            return {}
+        return FakeGmailRequest(self.gmail, run)
+
+    def batchDelete(self, userId: str = 'me', body: Dict = None) -> FakeGmailRequest:
+        def run():
+            # Unknown ids are ignored, as in Gmail
+            for message_id in (body or {}).get('ids', []):
+                if message_id in self.gmail.messages:
+                    self.gmail._remove_message(message_id)
+            return {}
+        return FakeGmailRequest(self.gmail, run)
+
+    def attachments(self) -> "_FakeAttachments":
+        return _FakeAttachments(self.gmail)
+
+
+class _FakeAttachments:
+    def __init__(self, gmail: "FakeGmailService"):
+        self.gmail = gmail
+
+    def get(self, userId: str = 'me', messageId: str = None, id: str = None) -> FakeGmailRequest:
+        def run():
+            self.gmail._get_message(messageId)
+            data = self.gmail.attachments.get(id)
+            if data is None:
+                raise HttpError(httplib2.Response({'status': 404}), b'{"error": {"message": "Not Found"}}')
+            return {'size': len(data), 'data': base64.urlsafe_b64encode(data).decode()}
+        return FakeGmailRequest(self.gmail, run)
+
+
+class _FakeHistory:
+    def __init__(self, gmail: "FakeGmailService"):
+        self.gmail = gmail
+
+    def list(self, userId: str = 'me', startHistoryId: str = None, maxResults: int = 100,
+             pageToken: Optional[str] = None, historyTypes: Optional[List[str]] = None,
+             **kwargs) -> FakeGmailRequest:
+        def run():
+            start_id = int(startHistoryId)
+            if start_id < self.gmail.history_floor:
+                # Gmail answers 404 once the checkpoint has aged out of its history window
+                raise HttpError(httplib2.Response({'status': 404}), b'{"error": {"message": "Requested entity was not found."}}')
+            records = [r for r in self.gmail.history if int(r['id']) > start_id]
+            if historyTypes:
+                keys = {_HISTORY_TYPE_KEYS[t] for t in historyTypes}
+                records = [r for r in records if keys & set(r)]
+            start = int(pageToken) if pageToken else 0
+            result = {'historyId': str(self.gmail.history_id)}
+            if records[start:start + maxResults]:
+                result['history'] = records[start:start + maxResults]
+            if start + maxResults < len(records):
+                result['nextPageToken'] = str(start + maxResults)
+            return result
+        return FakeGmailRequest(self.gmail, run)
+
+
+class _FakeUsers:
+    def __init__(self, gmail: "FakeGmailService"):
+        self.gmail = gmail
+
+    def messages(self) -> _FakeMessages:
+        return _FakeMessages(self.gmail)
+
+    def history(self) -> _FakeHistory:
+        return _FakeHistory(self.gmail)
+
+    def getProfile(self, userId: str = 'me') -> FakeGmailRequest:
+        def run():
+            return {
+                'emailAddress': self.gmail.email_address,
+                'messagesTotal': len(self.gmail.messages),
+                'threadsTotal': len({m['threadId'] for m in self.gmail.messages.values()}),
+                'historyId': str(self.gmail.history_id)
+            }
+        return FakeGmailRequest(self.gmail, run)
+
+
+class FakeGmailService:
+    """
+    In-memory Gmail API stand-in with the same call shape as the discovery client
+    (service.users().messages().get(...).execute()). It counts HTTP round trips so
+    fetch strategies can be compared offline.
+    """
+
+    def __init__(self, mailbox_size: int = 100, email_address: str = "me@example.com"):
+        self.email_address = email_address
+        self.messages: Dict[str, Dict] = {}
+        self.message_order: List[str] = []  # newest first, like messages.list
+        self.history_id = 1
+        self.history: List[Dict] = []
+        self.history_floor = 1  # oldest startHistoryId still accepted by history.list
+        self.round_trips = 0
+        self.attachments: Dict[str, bytes] = {}
+        self._next_index = 0
+        for _ in range(mailbox_size):
+            self.add_message()
+
+    def users(self) -> _FakeUsers:
+        return _FakeUsers(self)
+
+    def new_batch_http_request(self, callback: Optional[Callable] = None) -> FakeBatchHttpRequest:
+        return FakeBatchHttpRequest(self, callback)
+
+    def add_message(self, subject: Optional[str] = None, sender: str = "sender@example.com",
+                    body: Optional[str] = None, labels: Optional[List[str]] = None,
+                    html_body: Optional[str] = None, attachments: Optional[List[tuple]] = None) -> Dict:
+        """
+        Add a synthetic message to the top of the mailbox. With html_body or attachments
+        (a list of (filename, mime_type, bytes)) the payload is a nested multipart tree.
+        """
+        index = self._next_index
+        self._next_index += 1
+        self.history_id += 1
+        message_id = f"{index + 1:016x}"
+        text = body if body is not None else f"Synthetic message body number {index}."
+        sent_at = datetime(2024, 1, 1) + timedelta(minutes=index)
+        message = {
+            'id': message_id,
+            'threadId': f"{index // 3 + 1:016x}",
+            'labelIds': labels if labels is not None else (['INBOX', 'UNREAD'] if index % 2 else ['INBOX']),
+            'snippet': text[:200],
+            'historyId': str(self.history_id),
+            'internalDate': str(int(sent_at.timestamp() * 1000)),
+            'sizeEstimate': len(text),
+            'payload': {
+                'mimeType': 'text/plain',
+                'headers': [
+                    {'name': 'From', 'value': sender},
+                    {'name': 'To', 'value': self.email_address},
+                    {'name': 'Subject', 'value': subject or f"Synthetic message {index}"},
+                    {'name': 'Date', 'value': sent_at.strftime('%a, %d %b %Y %H:%M:%S +0000')},
+                    {'name': 'Message-ID', 'value': f"<{message_id}@example.com>"}
+                ],
+                'body': {
+                    'size': len(text),
+                    'data': base64.urlsafe_b64encode(text.encode()).decode()
+                }
+            }
+        }
+        if html_body is not None or attachments:
+            message['payload'] = self._multipart_payload(
+                message_id, message['payload']['headers'], body, html_body, attachments or []
+            )
+        self.messages[message_id] = message
+        self.message_order.insert(0, message_id)
+        self._record('messagesAdded', message)
+        return message
+
+    def _multipart_payload(self, message_id: str, headers: List[Dict], text: Optional[str],
+                           html_body: Optional[str], attachments: List[tuple]) -> Dict:
+        def leaf(part_id: str, mime_type: str, content: str) -> Dict:
+            data = content.encode()
+            return {'partId': part_id, 'mimeType': mime_type, 'filename': '', 'headers': [],
+                    'body': {'size': len(data), 'data': base64.urlsafe_b64encode(data).decode()}}
+
+        alternatives = []
+        if text is not None:
+            alternatives.append(leaf('0.0', 'text/plain', text))
+        if html_body is not None:
+            alternatives.append(leaf(f'0.{len(alternatives)}', 'text/html', html_body))
+
+        parts = [{'partId': '0', 'mimeType': 'multipart/alternative', 'filename': '', 'headers': [],
+                  'body': {'size': 0}, 'parts': alternatives}]
+        for index, (filename, mime_type, data) in enumerate(attachments, start=1):
+            attachment_id = f"att-{message_id}-{index}"
+            self.attachments[attachment_id] = data
+            parts.append({'partId': str(index), 'mimeType': mime_type, 'filename': filename, 'headers': [],
+                          'body': {'size': len(data), 'attachmentId': attachment_id}})
+
+        return {'partId': '', 'mimeType': 'multipart/mixed', 'filename': '', 'headers': headers,
+                'body': {'size': 0}, 'parts': parts}
+
+    def expire_history(self):
+        """Drop all history so older checkpoints get a 404, like Gmail's ~1 week window"""
+        self.history = []
+        self.history_floor = self.history_id + 1
+
+    def _record(self, change_type: str, message: Dict, label_ids: Optional[List[str]] = None):
+        summary = {'id': message['id'], 'threadId': message['threadId'], 'labelIds': list(message['labelIds'])}
+        change = {'message': summary}
+        if label_ids is not None:
+            change['labelIds'] = label_ids
+        self.history.append({
+            'id': str(self.history_id),
+            'messages': [summary],
+            change_type: [change]
+        })
+
+    def _get_message(self, message_id: str) -> Dict:
+        if message_id not in self.messages:
+            raise HttpError(httplib2.Response({'status': 404}), b'{"error": {"message": "Not Found"}}')
+        return self.messages[message_id]
+
+    def _modify_labels(self, message_id: str, add: List[str], remove: List[str]) -> Dict:
+        message = self._get_message(message_id)
+        removed = [label for label in remove if label in message['labelIds']]
+        added = [label for label in add if label not in message['labelIds']]
+        labels = [label for label in message['labelIds'] if label not in remove]
+        labels.extend(added)
+        message['labelIds'] = labels
+        self.history_id += 1
+        message['historyId'] = str(self.history_id)
+        if added:
+            self._record('labelsAdded', message, added)
+        if removed:
+            self._record('labelsRemoved', message, removed)
+        return {'id': message_id, 'threadId': message['threadId'], 'labelIds': labels}
+
+    def _remove_message(self, message_id: str):
+        message = self.messages.pop(message_id)
+        self.message_order.remove(message_id)
+        self.history_id += 1
+        self._record('messagesDeleted', message)
+
+    def _store_sent(self, body: Dict) -> Dict:
+        message = self.add_message(subject="Sent message", sender=self.email_address, labels=['SENT'])
+        if body.get('threadId'):
+            message['threadId'] = body['threadId']
+        return {'id': message['id'], 'threadId': message['threadId'], 'labelIds': ['SENT']}
+
+
+# One fake mailbox per user, so state persists across requests like a real account
+_fake_services: Dict[str, FakeGmailService] = {}
+
+
+def get_fake_gmail_service(user_id: str, mailbox_size: int = 100) -> FakeGmailService:
+    """Get (or create) the fake Gmail mailbox for a user"""
+    if user_id not in _fake_services:
+        _fake_services[user_id] = FakeGmailService(mailbox_size=mailbox_size)
+    return _fake_services[user_id]
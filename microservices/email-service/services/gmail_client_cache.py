@@ -0,0 +1,70 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+import hashlib
+
+
+class GmailClientCache:
+    """
+    LRU cache of built Gmail service objects, one per user.
+    Each entry remembers the fingerprint of the OAuth token it was built with and
+    stops being served when that token expires (or after max_age_seconds).
+    """
+
+    def __init__(self, max_size: int = 256, max_age_seconds: int = 3000, expiry_margin_seconds: int = 60):
+        self.max_size = max_size
+        self.max_age = timedelta(seconds=max_age_seconds)
+        self.expiry_margin = timedelta(seconds=expiry_margin_seconds)
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+
+    @staticmethod
+    def fingerprint(token_info: Dict) -> str:
+        """Stable fingerprint of a stored Google token (never keep the raw token as a key)"""
+        material = f"{token_info.get('token')}|{token_info.get('refresh_token')}|{','.join(token_info.get('scopes') or [])}"
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def get(self, user_id: str, fingerprint: Optional[str] = None):
+        """Cached service for the user, or None if missing, expired or built from another token"""
+        entry = self._entries.get(user_id)
+        if not entry:
+            return None
+        if entry["expires_at"] <= datetime.utcnow():
+            self.invalidate(user_id)
+            return None
+        if fingerprint is not None and entry["fingerprint"] != fingerprint:
+            self.invalidate(user_id)
+            return None
+        self._entries.move_to_end(user_id)
+        return entry["service"]
+
+    def put(self, user_id: str, fingerprint: str, service, token_expiry: Optional[str] = None):
+        expires_at = datetime.utcnow() + self.max_age
+        if token_expiry:
+            try:
+                expiry = datetime.fromisoformat(token_expiry.replace('Z', '+00:00'))
+                if expiry.tzinfo is not None:
+                    expiry = expiry.replace(tzinfo=None) - (expiry.utcoffset() or timedelta(0))
+                # An already-expired stored token is refreshed in memory by the client's
+                # credentials on first use, so only a future expiry shortens the entry
+                if expiry - self.expiry_margin > datetime.utcnow():
+                    expires_at = min(expires_at, expiry - self.expiry_margin)
+            except ValueError:
+                pass
+
+        self._entries[user_id] = {
+            "fingerprint": fingerprint,
+            "service": service,
+            "expires_at": expires_at
+        }
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str):
+        self._entries.pop(user_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
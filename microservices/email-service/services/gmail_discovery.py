@@ -0,0 +1,32 @@
+from googleapiclient.discovery import build_from_document
+from typing import Dict
+from config import settings
+import json
+import os
+import threading
+
+# Vendored, version-pinned discovery documents live next to the service code
+DISCOVERY_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "discovery")
+
+_documents: Dict[str, Dict] = {}
+_lock = threading.Lock()
+
+
+def get_discovery_document(api: str, version: str) -> Dict:
+    """Parsed discovery document, read from disk once per process"""
+    key = f"{api}.{version}"
+    document = _documents.get(key)
+    if document is None:
+        with _lock:
+            document = _documents.get(key)
+            if document is None:
+                path = os.path.join(settings.DISCOVERY_DOCUMENTS_DIR or DISCOVERY_DIR, f"{key}.json")
+                with open(path, "r", encoding="utf-8") as f:
+                    document = json.load(f)
+                _documents[key] = document
+    return document
+
+
+def build_gmail_client(**kwargs):
+    """Build a Gmail v1 client from the in-memory template (no network, no JSON parsing)"""
+    return build_from_document(get_discovery_document("gmail", "v1"), **kwargs)
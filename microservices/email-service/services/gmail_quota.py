@@ -0,0 +1,226 @@
+from collections import OrderedDict, defaultdict, deque
+from typing import Callable, Dict, Optional
+from googleapiclient.errors import HttpError
+from config import settings
+import asyncio
+import json
+import random
+import time
+
+# Gmail API quota units per call (https://developers.google.com/gmail/api/reference/quota)
+QUOTA_UNITS = {
+    "getProfile": 1,
+    "history.list": 2,
+    "messages.list": 5,
+    "messages.get": 5,
+    "messages.attachments.get": 5,
+    "messages.modify": 5,
+    "messages.trash": 5,
+    "messages.delete": 10,
+    "messages.batchModify": 50,
+    "messages.batchDelete": 50,
+    "messages.send": 100
+}
+DEFAULT_QUOTA_UNITS = 5
+
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "quotaExceeded"}
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+METRICS_WINDOW_SECONDS = 60
+
+
+def _error_reasons(error: HttpError) -> set:
+    try:
+        payload = json.loads(error.content.decode() if isinstance(error.content, bytes) else error.content)
+        return {item.get("reason") for item in payload.get("error", {}).get("errors", [])}
+    except (ValueError, AttributeError, TypeError):
+        return set()
+
+
+def is_rate_limited(error: Exception) -> bool:
+    if not isinstance(error, HttpError):
+        return False
+    status = getattr(error.resp, "status", None)
+    return status == 429 or (status == 403 and bool(_error_reasons(error) & RATE_LIMIT_REASONS))
+
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits and transient backend errors are worth retrying, everything else is not"""
+    if not isinstance(error, HttpError):
+        return False
+    return is_rate_limited(error) or getattr(error.resp, "status", None) in RETRYABLE_STATUSES
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` units per second, holding at most one second of burst.
+    reserve() always succeeds and returns how long the caller must wait: the balance may go
+    negative, which queues callers in arrival order without any polling.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = float(rate)
+        self.capacity = float(rate)
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.charged = deque()  # (monotonic time, units) within the metrics window
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, units: float) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        # A single charge bigger than the burst would otherwise never fit
+        self.tokens -= min(units, self.capacity)
+        self.charged.append((now, units))
+        return max(0.0, -self.tokens / self.rate)
+
+    def penalize(self, seconds: float):
+        """Push the bucket into debt after Gmail said we are going too fast"""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, -self.rate * seconds)
+
+    def utilization(self) -> float:
+        """Share of the rate used over the metrics window"""
+        cutoff = time.monotonic() - METRICS_WINDOW_SECONDS
+        while self.charged and self.charged[0][0] < cutoff:
+            self.charged.popleft()
+        used = sum(units for _, units in self.charged)
+        return round(used / (self.rate * METRICS_WINDOW_SECONDS), 4)
+
+
+class GmailRateLimiter:
+    """
+    Shared Gmail quota limiter: every call is charged its documented quota units against
+    the user's bucket and the project-wide bucket, waiting when either is exhausted.
+    Rate-limit and transient errors are retried with full-jitter exponential backoff.
+    """
+
+    def __init__(self, user_rate: float, project_rate: float, max_retries: int = 5,
+                 backoff_base: float = 1.0, backoff_max: float = 32.0, max_users: int = 10000):
+        self.user_rate = user_rate
+        self.project_bucket = TokenBucket(project_rate)
+        self.user_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_users = max_users
+        self.stats = {
+            "calls": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "failures": 0,
+            "throttled_seconds": 0.0
+        }
+        self.units_by_method: Dict[str, int] = defaultdict(int)
+
+    def _user_bucket(self, user_id: str) -> TokenBucket:
+        bucket = self.user_buckets.get(user_id)
+        if bucket is None:
+            bucket = self.user_buckets[user_id] = TokenBucket(self.user_rate)
+            # The least recently seen users have long since refilled their buckets
+            while len(self.user_buckets) > self.max_users:
+                self.user_buckets.popitem(last=False)
+        self.user_buckets.move_to_end(user_id)
+        return bucket
+
+    async def acquire(self, user_id: str, method: str, count: int = 1):
+        """Wait until `count` calls of `method` fit in the user's and the project's quota"""
+        units = QUOTA_UNITS.get(method, DEFAULT_QUOTA_UNITS) * count
+        self.stats["calls"] += count
+        self.units_by_method[method] += units
+        wait = max(self._user_bucket(user_id).reserve(units), self.project_bucket.reserve(units))
+        if wait > 0:
+            self.stats["throttled_seconds"] += wait
+            await asyncio.sleep(wait)
+
+    def busy(self, user_id: str, project_share: float = 1.0) -> bool:
+        """True while the user's calls would have to wait, or the project uses more than its share"""
+        bucket = self.user_buckets.get(user_id)
+        if bucket is not None:
+            bucket._refill(time.monotonic())
+            if bucket.tokens < 0:
+                return True
+        return self.project_bucket.utilization() > project_share
+
+    def backoff_delay(self, attempt: int, error: Optional[HttpError] = None) -> float:
+        retry_after = None
+        if error is not None and getattr(error, "resp", None) is not None:
+            retry_after = error.resp.get("retry-after")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def on_rate_limited(self, user_id: str, attempt: int, error: Optional[HttpError] = None) -> float:
+        """Record a rate-limit answer, slow the user's other callers and return the retry delay"""
+        self.stats["rate_limited"] += 1
+        delay = self.backoff_delay(attempt, error)
+        self._user_bucket(user_id).penalize(delay)
+        return delay
+
+    async def execute(self, user_id: str, method: str, call: Callable, count: int = 1,
+                      retry_server_errors: bool = True):
+        """
+        Run a blocking Gmail call (e.g. `request.execute`) in the executor under quota, with retries.
+        Non-idempotent calls (messages.send) pass retry_server_errors=False: after a 5xx the
+        call may still have gone through, so only rate limits, which Gmail rejects up front,
+        are retried.
+        """
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            await self.acquire(user_id, method, count)
+            try:
+                return await loop.run_in_executor(None, call)
+            except HttpError as e:
+                retryable = is_retryable(e) if retry_server_errors else is_rate_limited(e)
+                if not retryable or attempt >= self.max_retries:
+                    self.stats["failures"] += 1
+                    raise
+                self.stats["retries"] += 1
+                if is_rate_limited(e):
+                    # The penalty puts the user's bucket in debt; the next acquire() waits it out
+                    delay = self.on_rate_limited(user_id, attempt, e)
+                else:
+                    delay = self.backoff_delay(attempt, e)
+                print(f"Gmail {method} for user {user_id} failed with {e.resp.status}, "
+                      f"retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                attempt += 1
+                if not is_rate_limited(e):
+                    await asyncio.sleep(delay)
+
+    def snapshot(self, top_users: int = 10) -> Dict:
+        """Current utilization and counters, for the metrics endpoint"""
+        busiest = sorted(
+            ((user_id, bucket.utilization()) for user_id, bucket in self.user_buckets.items()),
+            key=lambda item: item[1],
+            reverse=True
+        )[:top_users]
+        return {
+            "window_seconds": METRICS_WINDOW_SECONDS,
+            "project": {
+                "rate_units_per_second": self.project_bucket.rate,
+                "utilization": self.project_bucket.utilization()
+            },
+            "users": {
+                "tracked": len(self.user_buckets),
+                "rate_units_per_second": self.user_rate,
+                "busiest": [{"user_id": user_id, "utilization": utilization} for user_id, utilization in busiest]
+            },
+            "units_by_method": dict(self.units_by_method),
+            **{key: round(value, 3) if isinstance(value, float) else value for key, value in self.stats.items()}
+        }
+
+
+gmail_limiter = GmailRateLimiter(
+    user_rate=settings.GMAIL_USER_QUOTA_PER_SECOND,
+    project_rate=settings.GMAIL_PROJECT_QUOTA_PER_SECOND,
+    max_retries=settings.GMAIL_MAX_RETRIES,
+    backoff_base=settings.GMAIL_BACKOFF_BASE_SECONDS,
+    backoff_max=settings.GMAIL_BACKOFF_MAX_SECONDS
+)
@@ -0,0 +1,199 @@
+from pymongo import DeleteOne, UpdateOne
+from googleapiclient.errors import HttpError
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+from db.mongodb import get_label_sync_collection
+from services.gmail_quota import gmail_limiter, is_retryable
+from config import settings
+import asyncio
+
+# messages.batchModify accepts at most 1000 ids per call
+GMAIL_BATCH_MODIFY_LIMIT = 1000
+
+
+def label_changes(op: Dict) -> tuple:
+    """(addLabelIds, removeLabelIds) that bring a Gmail message to the queued state"""
+    add, remove = set(), set()
+    if op.get("read") is True:
+        remove.add("UNREAD")
+    elif op.get("read") is False:
+        add.add("UNREAD")
+    if op.get("trashed"):
+        add.add("TRASH")
+        remove.add("INBOX")
+    return tuple(sorted(add)), tuple(sorted(remove))
+
+
+class LabelSyncQueue:
+    """
+    Write-behind queue for the Gmail side of read, unread and trash.
+
+    Mongo is updated first and is what the UI reads; the Gmail change is queued as one
+    document per message holding the desired final state, so opposing operations (read
+    then unread) collapse into whatever the user chose last. A background flusher waits
+    LABEL_SYNC_DELAY_SECONDS for more changes to arrive, then pushes each user's pending
+    messages as batchModify calls grouped by label change. The queue lives in Mongo, so
+    nothing is lost across restarts; failed flushes are retried with growing delays.
+    """
+
+    def __init__(self, delay: float = 1.0, poll_interval: int = 30, max_attempts: int = 10,
+                 max_backoff: int = 3600, concurrency: int = 4):
+        self.collection = get_label_sync_collection()
+        self.delay = delay
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.concurrency = max(1, concurrency)
+        self._email_service = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, email_service):
+        """Start the flusher (called on app startup); it also drains changes left by a previous run"""
+        self._email_service = email_service
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._wakeup.set()
+            self._task = asyncio.create_task(self._run())
+
+    async def shutdown(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def enqueue(self, user_id: str, message_ids: Iterable[str], read: Optional[bool] = None,
+                      trashed: Optional[bool] = None):
+        """Queue the Gmail side of a change already applied in Mongo"""
+        changes = {key: value for key, value in (("read", read), ("trashed", trashed)) if value is not None}
+        message_ids = [message_id for message_id in dict.fromkeys(message_ids) if message_id]
+        if not changes or not message_ids:
+            return
+
+        now = datetime.utcnow()
+        await self.collection.bulk_write([
+            UpdateOne(
+                {"user_id": user_id, "message_id": message_id},
+                {
+                    # A newer change replaces the older one and resets its retry schedule
+                    "$set": {**changes, "attempts": 0, "next_attempt_at": now, "updated_at": now},
+                    "$inc": {"version": 1},
+                    "$setOnInsert": {"created_at": now}
+                },
+                upsert=True
+            )
+            for message_id in message_ids
+        ], ordered=False)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def discard(self, user_id: str, message_ids: Iterable[str]):
+        """Drop pending changes of messages that no longer exist"""
+        message_ids = list(message_ids)
+        if message_ids:
+            await self.collection.delete_many({"user_id": user_id, "message_id": {"$in": message_ids}})
+
+    async def pending_ids(self, user_id: str, message_ids: Iterable[str]) -> Set[str]:
+        """Messages whose Gmail labels are still behind Mongo (sync must not overwrite them)"""
+        message_ids = list(message_ids)
+        if not message_ids:
+            return set()
+        cursor = self.collection.find(
+            {"user_id": user_id, "message_id": {"$in": message_ids}},
+            {"message_id": 1, "_id": 0}
+        )
+        return {doc["message_id"] async for doc in cursor}
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            # Give related changes (a quick read/unread toggle, a run of clicks) time to coalesce
+            await asyncio.sleep(self.delay)
+            try:
+                await self.flush_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error flushing queued Gmail label changes: {str(e)}")
+
+    async def flush_due(self):
+        user_ids = await self.collection.distinct("user_id", {"next_attempt_at": {"$lte": datetime.utcnow()}})
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def flush(user_id: str):
+            async with semaphore:
+                await self.flush_user(user_id)
+
+        await asyncio.gather(*(flush(user_id) for user_id in user_ids))
+
+    async def flush_user(self, user_id: str):
+        ops = await self.collection.find(
+            {"user_id": user_id, "next_attempt_at": {"$lte": datetime.utcnow()}}
+        ).to_list(length=None)
+        if not ops:
+            return
+
+        service = await self._email_service.get_gmail_service(user_id)
+        if not service:
+            await self._retry_later(ops)
+            return
+
+        groups: Dict[tuple, List[Dict]] = {}
+        for op in ops:
+            groups.setdefault(label_changes(op), []).append(op)
+
+        for (add, remove), group in groups.items():
+            for start in range(0, len(group), GMAIL_BATCH_MODIFY_LIMIT):
+                chunk = group[start:start + GMAIL_BATCH_MODIFY_LIMIT]
+                body = {
+                    'ids': [op["message_id"] for op in chunk],
+                    'addLabelIds': list(add),
+                    'removeLabelIds': list(remove)
+                }
+                try:
+                    await gmail_limiter.execute(
+                        user_id, "messages.batchModify",
+                        lambda body=body: service.users().messages().batchModify(userId='me', body=body).execute()
+                    )
+                except HttpError as e:
+                    self._email_service._handle_gmail_error(user_id, e)
+                    if is_retryable(e) or e.resp.status == 401:
+                        await self._retry_later(chunk)
+                    else:
+                        # Gmail refused the change for good (e.g. a message deleted there meanwhile)
+                        print(f"Dropping {len(chunk)} queued label changes for user {user_id}: {str(e)}")
+                        await self._done(chunk)
+                    continue
+                await self._done(chunk)
+
+    async def _done(self, ops: List[Dict]):
+        # The version check keeps changes queued while the flush was in flight
+        await self.collection.bulk_write([
+            DeleteOne({"_id": op["_id"], "version": op["version"]}) for op in ops
+        ], ordered=False)
+
+    async def _retry_later(self, ops: List[Dict]):
+        now = datetime.utcnow()
+        requests = []
+        for op in ops:
+            attempts = op.get("attempts", 0) + 1
+            if attempts >= self.max_attempts:
+                print(f"Giving up on queued label change for message {op['message_id']} after {attempts} attempts")
+                requests.append(DeleteOne({"_id": op["_id"], "version": op["version"]}))
+                continue
+            delay = min(self.max_backoff, self.poll_interval * 2 ** (attempts - 1))
+            requests.append(UpdateOne(
+                {"_id": op["_id"], "version": op["version"]},
+                {"$set": {"attempts": attempts, "next_attempt_at": now + timedelta(seconds=delay)}}
+            ))
+        await self.collection.bulk_write(requests, ordered=False)
+
+
+label_sync_queue = LabelSyncQueue(
+    delay=settings.LABEL_SYNC_DELAY_SECONDS,
+    poll_interval=settings.LABEL_SYNC_POLL_SECONDS,
+    max_attempts=settings.LABEL_SYNC_MAX_ATTEMPTS
+)
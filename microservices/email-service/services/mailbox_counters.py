@@ -0,0 +1,154 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterable
+from db.mongodb import get_email_collection, get_counters_collection
+from config import settings
+
+# Labels shown in the sidebar; only these get per-label counters
+COUNTED_LABELS = ["INBOX", "SENT", "DRAFT", "SPAM", "TRASH", "STARRED"]
+
+# Per-day buckets only matter for the "today" and "this week" figures
+DAY_BUCKETS = 8
+
+
+def _day_key(timestamp: datetime) -> str:
+    return timestamp.strftime("%Y-%m-%d")
+
+
+def email_delta(email: Dict, sign: int = 1) -> Dict[str, int]:
+    """Counter increments contributed by one stored email (sign=-1 to remove it)"""
+    unread = 1 if email.get("read") is False else 0
+    delta = {"total": sign, "unread": sign * unread}
+
+    for label in email.get("labels") or []:
+        if label in COUNTED_LABELS:
+            delta[f"labels.{label}.total"] = sign
+            delta[f"labels.{label}.unread"] = sign * unread
+
+    timestamp = email.get("timestamp")
+    if isinstance(timestamp, datetime) and timestamp >= datetime.utcnow() - timedelta(days=DAY_BUCKETS):
+        delta[f"days.{_day_key(timestamp)}"] = sign
+
+    return delta
+
+
+def change_delta(before: Dict, after: Dict) -> Dict[str, int]:
+    """Counter increments for an email whose read flag or labels changed"""
+    return merge_deltas([email_delta(before, -1), email_delta(after, 1)])
+
+
+def merge_deltas(deltas: Iterable[Dict[str, int]]) -> Dict[str, int]:
+    merged: Dict[str, int] = {}
+    for delta in deltas:
+        for field, value in delta.items():
+            merged[field] = merged.get(field, 0) + value
+    return {field: value for field, value in merged.items() if value}
+
+
+class MailboxCounters:
+    """
+    Materialized per-user mailbox counters (total, unread, per-label and per-day).
+    Write paths apply $inc deltas; the stats endpoint is a single point read. The
+    document is rebuilt with one $facet aggregation when missing or periodically,
+    which also corrects any drift from racing writers.
+    """
+
+    def __init__(self):
+        self.email_collection = get_email_collection()
+        self.counters_collection = get_counters_collection()
+
+    async def apply(self, user_id: str, delta: Dict[str, int]):
+        """Apply increments; a missing counters document is left for the next rebuild"""
+        if not delta:
+            return
+        try:
+            await self.counters_collection.update_one(
+                {"user_id": user_id},
+                {"$inc": delta, "$set": {"updated_at": datetime.utcnow()}}
+            )
+        except Exception as e:
+            print(f"Error updating mailbox counters for user {user_id}: {str(e)}")
+
+    async def get_stats(self, user_id: str) -> Dict:
+        counters = await self.counters_collection.find_one({"user_id": user_id})
+        max_age = timedelta(seconds=settings.MAILBOX_COUNTERS_REBUILD_INTERVAL)
+        if not counters or counters.get("rebuilt_at", datetime.min) < datetime.utcnow() - max_age:
+            counters = await self.rebuild(user_id)
+        return self._format_stats(counters)
+
+    async def invalidate(self, user_id: str):
+        """Force a rebuild on the next read"""
+        await self.counters_collection.delete_one({"user_id": user_id})
+
+    async def rebuild(self, user_id: str) -> Dict:
+        """Recompute all counters for a user in a single aggregation"""
+        week_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) \
+            - timedelta(days=DAY_BUCKETS - 1)
+        unread_expr = {"$cond": [{"$eq": ["$read", False]}, 1, 0]}
+
+        pipeline = [
+            {"$match": {"user_id": user_id}},
+            {"$facet": {
+                "totals": [
+                    {"$group": {"_id": None, "total": {"$sum": 1}, "unread": {"$sum": unread_expr}}}
+                ],
+                "labels": [
+                    {"$match": {"labels": {"$in": COUNTED_LABELS}}},
+                    {"$unwind": "$labels"},
+                    {"$match": {"labels": {"$in": COUNTED_LABELS}}},
+                    {"$group": {"_id": "$labels", "total": {"$sum": 1}, "unread": {"$sum": unread_expr}}}
+                ],
+                "days": [
+                    {"$match": {"timestamp": {"$gte": week_start}}},
+                    {"$group": {
+                        "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
+                        "count": {"$sum": 1}
+                    }}
+                ]
+            }}
+        ]
+        result = await self.email_collection.aggregate(pipeline).to_list(length=1)
+        facets = result[0] if result else {"totals": [], "labels": [], "days": []}
+        totals = facets["totals"][0] if facets["totals"] else {"total": 0, "unread": 0}
+
+        counters = {
+            "user_id": user_id,
+            "total": totals["total"],
+            "unread": totals["unread"],
+            "labels": {
+                label["_id"]: {"total": label["total"], "unread": label["unread"]}
+                for label in facets["labels"]
+            },
+            "days": {day["_id"]: day["count"] for day in facets["days"]},
+            "rebuilt_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow()
+        }
+        await self.counters_collection.replace_one({"user_id": user_id}, counters, upsert=True)
+        return counters
+
+    def _format_stats(self, counters: Dict) -> Dict:
+        now = datetime.utcnow()
+        days = counters.get("days", {})
+        today = days.get(_day_key(now), 0)
+        # Last 7 days including today
+        this_week = sum(days.get(_day_key(now - timedelta(days=offset)), 0) for offset in range(7))
+
+        total = counters.get("total", 0)
+        unread = counters.get("unread", 0)
+        labels = counters.get("labels", {})
+        return {
+            "total_emails": total,
+            "unread_emails": unread,
+            "read_emails": total - unread,
+            "today": today,
+            "this_week": this_week,
+            "labels": {
+                label: {
+                    "total": labels.get(label, {}).get("total", 0),
+                    "unread": labels.get(label, {}).get("unread", 0)
+                }
+                for label in COUNTED_LABELS
+            }
+        }
+
+
+mailbox_counters = MailboxCounters()
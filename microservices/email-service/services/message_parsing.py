@@ -0,0 +1,51 @@
+from typing import Dict, List
+import base64
+import html
+import re
+
+_SCRIPT_STYLE_RE = re.compile(r'<(script|style|head)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_BLOCK_TAG_RE = re.compile(r'<\s*(br|/p|/div|/tr|/li|/h[1-6])\b[^>]*>', re.IGNORECASE)
+_TAG_RE = re.compile(r'<[^>]+>')
+
+
+def decode_body_data(data: str, max_bytes: int):
+    """Decode a base64url body part, reading no more than max_bytes; returns (text, truncated)"""
+    # Every 4 base64 characters carry 3 bytes, so only the prefix under the cap is decoded
+    max_chars = -(-max_bytes // 3) * 4
+    truncated = len(data) > max_chars
+    chunk = data[:max_chars]
+    raw = base64.urlsafe_b64decode(chunk + "=" * (-len(chunk) % 4))[:max_bytes]
+    # A cut can split a multi-byte character; drop it rather than emit a replacement char
+    return raw.decode('utf-8', errors='ignore' if truncated else 'replace'), truncated
+
+
+def html_to_text(markup: str) -> str:
+    """Readable text from an HTML-only body"""
+    text = _SCRIPT_STYLE_RE.sub(' ', markup)
+    text = _BLOCK_TAG_RE.sub('\n', text)
+    text = html.unescape(_TAG_RE.sub('', text))
+    text = re.sub(r'[ \t\r\f\v]+', ' ', text)
+    return re.sub(r' ?\n\s*', '\n', text).strip()
+
+
+def header_map(headers: List[Dict]) -> Dict[str, str]:
+    """Case-folded name -> value for a Gmail header list, built in one pass (first occurrence wins)"""
+    mapped = {}
+    for header in headers or []:
+        name = header.get('name', '').lower()
+        if name not in mapped:
+            mapped[name] = header.get('value', '')
+    return mapped
+
+
+def rfc_headers_from(headers: Dict[str, str], fallback_sender: str = '') -> Dict[str, str]:
+    """Threading headers stored with each email for reply/forward"""
+    return {
+        "from": headers.get('from', fallback_sender),
+        "to": headers.get('to', ''),
+        "cc": headers.get('cc', ''),
+        "date": headers.get('date', ''),
+        "message_id": headers.get('message-id', ''),
+        "references": headers.get('references', ''),
+        "in_reply_to": headers.get('in-reply-to', '')
+    }
@@ -0,0 +1,199 @@
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from bson.objectid import ObjectId
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from db.mongodb import get_outbox_collection
+from services.gmail_quota import gmail_limiter
+from config import settings
+import asyncio
+
+OUTBOX_KINDS = ("send", "reply", "forward")
+# Statuses a worker may pick up
+DUE_STATUSES = ["queued", "retrying"]
+
+
+def outbox_status(job: Dict) -> Dict:
+    """Public view of an outbox job (the status handle clients poll)"""
+    result = job.get("result") or {}
+    return {
+        "outbox_id": str(job["_id"]),
+        "kind": job["kind"],
+        "status": job["status"],
+        "attempts": job.get("attempts", 0),
+        "message_id": result.get("message_id"),
+        "thread_id": result.get("thread_id"),
+        "error": job.get("error"),
+        "created_at": job.get("created_at"),
+        "updated_at": job.get("updated_at")
+    }
+
+
+class OutboxService:
+    """
+    Durable queue for outbound mail. Send, reply and forward requests are stored in the
+    outbox collection and answered with a status handle right away; a pool of workers
+    builds and sends them through Gmail with bounded concurrency, retrying with backoff
+    only failures Gmail is known not to have sent: throttling, expired credentials, and
+    outages before messages.send was called.
+
+    A client-supplied idempotency key is unique per user, so a retried request returns
+    the job created by the first one instead of sending twice. A send interrupted by a
+    restart, or one messages.send answered with a server error or timeout, is marked
+    failed rather than retried, since Gmail may already have sent it.
+    """
+
+    def __init__(self, workers: int = 4, max_attempts: int = 5, poll_interval: int = 5,
+                 retention_seconds: int = 604800):
+        self.collection = get_outbox_collection()
+        self.workers = max(1, workers)
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.retention = timedelta(seconds=retention_seconds)
+        self._email_service = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self, email_service):
+        """Start the workers (called on app startup)"""
+        if self._tasks:
+            return
+        self._email_service = email_service
+        self._wakeup = asyncio.Event()
+
+        now = datetime.utcnow()
+        interrupted = await self.collection.update_many(
+            {"status": "sending"},
+            {"$set": {
+                "status": "failed",
+                "error": "Interrupted while sending; check the Sent folder before sending again",
+                "updated_at": now,
+                "expires_at": now + self.retention
+            }}
+        )
+        if interrupted.modified_count:
+            print(f"Marked {interrupted.modified_count} interrupted outbox sends as failed")
+
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def enqueue(self, user_id: str, kind: str, params: Dict,
+                      idempotency_key: Optional[str] = None) -> Dict:
+        """Queue an outbound email and return its status handle"""
+        now = datetime.utcnow()
+        job = {
+            "user_id": user_id,
+            "kind": kind,
+            "params": params,
+            "status": "queued",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now
+        }
+        if idempotency_key:
+            job["idempotency_key"] = idempotency_key
+
+        try:
+            await self.collection.insert_one(job)
+        except DuplicateKeyError:
+            # A retry of a request we already accepted: hand back the original job
+            existing = await self.collection.find_one({"user_id": user_id, "idempotency_key": idempotency_key})
+            if existing:
+                return outbox_status(existing)
+            raise
+
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return outbox_status(job)
+
+    async def get_status(self, user_id: str, outbox_id: str) -> Optional[Dict]:
+        if not ObjectId.is_valid(outbox_id):
+            return None
+        job = await self.collection.find_one({"_id": ObjectId(outbox_id), "user_id": user_id})
+        return outbox_status(job) if job else None
+
+    async def _work(self):
+        while True:
+            job = await self._claim()
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            try:
+                await self._deliver(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error delivering outbox job {job['_id']}: {str(e)}")
+                await self._finish(job, "failed", error=f"Unexpected error: {str(e)}")
+
+    async def _claim(self) -> Optional[Dict]:
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {"status": {"$in": DUE_STATUSES}, "next_attempt_at": {"$lte": now}},
+            {"$set": {"status": "sending", "updated_at": now}, "$inc": {"attempts": 1}},
+            sort=[("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _deliver(self, job: Dict):
+        user_id, params = job["user_id"], job["params"]
+        if job["kind"] == "reply":
+            result = await self._email_service.reply_to_email(user_id=user_id, **params)
+        elif job["kind"] == "forward":
+            result = await self._email_service.forward_email(user_id=user_id, **params)
+        else:
+            result = await self._email_service.send_email(user_id=user_id, **params)
+
+        if result.get("success"):
+            await self._finish(job, "sent", result={
+                "message_id": result.get("message_id"),
+                "thread_id": result.get("thread_id")
+            })
+        elif result.get("retryable") and job["attempts"] < self.max_attempts:
+            delay = gmail_limiter.backoff_delay(job["attempts"])
+            print(f"Outbox job {job['_id']} failed ({result.get('error')}), retrying in {delay:.1f}s")
+            await self.collection.update_one(
+                {"_id": job["_id"]},
+                {"$set": {
+                    "status": "retrying",
+                    "error": result.get("error"),
+                    "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay),
+                    "updated_at": datetime.utcnow()
+                }}
+            )
+        else:
+            await self._finish(job, "failed", error=result.get("error"))
+
+    async def _finish(self, job: Dict, status: str, result: Optional[Dict] = None, error: Optional[str] = None):
+        now = datetime.utcnow()
+        await self.collection.update_one(
+            {"_id": job["_id"]},
+            {"$set": {
+                "status": status,
+                "result": result,
+                "error": error,
+                "updated_at": now,
+                # Finished jobs (and so their idempotency keys) expire after the retention window
+                "expires_at": now + self.retention
+            }}
+        )
+
+
+outbox_service = OutboxService(
+    workers=settings.OUTBOX_WORKERS,
+    max_attempts=settings.OUTBOX_MAX_ATTEMPTS,
+    poll_interval=settings.OUTBOX_POLL_SECONDS,
+    retention_seconds=settings.OUTBOX_RETENTION_SECONDS
+)
@@ -0,0 +1,193 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from db.mongodb import get_sync_state_collection
+from services.sync_service import sync_service
+from services.backfill_service import backfill_service
+from services.gmail_quota import gmail_limiter
+from config import settings
+import asyncio
+import heapq
+import time
+
+# Poll intervals shrink by this factor after a sync that found changes and grow by it otherwise
+INTERVAL_FACTOR = 2.0
+# Activity is persisted at most this often per user (seconds)
+ACTIVITY_WRITE_INTERVAL = 60
+
+
+class SyncScheduler:
+    """
+    Keeps recently active users synced in the background so inbox reads hit a warm Mongo.
+
+    Users due for a sync sit in a min-heap keyed by their next due time; a dispatcher
+    hands them in due order to a fixed pool of workers, so every active user gets a turn
+    before anyone is polled twice and at most SYNC_WORKERS syncs run at once. Each user's
+    interval adapts between SYNC_MIN_INTERVAL and SYNC_MAX_INTERVAL to how often their
+    mailbox changes. A sync is deferred while the user's Gmail quota is busy (client
+    requests, a backfill) or background syncs exceed their share of the project quota.
+    """
+
+    def __init__(self, workers: int = 4, min_interval: int = 30, max_interval: int = 600,
+                 active_window: int = 1800, quota_share: float = 0.5):
+        self.sync_state_collection = get_sync_state_collection()
+        self.workers = max(1, workers)
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.active_window = active_window
+        self.quota_share = quota_share
+
+        self._due: List[tuple] = []            # heap of (due monotonic time, user_id)
+        self._users: Dict[str, Dict] = {}      # user_id -> {interval, due, last_active, ...}
+        self._queue: Optional[asyncio.Queue] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self.stats = {"syncs": 0, "changed": 0, "failures": 0, "deferred": 0}
+
+    async def start(self):
+        """Load users active before a restart and start the dispatcher and workers"""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._wakeup = asyncio.Event()
+
+        since = datetime.utcnow() - timedelta(seconds=self.active_window)
+        cursor = self.sync_state_collection.find({"last_active_at": {"$gte": since}}, {"user_id": 1})
+        async for state in cursor:
+            self.touch(state["user_id"], persist=False)
+
+        self._tasks.append(asyncio.create_task(self._dispatch()))
+        self._tasks.extend(asyncio.create_task(self._work()) for _ in range(self.workers))
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def touch(self, user_id: str, persist: bool = True):
+        """Record user activity; a user the scheduler did not know is synced right away"""
+        if self._queue is None:
+            return
+        now = time.monotonic()
+        entry = self._users.get(user_id)
+        if entry is None:
+            entry = self._users[user_id] = {
+                "interval": self.min_interval,
+                "due": now,
+                "last_active": now,
+                "persisted_at": None,
+                "queued": False
+            }
+            self._push(user_id, now)
+        entry["last_active"] = now
+
+        if persist and (entry["persisted_at"] is None or now - entry["persisted_at"] >= ACTIVITY_WRITE_INTERVAL):
+            entry["persisted_at"] = now
+            asyncio.create_task(self._persist_activity(user_id))
+
+    async def _persist_activity(self, user_id: str):
+        try:
+            await self.sync_state_collection.update_one(
+                {"user_id": user_id},
+                {"$set": {"last_active_at": datetime.utcnow()}},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"Error recording activity for user {user_id}: {str(e)}")
+
+    def _push(self, user_id: str, due: float):
+        heapq.heappush(self._due, (due, user_id))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            while self._due and self._due[0][0] <= now:
+                due, user_id = heapq.heappop(self._due)
+                entry = self._users.get(user_id)
+                # Stale heap entries (rescheduled or dropped users) are skipped
+                if entry is None or entry["due"] != due or entry["queued"]:
+                    continue
+                entry["queued"] = True
+                self._queue.put_nowait(user_id)
+
+            timeout = self._due[0][0] - now if self._due else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _work(self):
+        while True:
+            user_id = await self._queue.get()
+            try:
+                await self._sync_user(user_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["failures"] += 1
+                print(f"Background sync failed for user {user_id}: {str(e)}")
+                self._reschedule(user_id, self.max_interval)
+            finally:
+                self._queue.task_done()
+
+    async def _sync_user(self, user_id: str):
+        entry = self._users.get(user_id)
+        if entry is None:
+            return
+
+        if time.monotonic() - entry["last_active"] > self.active_window:
+            # Inactive users drop out until their next request
+            self._users.pop(user_id, None)
+            return
+
+        if backfill_service._is_running(user_id) or gmail_limiter.busy(user_id, self.quota_share):
+            self.stats["deferred"] += 1
+            self._reschedule(user_id, entry["interval"])
+            return
+
+        result = await sync_service.sync_mailbox(user_id)
+        self.stats["syncs"] += 1
+        if not result.get("success"):
+            self.stats["failures"] += 1
+            self._reschedule(user_id, self.max_interval)
+            return
+
+        changed = any(result.get(key) for key in ("processed", "updated", "deleted"))
+        if changed:
+            self.stats["changed"] += 1
+            interval = entry["interval"] / INTERVAL_FACTOR
+        else:
+            interval = entry["interval"] * INTERVAL_FACTOR
+        self._reschedule(user_id, interval)
+
+    def _reschedule(self, user_id: str, interval: float):
+        entry = self._users.get(user_id)
+        if entry is None:
+            return
+        entry["interval"] = min(self.max_interval, max(self.min_interval, interval))
+        entry["due"] = time.monotonic() + entry["interval"]
+        entry["queued"] = False
+        self._push(user_id, entry["due"])
+
+    def snapshot(self) -> Dict:
+        """Scheduler state for the metrics endpoint"""
+        intervals = [entry["interval"] for entry in self._users.values()]
+        return {
+            "active_users": len(self._users),
+            "queued": self._queue.qsize() if self._queue else 0,
+            "workers": self.workers,
+            "mean_interval_seconds": round(sum(intervals) / len(intervals), 1) if intervals else None,
+            **self.stats
+        }
+
+
+sync_scheduler = SyncScheduler(
+    workers=settings.SYNC_WORKERS,
+    min_interval=settings.SYNC_MIN_INTERVAL,
+    max_interval=settings.SYNC_MAX_INTERVAL,
+    active_window=settings.SYNC_ACTIVE_WINDOW,
+    quota_share=settings.SYNC_QUOTA_SHARE
+)
@@ -0,0 +1,342 @@
+from googleapiclient.errors import HttpError
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from db.mongodb import get_email_collection, get_sync_state_collection
+from services.email_service import email_service
+from services.mailbox_counters import mailbox_counters, email_delta, change_delta, merge_deltas
+from services.body_store import body_store
+from services.thread_store import thread_store
+from services.gmail_quota import gmail_limiter
+from services.label_sync import label_sync_queue
+from services.change_feed import change_feed
+from config import settings
+import asyncio
+import weakref
+
+
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+# messages.list accepts at most 500 ids per page
+RESYNC_PAGE_SIZE = 500
+
+
+class HistoryExpiredError(Exception):
+    """Raised when Gmail no longer has history for the stored checkpoint"""
+    pass
+
+
+class SyncService:
+    """Keeps a user's stored mailbox in step with Gmail using historyId checkpoints"""
+
+    def __init__(self):
+        self.email_collection = get_email_collection()
+        self.sync_state_collection = get_sync_state_collection()
+        # One sync per user at a time (client fetches and the background scheduler share it)
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    async def sync_mailbox(self, user_id: str) -> Dict:
+        """Incremental sync from the stored checkpoint, falling back to a full resync"""
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        async with lock:
+            return await self._sync_mailbox(user_id)
+
+    async def _sync_mailbox(self, user_id: str) -> Dict:
+        service = await email_service.get_gmail_service(user_id)
+        if not service:
+            return {"success": False, "error": "Gmail service not available"}
+
+        try:
+            state = await self.sync_state_collection.find_one({"user_id": user_id})
+            if state and state.get("history_id"):
+                try:
+                    return await self._incremental_sync(user_id, service, state["history_id"])
+                except HistoryExpiredError:
+                    print(f"History checkpoint {state['history_id']} expired for user {user_id}, doing full resync")
+
+            return await self._full_sync(user_id, service)
+
+        except HttpError as e:
+            email_service._handle_gmail_error(user_id, e)
+            return {"success": False, "error": f"Gmail API error: {str(e)}"}
+        except Exception as e:
+            return {"success": False, "error": f"Unexpected error: {str(e)}"}
+
+    async def _full_sync(self, user_id: str, service) -> Dict:
+        """
+        Reconcile the stored mailbox with Gmail when there is no usable checkpoint, then
+        record a fresh one. Only the last RESYNC_WINDOW_DAYS days are reconciled, so the
+        Gmail calls stay bounded however much mail a backfill stored: Gmail messages in the
+        window that are unknown get stored, known ones get their labels refreshed, and
+        stored emails in the window Gmail no longer has are deleted. A mailbox with nothing
+        stored yet just gets its newest messages (older mail comes from a backfill).
+        """
+        # Take the checkpoint before listing so changes made during the sync are replayed next time
+        profile = await gmail_limiter.execute(
+            user_id, "getProfile",
+            lambda: service.users().getProfile(userId='me').execute()
+        )
+
+        await email_service.remember_own_address(user_id, profile.get('emailAddress'))
+
+        if not await self.email_collection.find_one({"user_id": user_id}, {"_id": 1}):
+            result = await email_service.fetch_emails(user_id)
+            if result.get("success"):
+                await self._save_checkpoint(user_id, profile.get('historyId'), "full")
+                result["mode"] = "full"
+            return result
+
+        window_start = datetime.now() - timedelta(days=settings.RESYNC_WINDOW_DAYS)
+        # Snapshot before listing: emails stored meanwhile (a backfill) are never taken for deleted
+        stored = {
+            doc["message_id"]: doc
+            async for doc in self.email_collection.find(
+                {"user_id": user_id, "timestamp": {"$gte": window_start}},
+                {"message_id": 1, "labels": 1}
+            )
+        }
+        gmail_ids = await self._list_message_ids(user_id, service, after=window_start)
+        listed = set(gmail_ids)
+
+        new_ids = [message_id for message_id in gmail_ids if message_id not in stored]
+        processed = await email_service._store_new_messages(user_id, service, new_ids)
+
+        # Labels are re-read for every known message in the window; only the ones that changed
+        # are written. Stored emails missing from the listing are asked for too: the ones Gmail
+        # no longer returns are gone, so a loose date filter can never delete mail that still exists
+        known_ids = [message_id for message_id in gmail_ids if message_id in stored]
+        unlisted = [message_id for message_id in stored if message_id not in listed]
+        found = await email_service._get_messages(
+            user_id, service, known_ids + unlisted, message_format='minimal'
+        )
+        labels = {}
+        for msg in found:
+            label_ids = msg.get('labelIds', [])
+            if set(label_ids) != set(stored[msg['id']].get("labels") or []):
+                labels[msg['id']] = label_ids
+        updated, deltas, touched_threads = await self._apply_labels(user_id, labels)
+
+        still_there = {msg['id'] for msg in found}
+        gone = [message_id for message_id in unlisted if message_id not in still_there]
+        removed, removed_deltas, removed_threads = await self._remove_messages(user_id, gone)
+        deltas.extend(removed_deltas)
+        touched_threads.update(removed_threads)
+
+        await mailbox_counters.apply(user_id, merge_deltas(deltas))
+        await thread_store.refresh(user_id, touched_threads)
+        if labels or gone:
+            email_service._invalidate_counts(user_id)
+
+        await self._save_checkpoint(user_id, profile.get('historyId'), "full")
+
+        return {
+            "success": True,
+            "mode": "full",
+            "processed": processed,
+            "total": len(gmail_ids),
+            "updated": updated,
+            "deleted": removed
+        }
+
+    async def _list_message_ids(self, user_id: str, service, after: datetime) -> List[str]:
+        """Ids of every Gmail message (trash and spam included) received after the given time"""
+        message_ids = []
+        page_token = None
+        # Stored timestamps come from internalDate via fromtimestamp, so this is the same epoch
+        query = f"after:{int(after.timestamp()) - 1}"
+
+        while True:
+            response = await gmail_limiter.execute(
+                user_id, "messages.list",
+                lambda: service.users().messages().list(
+                    userId='me',
+                    q=query,
+                    includeSpamTrash=True,
+                    maxResults=RESYNC_PAGE_SIZE,
+                    pageToken=page_token
+                ).execute()
+            )
+            message_ids.extend(message['id'] for message in response.get('messages', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return message_ids
+
+    async def _incremental_sync(self, user_id: str, service, start_history_id: str) -> Dict:
+        """Apply only the changes Gmail recorded since the checkpoint"""
+        records, latest_history_id = await self._list_history(user_id, service, start_history_id)
+        added, deleted, labels = self._collapse_history(records)
+
+        processed = 0
+        if added:
+            processed = await email_service._store_new_messages(user_id, service, list(added))
+
+        updated, deltas, touched_threads = await self._apply_labels(user_id, labels)
+        removed, removed_deltas, removed_threads = await self._remove_messages(user_id, deleted)
+        deltas.extend(removed_deltas)
+        touched_threads.update(removed_threads)
+
+        await mailbox_counters.apply(user_id, merge_deltas(deltas))
+        await thread_store.refresh(user_id, touched_threads)
+
+        if labels or deleted:
+            email_service._invalidate_counts(user_id)
+
+        await self._save_checkpoint(user_id, latest_history_id, "incremental")
+
+        return {
+            "success": True,
+            "mode": "incremental",
+            "processed": processed,
+            "total": len(added),
+            "updated": updated,
+            "deleted": removed
+        }
+
+    async def _apply_labels(self, user_id: str, labels: Dict[str, List[str]]):
+        """Store Gmail's label sets; returns (updated count, counter deltas, touched thread ids)"""
+        deltas = []
+        touched_threads = set()
+        updated = 0
+        # Local changes still queued for Gmail are newer than what Gmail reports
+        pending = await label_sync_queue.pending_ids(user_id, labels)
+        label_updates = [(message_id, label_ids) for message_id, label_ids in labels.items()
+                         if message_id not in pending]
+        if label_updates:
+            async with change_feed.sequence(user_id, len(label_updates)) as first_seq:
+                for offset, (message_id, label_ids) in enumerate(label_updates):
+                    changes = {
+                        "labels": label_ids,
+                        "read": 'UNREAD' not in label_ids,
+                        "trashed": 'TRASH' in label_ids
+                    }
+                    before = await self.email_collection.find_one_and_update(
+                        {"user_id": user_id, "message_id": message_id},
+                        {"$set": {**changes, "updated_at": datetime.utcnow(), "change_seq": first_seq + offset}},
+                        return_document=ReturnDocument.BEFORE
+                    )
+                    if before:
+                        deltas.append(change_delta(before, {**before, **changes}))
+                        touched_threads.add(before.get("thread_id"))
+                        updated += 1
+        return updated, deltas, touched_threads
+
+    async def _remove_messages(self, user_id: str, message_ids):
+        """Delete emails Gmail no longer has; returns (removed count, counter deltas, touched thread ids)"""
+        message_ids = list(message_ids)
+        if not message_ids:
+            return 0, [], set()
+
+        deleted_filter = {"user_id": user_id, "message_id": {"$in": message_ids}}
+        doomed = await self.email_collection.find(
+            deleted_filter, {"message_id": 1, "read": 1, "labels": 1, "timestamp": 1, "thread_id": 1}
+        ).to_list(length=None)
+        result = await self.email_collection.delete_many(deleted_filter)
+        await body_store.delete_many(doc["_id"] for doc in doomed)
+        await label_sync_queue.discard(user_id, message_ids)
+        await change_feed.record_deleted(user_id, doomed)
+        return (
+            result.deleted_count,
+            [email_delta(doc, -1) for doc in doomed],
+            {doc.get("thread_id") for doc in doomed}
+        )
+
+    async def _list_history(self, user_id: str, service, start_history_id: str):
+        """Page through users.history.list from the checkpoint"""
+        records = []
+        page_token = None
+        latest_history_id = start_history_id
+
+        while True:
+            try:
+                response = await gmail_limiter.execute(
+                    user_id, "history.list",
+                    lambda: service.users().history().list(
+                        userId='me',
+                        startHistoryId=start_history_id,
+                        historyTypes=HISTORY_TYPES,
+                        maxResults=settings.GMAIL_HISTORY_PAGE_SIZE,
+                        pageToken=page_token
+                    ).execute()
+                )
+            except HttpError as e:
+                if e.resp.status == 404:
+                    raise HistoryExpiredError(str(e))
+                raise
+
+            records.extend(response.get('history', []))
+            latest_history_id = response.get('historyId', latest_history_id)
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return records, latest_history_id
+
+    def _collapse_history(self, records: List[Dict]):
+        """Reduce history records to final added ids, deleted ids and label sets per message"""
+        added = {}
+        deleted = set()
+        labels = {}
+
+        for record in records:
+            for change in record.get('messagesAdded', []):
+                message = change['message']
+                added[message['id']] = True
+                deleted.discard(message['id'])
+            for change in record.get('messagesDeleted', []):
+                message = change['message']
+                deleted.add(message['id'])
+                added.pop(message['id'], None)
+                labels.pop(message['id'], None)
+            for change in record.get('labelsAdded', []) + record.get('labelsRemoved', []):
+                message = change['message']
+                # The message summary carries the full label set after this change
+                if 'labelIds' in message and message['id'] not in deleted:
+                    labels[message['id']] = message['labelIds']
+
+        # New messages are stored with their current labels, so no separate update is needed
+        for message_id in added:
+            labels.pop(message_id, None)
+
+        return added, deleted, labels
+
+    async def _save_checkpoint(self, user_id: str, history_id: Optional[str], mode: str):
+        if not history_id:
+            return
+        await self.sync_state_collection.update_one(
+            {"user_id": user_id},
+            {"$set": {
+                "history_id": str(history_id),
+                "last_sync_mode": mode,
+                "last_synced_at": datetime.utcnow()
+            }},
+            upsert=True
+        )
+
+    async def seed_checkpoint(self, user_id: str, history_id: Optional[str]):
+        """Record a checkpoint only if the user has none yet"""
+        if not history_id:
+            return
+        # The state document may already exist without a checkpoint (it also caches the
+        # user's address); an existing checkpoint makes the upsert collide and is kept
+        try:
+            await self.sync_state_collection.update_one(
+                {"user_id": user_id, "history_id": None},
+                {"$set": {
+                    "history_id": str(history_id),
+                    "last_sync_mode": "backfill",
+                    "last_synced_at": datetime.utcnow()
+                }},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            pass
+
+    async def reset_checkpoint(self, user_id: str):
+        """Forget the checkpoint so the next sync is a full resync"""
+        await self.sync_state_collection.update_one(
+            {"user_id": user_id},
+            {"$unset": {"history_id": "", "last_sync_mode": ""}}
+        )
+
+
+sync_service = SyncService()
@@ -0,0 +1,103 @@
+from pymongo import ReplaceOne
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from db.mongodb import get_email_collection, get_thread_collection, get_sync_state_collection
+
+
+class ThreadStore:
+    """
+    Materialized conversation threads, one document per (user_id, thread_id).
+    Every write path hands over the thread ids it touched and only those threads
+    are recomputed from their emails (an indexed, per-thread query), so label
+    changes and deletes can never leave a thread summary drifting.
+    """
+
+    def __init__(self):
+        self.email_collection = get_email_collection()
+        self.thread_collection = get_thread_collection()
+        self.sync_state_collection = get_sync_state_collection()
+
+    async def refresh(self, user_id: str, thread_ids: Iterable[Optional[str]]):
+        """Recompute the given threads; threads left without emails are removed"""
+        thread_ids = list({thread_id for thread_id in thread_ids if thread_id})
+        if not thread_ids:
+            return
+        try:
+            summaries = await self._summarize(user_id, {"thread_id": {"$in": thread_ids}})
+            await self._replace(user_id, summaries)
+
+            emptied = set(thread_ids) - {summary["thread_id"] for summary in summaries}
+            if emptied:
+                await self.thread_collection.delete_many(
+                    {"user_id": user_id, "thread_id": {"$in": list(emptied)}}
+                )
+        except Exception as e:
+            print(f"Error refreshing threads for user {user_id}: {str(e)}")
+
+    async def rebuild(self, user_id: str):
+        """Build every thread of a mailbox (first use for emails stored before threads existed)"""
+        summaries = await self._summarize(user_id, {"thread_id": {"$ne": None}})
+        await self._replace(user_id, summaries)
+        await self.sync_state_collection.update_one(
+            {"user_id": user_id},
+            {"$set": {"threads_built_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    async def ensure_built(self, user_id: str):
+        state = await self.sync_state_collection.find_one({"user_id": user_id}, {"threads_built_at": 1})
+        if not state or not state.get("threads_built_at"):
+            await self.rebuild(user_id)
+
+    async def _summarize(self, user_id: str, match: Dict) -> List[Dict]:
+        pipeline = [
+            {"$match": {"user_id": user_id, **match}},
+            {"$sort": {"timestamp": 1}},
+            {"$group": {
+                "_id": "$thread_id",
+                "subject": {"$first": "$subject"},
+                "senders": {"$push": "$sender"},
+                "message_ids": {"$push": "$message_id"},
+                "labels": {"$push": "$labels"},
+                "message_count": {"$sum": 1},
+                "unread_count": {"$sum": {"$cond": [{"$eq": ["$read", False]}, 1, 0]}},
+                "first_message_at": {"$first": "$timestamp"},
+                "last_message_at": {"$last": "$timestamp"},
+                "snippet": {"$last": "$snippet"},
+                "last_sender": {"$last": "$sender"}
+            }}
+        ]
+        groups = await self.email_collection.aggregate(pipeline).to_list(length=None)
+
+        now = datetime.utcnow()
+        return [
+            {
+                "user_id": user_id,
+                "thread_id": group["_id"],
+                "subject": group["subject"],
+                # Senders in order of first appearance
+                "participants": list(dict.fromkeys(group["senders"])),
+                "last_sender": group["last_sender"],
+                "message_ids": group["message_ids"],
+                "labels": sorted({label for labels in group["labels"] for label in labels or []}),
+                "message_count": group["message_count"],
+                "unread_count": group["unread_count"],
+                "first_message_at": group["first_message_at"],
+                "last_message_at": group["last_message_at"],
+                "snippet": group["snippet"],
+                "updated_at": now
+            }
+            for group in groups
+        ]
+
+    async def _replace(self, user_id: str, summaries: List[Dict]):
+        if not summaries:
+            return
+        # replace_one keeps the document _id, so keyset cursors stay valid across refreshes
+        await self.thread_collection.bulk_write([
+            ReplaceOne({"user_id": user_id, "thread_id": summary["thread_id"]}, summary, upsert=True)
+            for summary in summaries
+        ], ordered=False)
+
+
+thread_store = ThreadStore()
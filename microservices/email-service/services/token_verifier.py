@@ -0,0 +1,98 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from jose import jwt, JWTError
+from services.user_service_client import user_service_client
+from config import settings
+import hashlib
+
+# Only user-session tokens carry this type; service-to-service tokens (which also have sub and
+# user_id) carry an audience instead, and jose rejects those when no audience is given
+ACCESS_TOKEN_TYPE = "access"
+
+
+class TokenVerifier:
+    """
+    Verifies user-service JWTs locally with the shared SECRET_KEY and keeps the
+    verified claims in a small TTL/LRU cache, so authenticated requests need no
+    network round trip. user-service is still asked whether the user exists
+    (its revocation check), but only once per user per
+    TOKEN_REVOCATION_CHECK_INTERVAL, and always without blocking the event loop.
+    """
+
+    def __init__(self, ttl_seconds: int = 60, max_size: int = 10000, revocation_interval: int = 300):
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.max_size = max_size
+        self.revocation_interval = timedelta(seconds=revocation_interval)
+        self._claims: "OrderedDict[str, tuple]" = OrderedDict()
+        self._active_users: Dict[str, datetime] = {}
+
+    @staticmethod
+    def _cache_key(token: str) -> str:
+        # Never keep raw bearer tokens as dict keys
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    async def verify(self, token: str) -> Optional[Dict]:
+        """User data ({"email", "user_id"}) for a valid token, None otherwise"""
+        key = self._cache_key(token)
+        now = datetime.utcnow()
+
+        cached = self._claims.get(key)
+        if cached and cached[1] > now:
+            self._claims.move_to_end(key)
+            return cached[0]
+        self._claims.pop(key, None)
+
+        try:
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        except JWTError as e:
+            print(f"Token rejected: {str(e)}")
+            return None
+
+        if payload.get("type") != ACCESS_TOKEN_TYPE or "event" in payload:
+            print("Token rejected: not a user access token")
+            return None
+
+        email, user_id = payload.get("sub"), payload.get("user_id")
+        if email is None or user_id is None:
+            return None
+
+        if not await self._user_active(user_id, token, now):
+            return None
+
+        user = {"email": email, "user_id": user_id}
+        expires_at = now + self.ttl
+        if payload.get("exp"):
+            expires_at = min(expires_at, datetime.utcfromtimestamp(payload["exp"]))
+        self._claims[key] = (user, expires_at)
+        while len(self._claims) > self.max_size:
+            self._claims.popitem(last=False)
+        return user
+
+    async def _user_active(self, user_id: str, token: str, now: datetime) -> bool:
+        """Revocation check against user-service, at most once per interval per user"""
+        checked_at = self._active_users.get(user_id)
+        if checked_at and checked_at + self.revocation_interval > now:
+            return True
+
+        if not await user_service_client.verify_token(token):
+            self.invalidate_user(user_id)
+            return False
+
+        self._active_users[user_id] = now
+        if len(self._active_users) > self.max_size:
+            self._active_users.pop(next(iter(self._active_users)))
+        return True
+
+    def invalidate_user(self, user_id: str):
+        """Forget everything cached for a user (e.g. after logout or account deletion)"""
+        self._active_users.pop(user_id, None)
+        for key in [key for key, (user, _) in self._claims.items() if user["user_id"] == user_id]:
+            self._claims.pop(key, None)
+
+
+token_verifier = TokenVerifier(
+    ttl_seconds=settings.TOKEN_CACHE_TTL,
+    max_size=settings.TOKEN_CACHE_MAX_SIZE,
+    revocation_interval=settings.TOKEN_REVOCATION_CHECK_INTERVAL
+)
@@ -5,42 +5,75 @@
 import httpx
 from typing import Optional, Dict
 from config import settings
+import asyncio
+import time
 
 class UserServiceClient:
-    """Client for communicating with the user service"""
+    """
+    Client for communicating with the user service.
+    One pooled keep-alive AsyncClient is opened at app startup and closed on shutdown.
+    Profiles (which carry the Google token) are cached for PROFILE_CACHE_TTL seconds,
+    and concurrent lookups for the same user share a single request.
+    """
     
     def __init__(self):
         self.base_url = settings.USER_SERVICE_URL
         self.timeout = 10.0
-    
+        self._client: Optional[httpx.AsyncClient] = None
+        self._profiles: Dict[str, tuple] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Bumped on invalidation so a lookup already in flight cannot re-cache a stale profile
+        self._generations: Dict[str, int] = {}
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=settings.USER_SERVICE_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.USER_SERVICE_KEEPALIVE_CONNECTIONS
+                )
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _http(self) -> httpx.AsyncClient:
+        # Scripts and benchmarks may use the client without the app's startup hook
+        if self._client is None:
+            await self.start()
+        return self._client
+
+    def invalidate_profile(self, user_id: str):
+        """Drop the cached profile, e.g. after user-service refreshed the user's Google token"""
+        self._profiles.pop(user_id, None)
+        self._inflight.pop(user_id, None)
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
 
-    # #need to be  async
-    async def verify_token(self, token: str) -> Optional[Dict]:  # NOT async
-        """Verify user token with user service"""
+    async def verify_token(self, token: str) -> Optional[Dict]:
+        """Verify user token with user service (also confirms the user still exists)"""
         print(f"Verifying token with user service at: {self.base_url}")
         
-        # Using synchronous httpx client
-        with httpx.Client(timeout=self.timeout) as client:
-            try:
-                response = client.post(  # No 'await' needed
-                    f"http://user-service:8000/auth/verify",
-                    json={"token": token}
-                )
-                
-                print(f"User service response status: {response.status_code}")
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    print(f"Token verification result: {result}")
-                    if result.get("valid"):
-                        return result.get("user")
-                
-                print(f"Token verification failed: {response.text}")
-                return None
-                
-            except httpx.RequestError as e:
-                print(f"Error verifying token with user service: {str(e)}")
-                return None
+        client = await self._http()
+        try:
+            response = await client.post("/auth/verify", json={"token": token})
+            
+            print(f"User service response status: {response.status_code}")
+            
+            if response.status_code == 200:
+                result = response.json()
+                if result.get("valid"):
+                    return result.get("user")
+            
+            print(f"Token verification failed: {response.text}")
+            return None
+            
+        except httpx.RequestError as e:
+            print(f"Error verifying token with user service: {str(e)}")
+            return None
 
     
 
@@ -68,35 +101,55 @@ class UserServiceClient:
 
     
     async def get_user_profile(self, user_id: str) -> Optional[Dict]:  #  async
-        """Get user profile including Google tokens from user service"""
+        """Get user profile including Google tokens from user service (cached, single-flight)"""
+        cached = self._profiles.get(user_id)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+
+        pending = self._inflight.get(user_id)
+        if pending is None:
+            pending = asyncio.ensure_future(self._fetch_profile(user_id))
+            self._inflight[user_id] = pending
+            pending.add_done_callback(
+                lambda done: self._inflight.pop(user_id, None) if self._inflight.get(user_id) is done else None
+            )
+        # shield: one caller being cancelled must not cancel the lookup the others wait on
+        return await asyncio.shield(pending)
+
+    async def _fetch_profile(self, user_id: str) -> Optional[Dict]:
         print(f"Getting user profile for user_id: {user_id}")
+        generation = self._generations.get(user_id, 0)
 
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            try:
-                response = await client.get(f"http://user-service:8000/auth/user/{user_id}")
-                
-                print(f"User profile response status: {response.status_code}")
-                
-                if response.status_code == 200:
-                    profile = response.json()
-                    print(f"User profile retrieved, has google_token: {'google_token' in profile}")
-                    return profile
-                    
-                print(f"Failed to get user profile: {response.text}")
-                return None
+        client = await self._http()
+        try:
+            response = await client.get(f"/auth/user/{user_id}")
+            
+            print(f"User profile response status: {response.status_code}")
+            
+            if response.status_code == 200:
+                profile = response.json()
+                print(f"User profile retrieved, has google_token: {'google_token' in profile}")
+                if self._generations.get(user_id, 0) == generation:
+                    self._profiles[user_id] = (profile, time.monotonic() + settings.PROFILE_CACHE_TTL)
+                    if len(self._profiles) > settings.PROFILE_CACHE_MAX_USERS:
+                        self._profiles.pop(next(iter(self._profiles)))
+                return profile
                 
-            except httpx.RequestError as e:
-                print(f"Error getting user profile from user service: {str(e)}")
-                return None
+            print(f"Failed to get user profile: {response.text}")
+            return None
+            
+        except httpx.RequestError as e:
+            print(f"Error getting user profile from user service: {str(e)}")
+            return None
     
-    def health_check(self) -> bool:  # NOT async
+    async def health_check(self) -> bool:
         """Check if user service is healthy"""
-        with httpx.Client(timeout=5.0) as client:
-            try:
-                response = client.get(f"http://user-service:8000/health")
-                return response.status_code == 200
-            except httpx.RequestError:
-                return False
+        client = await self._http()
+        try:
+            response = await client.get("/health", timeout=5.0)
+            return response.status_code == 200
+        except httpx.RequestError:
+            return False
 
 # Global instance
 user_service_client = UserServiceClient()
@@ -0,0 +1,11 @@
+import axios from 'axios';
+
+// List pages leave bodies out; an opened or forwarded email loads its full version by id.
+export async function fetchEmail(emailId) {
+  const res = await axios.get(`http://localhost:8000/api/emails/${emailId}`, {
+    headers: {
+      Authorization: `Bearer ${localStorage.getItem('authToken')}`,
+    },
+  });
+  return res.data;
+}
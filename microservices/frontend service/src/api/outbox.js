@@ -0,0 +1,22 @@
+import axios from 'axios';
+
+// Statuses after which an outbox job never changes again
+const FINAL_STATUSES = ['sent', 'failed'];
+
+// Send, reply and forward answer 202 with an outbox job; poll it until it is sent or failed.
+// Resolves with the last job seen (still "queued"/"retrying" if it did not finish in time).
+export async function waitForDelivery(job, { timeoutMs = 20000, intervalMs = 1000 } = {}) {
+  const deadline = Date.now() + timeoutMs;
+  let current = job;
+
+  while (!FINAL_STATUSES.includes(current.status) && Date.now() < deadline) {
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+    const res = await axios.get(`http://localhost:8000/api/emails/outbox/${job.outbox_id}`, {
+      headers: {
+        Authorization: `Bearer ${localStorage.getItem('authToken')}`,
+      },
+    });
+    current = res.data;
+  }
+  return current;
+}
@@ -10,6 +10,7 @@ import {
   Link2
 } from 'lucide-react';
 import axios from 'axios';
+import { waitForDelivery } from '../api/outbox';
 
 export default function ComposePopup({ onClose, draft }) {
   const [to, setTo] = useState('');
@@ -26,6 +27,8 @@ export default function ComposePopup({ onClose, draft }) {
   const [loadingResponse, setLoadingResponse] = useState(false);
   const userId = localStorage.getItem('userId');
   const sendContainerRef = useRef();
+  // One key per compose window, so a retried click cannot send the email twice
+  const idempotencyKey = useRef(crypto.randomUUID());
   const isEditing = !!draft;
 
   useEffect(() => {
@@ -72,8 +75,8 @@ export default function ComposePopup({ onClose, draft }) {
         }
         alert('Draft saved.');
       } else if (sendAction === 'Send') {
-        // ✅ NEW EMAIL SEND
-        await axios.post(
+        // ✅ NEW EMAIL SEND (queued by the server; wait for the outcome)
+        const res = await axios.post(
           `http://localhost:8000/api/emails/send`,
           {
             subject,
@@ -83,10 +86,19 @@ export default function ComposePopup({ onClose, draft }) {
           {
             headers: {
               Authorization: `Bearer ${localStorage.getItem('authToken')}`,
+              'Idempotency-Key': idempotencyKey.current,
             },
           }
         );
-        alert('Email sent!');
+        const job = await waitForDelivery(res.data);
+        if (job.status === 'failed') {
+          // The failed job keeps its key; a fresh one lets the user send again
+          idempotencyKey.current = crypto.randomUUID();
+          alert(`Sending failed: ${job.error || 'unknown error'}`);
+          setShowSendOptions(false);
+          return;
+        }
+        alert(job.status === 'sent' ? 'Email sent!' : 'Email queued, it will be sent shortly.');
       } else if (sendAction === 'Schedule') {
         console.log('Schedule feature coming soon...');
       }
@@ -211,7 +211,7 @@ export default function EmailView({
 
         {/* Email Body */}
         <div className="email-body">
-          <p>{email.body || "Full message content goes here..."}</p>
+          <p>{email.body ?? email.snippet ?? "Loading message..."}</p>
         </div>
 
         {/* Reply/Forward/Edit Buttons */}
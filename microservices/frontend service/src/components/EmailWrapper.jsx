@@ -2,6 +2,7 @@ import React, { useState } from 'react';
 import EmailList from './EmailList';
 import EmailView from './EmailView';
 import ComposePopup from './ComposePopup';
+import { fetchEmail } from '../api/emails';
 import './styles/EmailWrapper.css';
 
 // Centralized config for mailbox type logic
@@ -129,6 +130,17 @@ export default function EmailWrapper({ emails: initialEmails = [], type }) {
         if (selectedEmail && selectedEmail.id === id) setSelectedEmail(null);
     };
 
+    // List items have no body: load the full email and show it if it is still the one open
+    const openEmail = async (email) => {
+        if (email.body !== undefined) return;
+        try {
+            const full = await fetchEmail(email.id);
+            setSelectedEmail(prev => (prev && prev.id === email.id ? { ...prev, body: full.body } : prev));
+        } catch (err) {
+            console.error('Failed to load email:', err);
+        }
+    };
+
     // Filter emails based on type
     let filteredEmails = emails;
     if (type === 'inbox') {
@@ -154,6 +166,7 @@ export default function EmailWrapper({ emails: initialEmails = [], type }) {
                 setComposeDraft(email);
             } else {
                 setSelectedEmail(email);
+                openEmail(email);
             }
         },
     };
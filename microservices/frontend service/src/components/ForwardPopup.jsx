@@ -1,12 +1,27 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import {
   Send, Trash2, Sparkles, Paperclip, Smile, Image, Link, Calendar
 } from 'lucide-react';
+import { fetchEmail } from '../api/emails';
 import './styles/ForwardPopup.css';
 
 export default function ForwardPopup({ originalEmail, onClose, onSend }) {
   const [to, setTo] = useState('');
   const [message, setMessage] = useState('');
+  const [originalBody, setOriginalBody] = useState(originalEmail.body);
+
+  // Opened from a list item whose body has not loaded yet
+  useEffect(() => {
+    if (originalEmail.body !== undefined) {
+      setOriginalBody(originalEmail.body);
+      return;
+    }
+    let cancelled = false;
+    fetchEmail(originalEmail.id)
+      .then((full) => { if (!cancelled) setOriginalBody(full.body); })
+      .catch((err) => console.error('Failed to load forwarded email:', err));
+    return () => { cancelled = true; };
+  }, [originalEmail.id, originalEmail.body]);
 
   const handleSend = () => {
     onSend?.({ to, message });
@@ -40,7 +55,7 @@ export default function ForwardPopup({ originalEmail, onClose, onSend }) {
           <p><strong>Date:</strong> {originalEmail.date}</p>
           <p><strong>Subject:</strong> {originalEmail.subject}</p>
           <p><strong>To:</strong> me</p>
-          <div style={{ whiteSpace: 'pre-wrap', marginTop: '0.5rem' }}>{originalEmail.body}</div>
+          <div style={{ whiteSpace: 'pre-wrap', marginTop: '0.5rem' }}>{originalBody}</div>
         </div>
       </div>
 
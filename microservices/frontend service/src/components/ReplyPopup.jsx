@@ -1,19 +1,22 @@
-import React, { useState } from 'react';
+import React, { useState, useRef } from 'react';
 import {
   Send, Trash2, Sparkles, Paperclip, Smile, Image, Link, Calendar
 } from 'lucide-react';
 import './styles/ReplyPopup.css';
 import axios from 'axios';
+import { waitForDelivery } from '../api/outbox';
 
 export default function ReplyPopup({ recipient, emailId, userId, originalBody, onClose }) {
   const [message, setMessage] = useState('');
   const [loading, setLoading] = useState(false);
   const [aiError, setAiError] = useState('');
+  // One key per reply window, so a retried click cannot send the reply twice
+  const idempotencyKey = useRef(crypto.randomUUID());
 
   const handleSend = async () => {
     try {
       const token = localStorage.getItem('authToken');
-      await axios.post(
+      const res = await axios.post(
         `http://localhost:8000/api/emails/${emailId}/reply`,
         { reply_body: message,
         reply_to_all:false,
@@ -21,10 +24,22 @@ export default function ReplyPopup({ recipient, emailId, userId, originalBody, o
         additional_bcc: '' },
         {
           headers: {
-            Authorization: `Bearer ${token}`
+            Authorization: `Bearer ${token}`,
+            'Idempotency-Key': idempotencyKey.current
           }
         }
       );
+      // The reply is queued by the server; wait for the outcome
+      const job = await waitForDelivery(res.data);
+      if (job.status === 'failed') {
+        // The failed job keeps its key; a fresh one lets the user send again
+        idempotencyKey.current = crypto.randomUUID();
+        alert(`Reply failed: ${job.error || 'unknown error'}`);
+        return;
+      }
+      if (job.status !== 'sent') {
+        alert('Reply queued, it will be sent shortly.');
+      }
       onClose?.();
     } catch (err) {
       console.error('Failed to send reply:', err);
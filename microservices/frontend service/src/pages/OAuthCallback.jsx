@@ -30,8 +30,8 @@ export default function OAuthCallback() {
 
         if (!fetchRes.ok) throw new Error('Failed to fetch Gmail emails');
 
-        // Step 2: Fetch recent sent emails
-        const emailRes = await fetch('http://localhost:8000/api/emails?limit=50&type=sent', {
+        // Step 2: Fetch recent sent emails (list pages leave bodies out unless asked)
+        const emailRes = await fetch('http://localhost:8000/api/emails?limit=50&type=sent&include_body=true', {
           headers: {
             Authorization: `Bearer ${token}`,
           },
@@ -23,6 +23,8 @@ class Settings(BaseSettings):
 
     
     USER_SERVICE_URL: str = os.getenv("USER_SERVICE_URL", "http://user-service:8000")
+    # Notified when a user's Google token is replaced, so its cached copy is dropped
+    EMAIL_SERVICE_URL: str = os.getenv("EMAIL_SERVICE_URL", "http://email-service:8000")
     FRONTEND_URL: str = os.getenv("FRONTEND_URL", "http://localhost:5173")
 
 settings = Settings()
\ No newline at end of file
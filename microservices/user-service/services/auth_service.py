@@ -1,6 +1,5 @@
 from google_auth_oauthlib.flow import Flow
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 from google.auth.transport.requests import Request
 from datetime import datetime, timedelta
 from jose import jwt, JWTError
@@ -9,6 +8,8 @@ from config import settings
 import asyncio 
 
 from db.mongodb import get_user_collection
+from services.google_discovery import build_oauth2_client
+from services.notifications import notify_google_token_refreshed
 
 
 SCOPES = [
@@ -77,6 +78,7 @@ async def exchange_code_for_token(code, state):
             }
         )
         user_id = str(existing_user["_id"])
+        await notify_google_token_refreshed(user_id)
     else:
         user_data = {
             "email": user_info["email"],
@@ -100,7 +102,7 @@ async def exchange_code_for_token(code, state):
 async def get_user_info(credentials):
     """Get user info from Google (non-blocking using to_thread)"""
     def fetch_userinfo():
-        service = build('oauth2', 'v2', credentials=credentials)
+        service = build_oauth2_client(credentials=credentials)
         return service.userinfo().get().execute()
 
     user_info = await asyncio.to_thread(fetch_userinfo)
@@ -112,7 +114,8 @@ def create_access_token(data: dict):
     """Create JWT access token"""
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    # Services only accept "access" tokens as user sessions
+    to_encode.update({"exp": expire, "type": "access"})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
@@ -278,6 +281,7 @@ async def refresh_token(token: str):
                 {"$set": {"google_token": updated_token_info}}
             )
             print("[DEBUG] Updated Google token in database")
+            await notify_google_token_refreshed(user_id)
         
         # Create new JWT token
         new_access_token = create_access_token(
@@ -0,0 +1,30 @@
+from googleapiclient.discovery import build_from_document
+from typing import Dict
+import json
+import os
+import threading
+
+# Vendored, version-pinned discovery documents live next to the service code
+DISCOVERY_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "discovery")
+
+_documents: Dict[str, Dict] = {}
+_lock = threading.Lock()
+
+
+def get_discovery_document(api: str, version: str) -> Dict:
+    """Parsed discovery document, read from disk once per process"""
+    key = f"{api}.{version}"
+    document = _documents.get(key)
+    if document is None:
+        with _lock:
+            document = _documents.get(key)
+            if document is None:
+                with open(os.path.join(DISCOVERY_DIR, f"{key}.json"), "r", encoding="utf-8") as f:
+                    document = json.load(f)
+                _documents[key] = document
+    return document
+
+
+def build_oauth2_client(**kwargs):
+    """Build an OAuth2 v2 client from the in-memory template (no network, no JSON parsing)"""
+    return build_from_document(get_discovery_document("oauth2", "v2"), **kwargs)
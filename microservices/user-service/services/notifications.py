@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta
+from jose import jwt
+from config import settings
+import httpx
+
+TOKEN_REFRESHED_EVENT = "google_token_refreshed"
+# Audience of service-to-service tokens; user-session checks reject any token carrying one
+INTERNAL_AUDIENCE = "email-service-internal"
+
+
+async def notify_google_token_refreshed(user_id: str):
+    """
+    Tell email-service that the user's Google token changed, so it drops the
+    cached profile and Gmail client. Best effort: email-service's profile cache
+    expires on its own, so a failed notification only delays the switch.
+    """
+    service_token = jwt.encode(
+        {
+            "sub": "user-service",
+            "aud": INTERNAL_AUDIENCE,
+            "user_id": user_id,
+            "event": TOKEN_REFRESHED_EVENT,
+            "exp": datetime.utcnow() + timedelta(minutes=1)
+        },
+        settings.SECRET_KEY,
+        algorithm=settings.ALGORITHM
+    )
+    try:
+        async with httpx.AsyncClient(timeout=2.0) as client:
+            await client.post(
+                f"{settings.EMAIL_SERVICE_URL}/internal/users/{user_id}/token-refreshed",
+                headers={"Authorization": f"Bearer {service_token}"}
+            )
+    except httpx.HTTPError as e:
+        print(f"Could not notify email-service of token refresh for user {user_id}: {str(e)}")